@@ -1,8 +1,12 @@
+import copy
 from dataclasses import dataclass, field
 from .state import Stage
 
 SUPPORTED_LANGS = ["it","en","fr","es","ar","hi","ur","bn","wo"]
 
+# Campi salvati in users/{phone}
+PERSISTED_FIELDS = ("lang", "name", "client_type", "state", "asked_name", "slots", "history", "summary")
+
 @dataclass
 class Context:
     phone:str
@@ -14,6 +18,32 @@ class Context:
     stage:str="DISCOVERY"   # Stage tracking
     asked_name:bool=False   # ← default
     slots:dict[str,str]=field(default_factory=dict)   # generic slot bag
-    history:list[dict]=field(default_factory=list)    # last N messages
+    history:list[dict]=field(default_factory=list)    # last N messages (see agents.history)
+    summary:str=""          # rolling summary of the archived messages
     rag_chunks:list[str]=field(default_factory=list)  # RAG retrieved chunks
-    clarify_count:int=0     # Counter per loop detection 
\ No newline at end of file
+    clarify_count:int=0     # Counter per loop detection
+    # Dirty tracking: persisted fields as last loaded/saved (None = never saved)
+    _saved:dict|None=field(default=None, repr=False, compare=False)
+    # Snapshot handed to the write-behind queue, not committed yet (baseline of the next delta)
+    _queued:dict|None=field(default=None, repr=False, compare=False)
+
+    def snapshot(self) -> dict:
+        """Deep copy of the persisted fields"""
+        return copy.deepcopy({name: getattr(self, name) for name in PERSISTED_FIELDS})
+
+    def mark_saved(self, snapshot: dict | None = None):
+        """Record the persisted state (after load or once a queued write is committed)"""
+        self._saved = snapshot if snapshot is not None else self.snapshot()
+        if snapshot is None or snapshot is self._queued:
+            self._queued = None
+
+    def mark_queued(self, snapshot: dict):
+        """Record a snapshot queued for writing (saved only once committed)"""
+        self._queued = snapshot
+
+    def dirty_fields(self) -> dict:
+        """Persisted fields changed since mark_saved (all of them if never saved)"""
+        current = self.snapshot()
+        if self._saved is None:
+            return current
+        return {name: value for name, value in current.items() if value != self._saved.get(name)}
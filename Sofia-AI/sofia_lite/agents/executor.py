@@ -3,7 +3,8 @@ from .context import Context
 from importlib import import_module
 from ..utils.name_extract import extract_name
 from ..middleware.memory import save_context
-from ..policy.guardrails import is_inappropriate, abuse_reply, warning_reply
+from ..policy.guardrails import abuse_reply, warning_reply
+from .features import features_for
 
 log = logging.getLogger("sofia.executor")
 _ROUTE = {          # intent → skill module
@@ -28,7 +29,7 @@ def dispatch(intent, ctx, text):
     log.info(f"📊 Context: name={ctx.name}, lang={ctx.lang}, client_type={ctx.client_type}")
     
     # Check for inappropriate content first
-    if is_inappropriate(text):
+    if features_for(text, ctx).inappropriate:
         log.warning(f"⚠️ Inappropriate content detected: {text}")
         abuse_count = ctx.slots.get("abuse_count", 0)
         if abuse_count >= 1:
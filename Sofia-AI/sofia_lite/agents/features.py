@@ -0,0 +1,101 @@
+"""
+Sofia Lite - Turn features
+Preprocessing del messaggio una sola volta per turno: testo normalizzato, token,
+scrittura, flag saluto/presentazione, lingua e guardrail. Orchestrator, planner,
+executor e skill leggono lo stesso oggetto invece di rifare lower() e scansioni.
+"""
+
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, FrozenSet, Optional, Tuple
+
+from ..policy.guardrails import scan
+from ..utils.name_extract import detect_script
+
+log = logging.getLogger("sofia.features")
+
+# Saluti che forzano GREET ovunque compaiano (planner.plan)
+FORCED_GREET_WORDS = ("ciao", "hello", "buongiorno", "salve", "bonjour", "hola")
+# Saluti e frasi di presentazione dell'euristica rapida (classify_intent)
+GREETING_WORDS = ("ciao", "salve", "buongiorno", "buonasera", "hello", "hi", "bonjour", "hola")
+NAME_PHRASES = ("mi chiamo", "my name is", "je m'appelle", "me llamo")
+
+@dataclass
+class TurnFeatures:
+    """
+    Everything derived from one user message. Text features are computed on
+    creation; language and guardrails on first use, then reused by every stage.
+    The lazy ones are memoized under a per-instance lock (cached_property on
+    3.11 would serialize every turn on one class-wide lock).
+    """
+    text: str
+    ctx: Any = field(default=None, repr=False, compare=False)
+    normalized: str = field(init=False)
+    tokens: Tuple[str, ...] = field(init=False)
+    first_word: str = field(init=False)
+    script: Optional[str] = field(init=False)
+    forced_greet: bool = field(init=False)
+    greeting: bool = field(init=False)
+    name_phrase: bool = field(init=False)
+    _language: Optional[Tuple[str, Optional[str]]] = field(default=None, init=False, repr=False, compare=False)
+    _guardrails: Optional[FrozenSet[str]] = field(default=None, init=False, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.tokens = tuple(self.text.lower().split())
+        self.normalized = " ".join(self.tokens)
+        self.first_word = self.tokens[0] if self.tokens else ""
+        self.script = detect_script(self.text)
+        self.forced_greet = any(word in self.normalized for word in FORCED_GREET_WORDS)
+        self.greeting = any(word in self.normalized for word in GREETING_WORDS)
+        self.name_phrase = any(phrase in self.normalized for phrase in NAME_PHRASES)
+
+    @property
+    def language(self) -> Tuple[str, Optional[str]]:
+        """(lang, extra_tag) from detect_lang_with_heuristics: the sticky language moves once per turn"""
+        if self._language is None:
+            with self._lock:
+                if self._language is None:
+                    from ..middleware.language import detect_lang_with_heuristics
+                    self._language = detect_lang_with_heuristics(self.text, self.ctx)
+        return self._language
+
+    @property
+    def lang(self) -> str:
+        return self.language[0]
+
+    @property
+    def guardrails(self) -> FrozenSet[str]:
+        """Guardrail categories matched by the message"""
+        if self._guardrails is None:
+            with self._lock:
+                if self._guardrails is None:
+                    self._guardrails = scan(self.text)
+        return self._guardrails
+
+    @property
+    def inappropriate(self) -> bool:
+        return bool(self.guardrails)
+
+_CURRENT: contextvars.ContextVar[Optional[TurnFeatures]] = \
+    contextvars.ContextVar("sofia_turn_features", default=None)
+
+@contextmanager
+def turn_features(text: str, ctx=None):
+    """Scope of one turn: features_for(text) returns the same object inside it"""
+    features = TurnFeatures(text, ctx)
+    token = _CURRENT.set(features)
+    try:
+        yield features
+    finally:
+        _CURRENT.reset(token)
+
+def features_for(text: str, ctx=None) -> TurnFeatures:
+    """Features of the current turn when text is its message, else computed now"""
+    current = _CURRENT.get()
+    if current is not None and current.text == text and (ctx is None or current.ctx is ctx):
+        return current
+    return TurnFeatures(text, ctx)
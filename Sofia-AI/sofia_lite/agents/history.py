@@ -0,0 +1,54 @@
+"""
+Sofia Lite - History retention
+Ultimi K messaggi inline in users/{phone}, i più vecchi vanno in archivio
+e in un riassunto estrattivo rolling usato dal prompt builder.
+"""
+
+import logging
+import os
+from typing import List
+
+from .context import Context
+
+log = logging.getLogger("sofia.history")
+
+# Messaggi tenuti inline nel documento utente (2 per turno: user + assistant)
+HISTORY_MAX_MESSAGES = int(os.getenv("SOFIA_HISTORY_MAX_MESSAGES", "20"))
+# Messaggi oltre il limite prima di archiviare: la history si riscrive una volta ogni N messaggi
+# e nel frattempo resta un append (ArrayUnion)
+HISTORY_ARCHIVE_CHUNK = int(os.getenv("SOFIA_HISTORY_ARCHIVE_CHUNK", "10"))
+# Limite del riassunto rolling (caratteri)
+SUMMARY_MAX_CHARS = int(os.getenv("SOFIA_HISTORY_SUMMARY_CHARS", "600"))
+SUMMARY_LINE_CHARS = 120
+
+def _summary_line(message: dict) -> str:
+    text = " ".join(str(message.get("text", "")).split())
+    if len(text) > SUMMARY_LINE_CHARS:
+        text = text[:SUMMARY_LINE_CHARS - 1] + "…"
+    return f"- {text}"
+
+def summarize(previous: str, messages: List[dict], max_chars: int = SUMMARY_MAX_CHARS) -> str:
+    """
+    Fold archived messages into the rolling summary: one line per user
+    message, oldest lines dropped first to stay within max_chars.
+    """
+    lines = [line for line in previous.splitlines() if line]
+    lines += [_summary_line(m) for m in messages
+              if isinstance(m, dict) and m.get("role", "user") == "user" and m.get("text")]
+    while lines and len("\n".join(lines)) > max_chars:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def compact_history(ctx: Context) -> List[dict]:
+    """
+    Keep at most HISTORY_MAX_MESSAGES inline once the history grows
+    HISTORY_ARCHIVE_CHUNK past it; returns the messages moved out
+    (to be archived) after folding them into ctx.summary.
+    """
+    overflow = len(ctx.history) - HISTORY_MAX_MESSAGES
+    if overflow < HISTORY_ARCHIVE_CHUNK:
+        return []
+    archived, ctx.history = ctx.history[:overflow], ctx.history[overflow:]
+    ctx.summary = summarize(ctx.summary, archived)
+    log.info(f"🗄️ Archived {len(archived)} messages for {ctx.phone}, {len(ctx.history)} kept inline")
+    return archived
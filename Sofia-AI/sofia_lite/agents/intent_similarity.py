@@ -0,0 +1,146 @@
+"""
+Sofia Lite - Similarity Intent Classifier
+Modello caricato una sola volta + matrice di embedding degli esempi pre-calcolata.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+log = logging.getLogger("sofia.intent_similarity")
+
+MODEL_NAME = os.getenv("SOFIA_SIMILARITY_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), "..", "config", "intent_examples.json")
+# Directory opzionale dove persistere la matrice (es. /tmp/sofia-cache)
+CACHE_DIR = os.getenv("SOFIA_EMBEDDINGS_CACHE_DIR", "")
+
+Encoder = Callable[[List[str]], np.ndarray]
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so that dot product == cosine similarity"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class SimilarityClassifier:
+    """Nearest-example intent classifier over a normalized float32 matrix"""
+
+    def __init__(self, model_name: str = MODEL_NAME, examples_path: str = EXAMPLES_PATH,
+                 cache_dir: str = CACHE_DIR, encoder: Optional[Encoder] = None):
+        self.model_name = model_name
+        self.examples_path = examples_path
+        self.cache_dir = cache_dir
+        self._encoder = encoder
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.intents: List[str] = []
+        self.labels: Optional[np.ndarray] = None   # row → intent index
+        self.matrix: Optional[np.ndarray] = None   # (n_examples, dim) float32
+
+    def _get_encoder(self) -> Encoder:
+        """Load the sentence-transformers model once"""
+        if self._encoder is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(self.model_name)
+            self._encoder = lambda texts: model.encode(texts, convert_to_numpy=True)
+            log.info(f"✅ Similarity model loaded: {self.model_name}")
+        return self._encoder
+
+    def _cache_path(self, digest: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"intent_examples_{digest[:16]}.npz")
+
+    def load(self):
+        """Load model and example matrix (from disk cache when the examples file is unchanged)"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+
+            with open(self.examples_path, "rb") as f:
+                raw = f.read()
+            intent_examples = json.loads(raw.decode("utf-8"))
+            digest = hashlib.sha256(raw + self.model_name.encode()).hexdigest()
+
+            intents = [intent for intent, examples in intent_examples.items() if examples]
+            texts, labels = [], []
+            for idx, intent in enumerate(intents):
+                texts.extend(intent_examples[intent])
+                labels.extend([idx] * len(intent_examples[intent]))
+
+            encoder = self._get_encoder()
+            matrix = self._load_cached(digest, len(texts))
+            if matrix is None:
+                matrix = _normalize(encoder(texts))
+                self._save_cached(digest, matrix)
+
+            self.intents = intents
+            self.labels = np.asarray(labels, dtype=np.int32)
+            self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            self._loaded = True
+            log.info(f"✅ Similarity classifier ready: {len(texts)} examples, {len(intents)} intents")
+
+    def _load_cached(self, digest: str, n_rows: int) -> Optional[np.ndarray]:
+        path = self._cache_path(digest)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            matrix = np.load(path)["matrix"]
+            if matrix.shape[0] != n_rows:
+                return None
+            log.info(f"💾 Loaded example embeddings from {path}")
+            return matrix
+        except Exception as e:
+            log.warning(f"⚠️ Example embeddings cache unreadable: {e}")
+            return None
+
+    def _save_cached(self, digest: str, matrix: np.ndarray):
+        path = self._cache_path(digest)
+        if not path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp.npz"
+            np.savez(tmp_path, matrix=matrix)
+            os.replace(tmp_path, path)
+            log.info(f"💾 Saved example embeddings to {path}")
+        except Exception as e:
+            log.warning(f"⚠️ Could not persist example embeddings: {e}")
+
+    def classify(self, text: str) -> Tuple[str, float]:
+        """Return (best_intent, cosine_similarity) with one matrix-vector product"""
+        self.load()
+        query = _normalize(self._get_encoder()([text]))[0]
+        scores = self.matrix @ query
+        best = int(np.argmax(scores))
+        return self.intents[self.labels[best]], float(scores[best])
+
+# Singleton condiviso dal planner
+_classifier: Optional[SimilarityClassifier] = None
+_classifier_lock = threading.Lock()
+
+def get_similarity_classifier() -> SimilarityClassifier:
+    """Get or create the shared similarity classifier"""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = SimilarityClassifier()
+    return _classifier
+
+def warm_up() -> bool:
+    """Load model and example matrix ahead of the first message"""
+    try:
+        get_similarity_classifier().load()
+        return True
+    except Exception as e:
+        log.warning(f"⚠️ Similarity classifier warm-up failed: {e}")
+        return False
@@ -3,19 +3,28 @@ Sofia Lite - Core Orchestrator
 Manages conversation flow and state transitions
 """
 
+import asyncio
 import logging
-from typing import Optional, Dict, Any
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Callable
 from .context import Context
-from .planner import plan
+from .features import features_for, turn_features
+from .pipeline import STAGES, plan_stages
+from .planner import plan, aplan
 from .executor import dispatch
 from .validator import validate
 from .prompt_builder import build_system_prompt
 from ..middleware.llm import chat
-from ..middleware.memory import get_or_create_context, save_context, search_similar
+from ..middleware.memory import aget_or_create_context, context_turn, get_or_create_context, save_context, search_similar
 from ..middleware.latency import track_latency
+from ..middleware.ordering import get_phone_locks
+from ..middleware.workers import in_worker_thread, run_blocking, submit
 
 log = logging.getLogger("sofia.orchestrator")
 
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
 class Orchestrator:
     """Main orchestrator for Sofia conversation flow"""
     
@@ -25,37 +34,68 @@ class Orchestrator:
     @track_latency("TOTAL")
     def process_message(self, phone: str, message: str, channel: str = "whatsapp") -> Dict[str, Any]:
         """Process incoming message and return response - γ5 optimization with parallel execution"""
-        
+        # All saves of the turn are coalesced and written once, behind the reply
+        with context_turn():
+            return self._process_message(phone, message)
+    
+    def _process_message(self, phone: str, message: str) -> Dict[str, Any]:
         # Load or create context
         ctx = get_or_create_context(phone)
         log.info(f"📱 Context loaded/created for: {phone} (state: {ctx.state})")
         
-        # γ5 optimization: Execute language-detect, RAG retrieve, name-extract in parallel
-        import asyncio
-        import concurrent.futures
-        
-        def run_parallel_tasks():
-            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-                # Task 1: Language detection
-                lang_future = executor.submit(self._detect_language, message, ctx)
-                
-                # Task 2: RAG search
-                rag_future = executor.submit(search_similar, message, 3)
-                
-                # Task 3: Name extraction (if needed)
-                name_future = executor.submit(self._extract_name, message, ctx)
-                
-                # Wait for all tasks to complete
-                lang_result = lang_future.result()
-                rag_result = rag_future.result()
-                name_result = name_future.result()
-                
-                return lang_result, rag_result, name_result
-        
-        # Execute parallel tasks
-        lang_result, rag_result, name_result = run_parallel_tasks()
+        # Message preprocessing done once, read by every stage of the turn
+        with turn_features(message, ctx):
+            # γ5 optimization: the stages this state needs (language-detect, RAG retrieve,
+            # name-extract) run in parallel on the shared bounded pool (inline if we
+            # already are on a pool thread); the others are skipped
+            calls = self._enrichment_calls(message, ctx, phone)
+            if in_worker_thread() or len(calls) < 2:
+                results = {stage: call() for stage, call in calls.items()}
+            else:
+                futures = {stage: submit(call) for stage, call in calls.items()}
+                results = {stage: future.result() for stage, future in futures.items()}
+            
+            self._apply_enrichment(ctx, phone, results.get("lang"), results.get("rag"), results.get("name"))
+            return self._plan_and_dispatch(ctx, phone, message)
+    
+    @track_latency("TOTAL")
+    async def aprocess_message(self, phone: str, message: str, channel: str = "whatsapp") -> Dict[str, Any]:
+        """Async version of process_message: never blocks the event loop"""
+        # One turn at a time per phone: the next one loads what this one saved
+        async with get_phone_locks().hold(phone):
+            with context_turn():
+                return await self._aprocess_message(phone, message)
+    
+    async def _aprocess_message(self, phone: str, message: str) -> Dict[str, Any]:
+        # Load or create context
+        ctx = await aget_or_create_context(phone)
+        log.info(f"📱 Context loaded/created for: {phone} (state: {ctx.state})")
         
-        # Update context with results
+        # Message preprocessing done once (the pool threads see it through the context)
+        with turn_features(message, ctx):
+            # The stages this state needs run concurrently on the shared pool
+            calls = self._enrichment_calls(message, ctx, phone)
+            values = await asyncio.gather(*(run_blocking(call) for call in calls.values()))
+            results = dict(zip(calls, values))
+            
+            self._apply_enrichment(ctx, phone, results.get("lang"), results.get("rag"), results.get("name"))
+            
+            # Plan intent (hedged classification runs natively on the event loop)
+            intent, reason = await aplan(ctx, message, chat)
+            return await run_blocking(self._validate_and_dispatch, ctx, phone, message, intent, reason)
+    
+    def _enrichment_calls(self, message: str, ctx, phone: str) -> Dict[str, Callable[[], Any]]:
+        """Stage → call, only for the stages planned for this state (see pipeline.STAGE_SPEC)"""
+        stages = plan_stages(ctx)
+        calls = {
+            "lang": lambda: self._detect_language(message, ctx),
+            "rag": lambda: search_similar(message, 3, phone=phone),
+            "name": lambda: self._extract_name(message, ctx),
+        }
+        return {stage: calls[stage] for stage in STAGES if stage in stages}
+    
+    def _apply_enrichment(self, ctx, phone: str, lang_result, rag_result, name_result):
+        """Update context with language, RAG and name-extraction results"""
         if lang_result:
             ctx.lang, _ = lang_result
             log.info(f"🌍 Language detected: {ctx.lang} for {phone}")
@@ -75,12 +115,15 @@ class Orchestrator:
             # Clear any extracted name to force sequence
             ctx.extracted_name = None
             ctx.name = None
-        
-        # Build system prompt (will be updated by each skill with intent-specific prompt)
-        # system_prompt = build_system_prompt(ctx)  # REMOVED - each skill will use intent-specific prompt
-        
+    
+    def _plan_and_dispatch(self, ctx, phone: str, message: str) -> Dict[str, Any]:
+        """Plan, validate and execute the skill for an enriched context"""
         # Plan intent
         intent, reason = plan(ctx, message, chat)
+        return self._validate_and_dispatch(ctx, phone, message, intent, reason)
+    
+    def _validate_and_dispatch(self, ctx, phone: str, message: str, intent: str, reason: str) -> Dict[str, Any]:
+        """Validate the planned intent and execute its skill"""
         log.info(f"🎯 Intent detected: {intent} for {phone}")
         log.info(f"📝 Intent reason: {reason}")
         
@@ -104,7 +147,10 @@ class Orchestrator:
         log.info(f"✅ Intent validated: {intent} (conf: {confidence:.2f})")
         
         # Execute skill
+        ctx.history.append({"role": "user", "text": message, "timestamp": _now()})
         response = dispatch(intent, ctx, message)
+        ctx.history.append({"role": "assistant", "text": response, "timestamp": _now()})
+        save_context(ctx)
         return {
             "reply": response,
             "intent": intent,
@@ -116,15 +162,17 @@ class Orchestrator:
     def _detect_language(self, message: str, ctx) -> tuple[str, Optional[str]]:
         """Helper method for language detection - γ5 optimization"""
         if not ctx.lang or ctx.lang == "unknown":
-            from ..middleware.language import detect_lang_with_heuristics
-            return detect_lang_with_heuristics(message, ctx)
+            # Shared with the planner: detected once per turn
+            return features_for(message, ctx).language
         return None
     
     def _extract_name(self, message: str, ctx) -> Optional[str]:
-        """Helper method for name extraction - γ5 optimization"""
+        """Helper method for name extraction - γ5 optimization (only in states that need a name)"""
         try:
-            from ..utils.name_extract import extract_name
-            return extract_name(message, ctx.lang)
+            from ..utils.name_extract import extract_name, needs_name
+            if not needs_name(ctx):
+                return None
+            return extract_name(message, ctx)
         except Exception as e:
             log.warning(f"Name extraction failed: {e}")
             return None
@@ -134,7 +182,15 @@ class Orchestrator:
         
         # Process message normally
         result = self.process_message(phone, transcript, "voice")
-        
+        return self._voice_response(result)
+    
+    async def aprocess_voice(self, phone: str, transcript: str) -> Dict[str, Any]:
+        """Async version of process_voice"""
+        result = await self.aprocess_message(phone, transcript, "voice")
+        return self._voice_response(result)
+    
+    def _voice_response(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Wrap an orchestrator result into a TwiML response"""
         # Generate TwiML response
         twiml_response = f"""<?xml version="1.0" encoding="UTF-8"?>
 <Response>
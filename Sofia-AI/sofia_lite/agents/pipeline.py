@@ -0,0 +1,50 @@
+"""
+Sofia Lite - Enrichment pipeline spec
+Quali stadi di arricchimento servono in ogni stato prima della pianificazione:
+l'orchestrator esegue solo quelli, gli altri vengono saltati (e contati).
+"""
+
+import os
+from typing import Dict, FrozenSet
+
+from ..metrics import enrichment_stages
+
+# lang: rilevamento lingua · rag: embedding + ricerca FAISS · name: estrazione nome
+STAGES = ("lang", "rag", "name")
+
+_LANG = frozenset({"lang"})
+
+# Stato → stadi. "lang" gira comunque solo finché ctx.lang non è noto; "rag"
+# solo dove un prompt usa ctx.rag_chunks (nessun prompt per intent, oggi)
+STAGE_SPEC: Dict[str, FrozenSet[str]] = {
+    "INITIAL":           _LANG,
+    "GREETING":          _LANG,
+    "ASK_NAME":          _LANG | {"name"},
+    "ASK_SERVICE":       _LANG,
+    "PROPOSE_CONSULT":   _LANG,
+    "ASK_CHANNEL":       _LANG,
+    "ASK_SLOT":          _LANG,
+    "ASK_PAYMENT":       _LANG,
+    "CONFIRMED":         _LANG,
+    "ROUTE_ACTIVE":      _LANG,
+    "ASK_CLARIFICATION": _LANG,
+}
+
+# Stati aggiuntivi con RAG, es. SOFIA_RAG_STATES=ASK_SERVICE,ASK_CLARIFICATION
+RAG_STATES = frozenset(s.strip() for s in os.getenv("SOFIA_RAG_STATES", "").split(",") if s.strip())
+
+def stages_for(state: str) -> FrozenSet[str]:
+    """Stages declared for a state (unknown states run everything)"""
+    stages = STAGE_SPEC.get(state, frozenset(STAGES))
+    if state in RAG_STATES:
+        stages = stages | {"rag"}
+    return stages
+
+def plan_stages(ctx) -> FrozenSet[str]:
+    """Stages to run for this turn; counts every stage as run or skipped"""
+    stages = stages_for(ctx.state)
+    if ctx.lang and ctx.lang != "unknown":
+        stages = stages - {"lang"}
+    for stage in STAGES:
+        enrichment_stages.labels(stage=stage, result="run" if stage in stages else "skip").inc()
+    return stages
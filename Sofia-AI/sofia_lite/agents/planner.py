@@ -1,19 +1,26 @@
+import asyncio
+import concurrent.futures
 import json
-import os
 import logging
 import functools
-from typing import Tuple
+import os
+import time
+from typing import Dict, Optional, Tuple
 from tenacity import retry, stop_after_attempt, wait_exponential
 from .prompt_builder import build_system_prompt
 from .context import Context
 from .state import State
-from .. import get_config
+from .intent_similarity import get_similarity_classifier
+from .features import TurnFeatures, features_for
+from ..middleware.llm import get_async_openai_client, get_openai_client
+from ..middleware.workers import run_blocking, submit
+from ..metrics import intent_hedge_wins
+from ..utils.memo import get_cache
 
 log = logging.getLogger("sofia.planner")
 
-# Tiny cache for intent classification (LRU 1024)
-_intent_cache = {}
-_MAX_CACHE_SIZE = 1024
+# Cache condivisa per la classificazione intent (LRU + TTL, utils.memo)
+_intent_cache = get_cache("classify")
 
 # Definizione degli intent con priorità (più alta = più importante)
 INTENTS = ["GREET","ASK_NAME","ASK_SERVICE","PROPOSE_CONSULT",
@@ -56,130 +63,208 @@ User: "I don't understand" → Intent: CLARIFY
 User: "asdfghjkl" → Intent: CLARIFY
 """
 
-def classify_intent(text: str, lang: str, ctx=None) -> Tuple[str, float]:
+# Hedged classification: budget reale e soglia minima di confidence
+CLASSIFY_BUDGET_S = float(os.getenv("SOFIA_CLASSIFY_BUDGET", "0.8"))  # Ottimizzato per γ4-a
+CONFIDENCE_FLOOR = 0.25
+TIMEOUT_CONFIDENCE = 0.1  # CLARIFY quando nessun classificatore risponde entro il budget
+
+def _quick_intent(text: str, ctx=None) -> Tuple[str, Optional[Tuple[str, float]]]:
     """
-    Classifica l'intent del testo usando nuova pipeline con cache.
+    Language detection + greeting heuristics (no I/O).
     
-    Args:
-        text: Testo da analizzare
-        lang: Lingua del testo
-        ctx: Conversation context (optional, for language caching)
-        
     Returns:
-        Tuple (intent, confidence)
+        Tuple (detected_lang, (intent, confidence) or None)
     """
-    import asyncio
-    
-    # Step 1: Language detection with heuristics
-    from ..middleware.language import detect_lang_with_heuristics
-    detected_lang, extra_tag = detect_lang_with_heuristics(text, ctx)
+    # Step 1: Language detection with heuristics (once per turn, see features)
+    features = features_for(text, ctx)
+    detected_lang, extra_tag = features.language
     log.info(f"🌍 Language detected: {detected_lang} for text: '{text[:20]}...'")
     
     # Step 2: Quick greeting heuristic
     if extra_tag == "GREETING_QUICK":
         log.info(f"🚀 Quick greeting heuristic: '{text}' -> GREET")
-        return "GREET", 0.99
+        return detected_lang, ("GREET", 0.99)
     
     # FORCE SEQUENCE: If message contains greeting words or name phrases, force GREET intent
-    greeting_words = ["ciao", "salve", "buongiorno", "buonasera", "hello", "hi", "bonjour", "hola"]
-    name_phrases = ["mi chiamo", "my name is", "je m'appelle", "me llamo"]
-    text_lower = text.lower()
-    if any(word in text_lower for word in greeting_words) or any(phrase in text_lower for phrase in name_phrases):
+    # (a message starting with a greeting contains it, so one scan covers both rules)
+    if features.greeting or features.name_phrase:
         log.info(f"🚀 Force GREET intent for greeting/name message: '{text}'")
-        return "GREET", 0.95
+        return detected_lang, ("GREET", 0.95)
     
-    # FORCE SEQUENCE: If message starts with greeting, force GREET intent regardless of content
-    first_word = text.strip().split()[0].lower() if text.strip() else ""
-    if first_word in greeting_words:
-        log.info(f"🚀 Force GREET intent for message starting with greeting: '{text}'")
-        return "GREET", 0.95
+    return detected_lang, None
+
+def _pick_result(results: Dict[str, Tuple[str, float]]) -> Optional[Tuple[str, str, float]]:
+    """Best (path, intent, confidence) among finished classifiers"""
+    if not results:
+        return None
+    path, (intent, confidence) = max(results.items(), key=lambda item: item[1][1])
+    return path, intent, confidence
+
+def _record_winner(path: str, text: str, intent: str, confidence: float):
+    intent_hedge_wins.labels(path=path).inc()
+    log.info(f"🏁 Hedged classification won by {path}: '{text}' → {intent} (conf: {confidence:.2f})")
+
+def _hedged_classify_sync(text: str, lang: str, budget: float = None) -> Tuple[str, float, str]:
+    """
+    Race OpenAI vs similarity on the shared pool; first answer above
+    CONFIDENCE_FLOOR wins, the loser is cancelled (or its result dropped).
+    
+    Returns:
+        Tuple (intent, confidence, winning_path)
+    """
+    budget = CLASSIFY_BUDGET_S if budget is None else budget
+    deadline = time.monotonic() + budget
+    futures = {
+        submit(_classify_with_openai_fast, text, lang): "openai",
+        submit(_classify_with_similarity, text): "similarity",
+    }
+    results: Dict[str, Tuple[str, float]] = {}
+    pending = set(futures)
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = concurrent.futures.wait(
+                pending, timeout=remaining, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                try:
+                    intent, confidence = future.result()
+                except Exception as e:
+                    log.warning(f"⚠️ {futures[future]} classifier failed: {e}")
+                    continue
+                results[futures[future]] = (intent, float(confidence))
+                if confidence >= CONFIDENCE_FLOOR:
+                    _record_winner(futures[future], text, intent, confidence)
+                    return intent, float(confidence), futures[future]
+    finally:
+        for future in pending:
+            future.cancel()
     
-    # FORCE SEQUENCE: If message contains greeting words or name phrases anywhere, force GREET intent
-    if any(word in text_lower for word in greeting_words) or any(phrase in text_lower for phrase in name_phrases):
-        log.info(f"🚀 Force GREET intent for message containing greeting/name: '{text}'")
-        return "GREET", 0.95
+    return _finish_without_winner(results, text)
+
+async def _hedged_classify_async(text: str, lang: str, budget: float = None) -> Tuple[str, float, str]:
+    """
+    Async race: OpenAI over the shared async pool, similarity on the worker pool.
+    First answer above CONFIDENCE_FLOOR wins and the loser task is cancelled.
     
-    # Step 3: Execute OpenAI + similarity in parallel
+    Returns:
+        Tuple (intent, confidence, winning_path)
+    """
+    budget = CLASSIFY_BUDGET_S if budget is None else budget
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget
+    tasks = {
+        asyncio.ensure_future(_classify_with_openai_fast_async(text, lang)): "openai",
+        asyncio.ensure_future(_classify_with_similarity_async(text)): "similarity",
+    }
+    results: Dict[str, Tuple[str, float]] = {}
+    pending = set(tasks)
     try:
-        # Run both classification methods in parallel
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        async def parallel_classify():
-            tasks = [
-                asyncio.create_task(_classify_with_openai_fast_async(text, detected_lang)),
-                asyncio.create_task(_classify_with_similarity_async(text))
-            ]
-            
-            # Wait for first result or timeout - Ottimizzato per γ4-a
-            done, pending = await asyncio.wait(tasks, timeout=0.8, return_when=asyncio.FIRST_COMPLETED)
-            
-            # Cancel pending tasks
-            for task in pending:
-                task.cancel()
-            
-            if done:
-                result = done.pop().result()
-                return result
-            else:
-                raise TimeoutError("Both classification methods timed out")
-        
-        intent, confidence = loop.run_until_complete(parallel_classify())
-        loop.close()
-        
-        log.info(f"🚀 Parallel classified '{text}' as {intent} (conf: {confidence:.2f})")
-        
-        # Step 4: Apply confidence threshold
-        if confidence < 0.25:
-            log.warning(f"⚠️ Low confidence ({confidence:.2f}), falling back to CLARIFY")
-            return "CLARIFY", confidence
-            
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(
+                pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                try:
+                    intent, confidence = task.result()
+                except Exception as e:
+                    log.warning(f"⚠️ {tasks[task]} classifier failed: {e}")
+                    continue
+                results[tasks[task]] = (intent, float(confidence))
+                if confidence >= CONFIDENCE_FLOOR:
+                    _record_winner(tasks[task], text, intent, confidence)
+                    return intent, float(confidence), tasks[task]
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    return _finish_without_winner(results, text)
+
+def _finish_without_winner(results: Dict[str, Tuple[str, float]], text: str) -> Tuple[str, float, str]:
+    """No answer above the floor: best low-confidence answer, or CLARIFY on timeout"""
+    best = _pick_result(results)
+    if best is None:
+        intent_hedge_wins.labels(path="timeout").inc()
+        log.warning(f"⏱️ No classifier answered for '{text}' (failed or over budget), falling back to CLARIFY")
+        return "CLARIFY", TIMEOUT_CONFIDENCE, "timeout"
+    path, intent, confidence = best
+    _record_winner(path, text, intent, confidence)
+    return intent, confidence, path
+
+def _apply_floor(text: str, intent: str, confidence: float) -> Tuple[str, float]:
+    """Step 4: Apply confidence threshold"""
+    log.info(f"🚀 Parallel classified '{text}' as {intent} (conf: {confidence:.2f})")
+    if confidence < CONFIDENCE_FLOOR:
+        log.warning(f"⚠️ Low confidence ({confidence:.2f}), falling back to CLARIFY")
+        return "CLARIFY", confidence
+    return intent, confidence
+
+def _intent_cache_key(text: str, lang: str) -> Tuple[str, str, str]:
+    return ("intent", features_for(text).normalized, lang)
+
+def _finish_classification(cache_key, text: str, intent: str, confidence: float, path: str) -> Tuple[str, float]:
+    """Apply the floor and cache the result (timeouts are not cached: the next turn retries)"""
+    if path == "timeout":
         return intent, confidence
+    result = _apply_floor(text, intent, confidence)
+    _intent_cache.set(cache_key, result)
+    return result
+
+def classify_intent(text: str, lang: str, ctx=None) -> Tuple[str, float]:
+    """
+    Classifica l'intent del testo usando nuova pipeline con cache.
+    
+    Args:
+        text: Testo da analizzare
+        lang: Lingua del testo
+        ctx: Conversation context (optional, for language caching)
         
+    Returns:
+        Tuple (intent, confidence)
+    """
+    detected_lang, quick = _quick_intent(text, ctx)
+    if quick:
+        return quick
+    
+    cache_key = _intent_cache_key(text, detected_lang)
+    cached = _intent_cache.get(cache_key)
+    if cached:
+        return cached
+    
+    # Step 3: Hedged OpenAI + similarity race, bounded by CLASSIFY_BUDGET_S
+    try:
+        intent, confidence, path = _hedged_classify_sync(text, detected_lang)
     except Exception as e:
-        log.warning(f"⚠️ Parallel classification failed: {e}, trying sequential fallback")
-        
-        # Fallback to sequential execution
-        try:
-            intent, confidence = _classify_with_openai_fast(text, detected_lang)
-            log.info(f"🤖 OpenAI classified '{text}' as {intent} (conf: {confidence:.2f})")
-            
-            if confidence < 0.25:
-                return "CLARIFY", confidence
-                
-            return intent, confidence
-            
-        except Exception as e2:
-            log.warning(f"⚠️ OpenAI failed: {e2}, trying similarity")
-            
-            try:
-                intent, confidence = _classify_with_similarity(text)
-                log.info(f"🔍 Similarity classified '{text}' as {intent} (conf: {confidence:.2f})")
-                
-                if confidence < 0.25:
-                    return "CLARIFY", confidence
-                    
-                return intent, confidence
-                
-            except Exception as e3:
-                log.error(f"❌ All classification methods failed: {e3}")
-                return "CLARIFY", 0.1
+        log.error(f"❌ Parallel classification failed: {e}")
+        return "CLARIFY", TIMEOUT_CONFIDENCE
+    return _finish_classification(cache_key, text, intent, confidence, path)
 
-@retry(stop=stop_after_attempt(1), wait=wait_exponential(multiplier=1, min=1, max=2))
-def _classify_with_openai_fast(text: str, lang: str) -> Tuple[str, float]:
-    """Classifica intent usando OpenAI con timeout 0.8s e 1 retry - Ottimizzato γ4-a"""
+async def aclassify_intent(text: str, lang: str, ctx=None) -> Tuple[str, float]:
+    """Async version of classify_intent (native async race on the event loop)"""
+    detected_lang, quick = _quick_intent(text, ctx)
+    if quick:
+        return quick
+    
+    cache_key = _intent_cache_key(text, detected_lang)
+    cached = _intent_cache.get(cache_key)
+    if cached:
+        return cached
+    
     try:
-        import openai
-        import httpx
-        cfg = get_config()
-        
-        # Configure client with timeout
-        client = openai.OpenAI(
-            api_key=cfg["OPENAI_API_KEY"],
-            http_client=httpx.Client(timeout=0.8)  # 0.8 second timeout - Ottimizzato γ4-a
-        )
-        
-        prompt = f"""{FEW_SHOT_EXAMPLES}
+        intent, confidence, path = await _hedged_classify_async(text, detected_lang)
+    except Exception as e:
+        log.error(f"❌ Parallel classification failed: {e}")
+        return "CLARIFY", TIMEOUT_CONFIDENCE
+    return _finish_classification(cache_key, text, intent, confidence, path)
+
+def _classification_messages(text: str, lang: str) -> list:
+    """Few-shot prompt shared by the OpenAI classifiers (fast sync, fast async, legacy)"""
+    prompt = f"""{FEW_SHOT_EXAMPLES}
 
 Classify the intent of this user message. Respond with JSON only:
 {{"intent": "INTENT_NAME", "confidence": 0.95}}
@@ -188,93 +273,73 @@ User message: "{text}"
 Language: {lang}
 
 JSON response:"""
+    return [{"role": "user", "content": prompt}]
+
+def _parse_classification(response) -> Tuple[str, float]:
+    """(intent, confidence) from the JSON answer of a classification completion"""
+    result = json.loads(response.choices[0].message.content.strip())
+    return result["intent"], result["confidence"]
+
+@retry(stop=stop_after_attempt(1), wait=wait_exponential(multiplier=1, min=1, max=2))
+def _classify_with_openai_fast(text: str, lang: str) -> Tuple[str, float]:
+    """Classifica intent usando OpenAI con timeout 0.8s e 1 retry - Ottimizzato γ4-a"""
+    try:
+        # Shared pooled client, 0.8 second timeout - Ottimizzato γ4-a
+        client = get_openai_client("classify_fast")
         
         response = client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
+            messages=_classification_messages(text, lang),
             temperature=0,
             max_tokens=48  # Reduced for faster response
         )
         
-        result = json.loads(response.choices[0].message.content.strip())
-        return result["intent"], result["confidence"]
+        return _parse_classification(response)
         
     except Exception as e:
         log.error(f"❌ OpenAI fast classification error: {e}")
         raise
 
 async def _classify_with_openai_fast_async(text: str, lang: str) -> Tuple[str, float]:
-    """Async version of OpenAI classification"""
-    return _classify_with_openai_fast(text, lang)
+    """Async version of OpenAI classification (shared async pool, 0.8s timeout)"""
+    client = get_async_openai_client("classify_fast")
+    
+    response = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=_classification_messages(text, lang),
+        temperature=0,
+        max_tokens=48  # Reduced for faster response
+    )
+    
+    return _parse_classification(response)
 
 async def _classify_with_similarity_async(text: str) -> Tuple[str, float]:
-    """Async version of similarity classification"""
-    return _classify_with_similarity(text)
+    """Async version of similarity classification (runs on the shared worker pool)"""
+    return await run_blocking(_classify_with_similarity, text)
 
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
 def _classify_with_openai(text: str, lang: str) -> Tuple[str, float]:
     """Classifica intent usando OpenAI con few-shot examples (legacy)"""
     try:
-        import openai
-        cfg = get_config()
-        client = openai.OpenAI(api_key=cfg["OPENAI_API_KEY"])
-        
-        prompt = f"""{FEW_SHOT_EXAMPLES}
-
-Classify the intent of this user message. Respond with JSON only:
-{{"intent": "INTENT_NAME", "confidence": 0.95}}
-
-User message: "{text}"
-Language: {lang}
-
-JSON response:"""
+        client = get_openai_client("chat")
         
         response = client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
+            messages=_classification_messages(text, lang),
             temperature=0,
             max_tokens=50
         )
         
-        result = json.loads(response.choices[0].message.content.strip())
-        return result["intent"], result["confidence"]
+        return _parse_classification(response)
         
     except Exception as e:
         log.error(f"❌ OpenAI classification error: {e}")
         raise
 
 def _classify_with_similarity(text: str) -> Tuple[str, float]:
-    """Classifica intent usando sentence-transformers similarity"""
+    """Classifica intent usando sentence-transformers similarity (modello e matrice esempi pre-caricati)"""
     try:
-        from sentence_transformers import SentenceTransformer
-        import numpy as np
-        
-        # Carica il modello
-        model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-        
-        # Carica gli esempi
-        examples_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'intent_examples.json')
-        with open(examples_path, 'r', encoding='utf-8') as f:
-            intent_examples = json.load(f)
-        
-        # Vettorizza il testo di input
-        text_embedding = model.encode([text])[0]
-        
-        best_intent = "CLARIFY"
-        best_similarity = 0.0
-        
-        # Calcola similarità con tutti gli esempi
-        for intent, examples in intent_examples.items():
-            if examples:
-                example_embeddings = model.encode(examples)
-                similarities = np.dot(example_embeddings, text_embedding) / (
-                    np.linalg.norm(example_embeddings, axis=1) * np.linalg.norm(text_embedding)
-                )
-                max_similarity = np.max(similarities)
-                
-                if max_similarity > best_similarity:
-                    best_similarity = max_similarity
-                    best_intent = intent
+        best_intent, best_similarity = get_similarity_classifier().classify(text)
         
         # Se similarity < 0.22, ritorna CLARIFY (abbassato da 0.25)
         if best_similarity < 0.22:
@@ -290,7 +355,7 @@ def _classify_with_similarity(text: str) -> Tuple[str, float]:
             }
             
             # Estrai la prima parola del testo
-            first_word = text.strip().split()[0].lower() if text.strip() else ""
+            first_word = features_for(text).first_word
             
             # Controlla se la prima parola è un saluto
             for lang, greet_words in GREET_WORDS.items():
@@ -306,23 +371,37 @@ def _classify_with_similarity(text: str) -> Tuple[str, float]:
         log.error(f"❌ Similarity classification error: {e}")
         raise
 
+def _forced_greet(features: TurnFeatures) -> bool:
+    """FORCE SEQUENCE: Force GREET intent for any message containing greeting words"""
+    if features.forced_greet:
+        log.info(f"🔄 FORCE GREET intent for message containing greeting: '{features.text}'")
+        return True
+    return False
+
+def _rationale(user_msg: str, intent: str, confidence: float) -> tuple[str, str]:
+    log.info(f"🎯 Intent Engine 2.0: '{user_msg}' → {intent} (conf: {confidence:.2f})")
+    return intent, f"Intent Engine 2.0: {intent} (confidence: {confidence:.2f})"
+
 def plan(ctx: Context, user_msg: str, llm) -> tuple[str, str]:
     """
     Returns (intent:str, rationale:str) usando Intent Engine 2.0
     """
-    # FORCE SEQUENCE: Force GREET intent for any message containing greeting words
-    greeting_words = ["ciao", "hello", "buongiorno", "salve", "bonjour", "hola"]
-    if any(greeting in user_msg.lower() for greeting in greeting_words):
-        log.info(f"🔄 FORCE GREET intent for message containing greeting: '{user_msg}'")
-        intent = "GREET"
-        confidence = 0.95
+    if _forced_greet(features_for(user_msg, ctx)):
+        intent, confidence = "GREET", 0.95
     else:
         # Classifica intent con confidence (pass context for language caching)
         intent, confidence = classify_intent(user_msg, ctx.lang, ctx)
     
-    log.info(f"🎯 Intent Engine 2.0: '{user_msg}' → {intent} (conf: {confidence:.2f})")
+    return _rationale(user_msg, intent, confidence)
+
+async def aplan(ctx: Context, user_msg: str, llm) -> tuple[str, str]:
+    """Async version of plan"""
+    if _forced_greet(features_for(user_msg, ctx)):
+        intent, confidence = "GREET", 0.95
+    else:
+        intent, confidence = await aclassify_intent(user_msg, ctx.lang, ctx)
     
-    return intent, f"Intent Engine 2.0: {intent} (confidence: {confidence:.2f})"
+    return _rationale(user_msg, intent, confidence)
 
 def next_state(current_state: State, intent: str, ctx=None) -> State:
     """
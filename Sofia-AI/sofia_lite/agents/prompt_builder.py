@@ -160,6 +160,13 @@ def build_system_prompt(ctx: Context) -> str:
     
     return f"{PARAHELP_TEMPLATE}{rag_section}\n\nCURRENT_LANG: {ctx.lang}"
 
+def _summary_section(ctx: Context) -> str:
+    """Rolling summary of the archived conversation (empty when there is none)"""
+    summary = getattr(ctx, 'summary', '')
+    if not summary:
+        return ""
+    return f"Earlier in the conversation the user said:\n{summary}\n"
+
 def build_intent_specific_prompt(ctx: Context, intent: str) -> str:
     """
     Build intent-specific prompts to ensure Sofia follows the correct journey.
@@ -169,7 +176,7 @@ def build_intent_specific_prompt(ctx: Context, intent: str) -> str:
 Current language: {ctx.lang}
 User name: {ctx.name or 'Not provided'}
 Current state: {ctx.state}
-
+{_summary_section(ctx)}
 IMPORTANT RULES:
 • Never say "ciao, sono sofia, l'assistente virtuale di studio immigrato"
 • Be brief and direct
@@ -4,6 +4,7 @@ Integrazione completa di tutti i moduli
 """
 
 import os
+import sys
 import logging
 from fastapi import FastAPI, Request, Form
 from fastapi.responses import JSONResponse, Response
@@ -30,6 +31,22 @@ async def lifespan(app: FastAPI):
         from .agents.orchestrator import Orchestrator
         orchestrator = Orchestrator()
         
+        # Carica modello di similarity + matrice esempi prima del primo messaggio
+        from .agents.intent_similarity import warm_up as warm_up_similarity
+        from .middleware.workers import run_blocking
+        await run_blocking(warm_up_similarity)
+        
+        # Lessici guardrail compilati prima del primo messaggio
+        from .policy.guardrails import get_guardrails
+        get_guardrails()
+        
+        # Client Firestore async + canale gRPC caldo prima del primo messaggio
+        from .middleware.memory import warm_up_firestore
+        try:
+            await warm_up_firestore()
+        except Exception as e:
+            logger.warning(f"⚠️ Firestore warm-up failed, using the sync client: {e}")
+        
         logger.info("✅ Sofia Lite inizializzata con successo")
         
     except Exception as e:
@@ -40,6 +57,18 @@ async def lifespan(app: FastAPI):
     
     # Cleanup
     logger.info("Cleanup Sofia Lite...")
+    from .middleware.llm import aclose_clients
+    from .middleware.memory import aclose_firestore, flush_pending_writes, flush_vector_store
+    from .middleware.workers import run_blocking, shutdown_executor
+    await run_blocking(flush_pending_writes)
+    await run_blocking(flush_vector_store)
+    await aclose_clients()
+    await aclose_firestore()
+    # Sessione aiohttp del client Twilio async (solo se il router WhatsApp è stato caricato)
+    whatsapp = sys.modules.get(f"{__package__}.whatsapp")
+    if whatsapp is not None:
+        await whatsapp.aclose_twilio_client()
+    shutdown_executor(wait=False)
 
 app = FastAPI(
     title="Sofia Lite", 
@@ -66,6 +95,14 @@ async def health_check():
         "orchestrator": "ready" if orchestrator else "initializing"
     }
 
+async def _whatsapp_turn(phone: str, message: str):
+    """Rapid-fire messages: one orchestrator turn and one reply for the whole burst"""
+    from .middleware.burst import get_burst_coalescer
+    text, answers_burst = await get_burst_coalescer().collect(phone, message)
+    if not answers_burst:
+        return {"status": "merged", "phone": phone}
+    return await orchestrator.aprocess_message(phone, text)
+
 @app.post("/webhook/whatsapp")
 async def whatsapp_webhook(request: Request):
     """WhatsApp webhook endpoint."""
@@ -76,6 +113,7 @@ async def whatsapp_webhook(request: Request):
             logger.info(f"📋 JSON data received: {json_data}")
             phone = json_data.get("From", "").replace("whatsapp:", "")
             message = json_data.get("Body", "")
+            message_sid = json_data.get("MessageSid")
             logger.info(f"📱 Extracted from JSON - phone: '{phone}', message: '{message}'")
         except Exception as e:
             logger.warning(f"⚠️ JSON parsing failed: {e}, trying form data")
@@ -83,6 +121,7 @@ async def whatsapp_webhook(request: Request):
             form_data = await request.form()
             phone = form_data.get("From", "").replace("whatsapp:", "")
             message = form_data.get("Body", "")
+            message_sid = form_data.get("MessageSid")
             logger.info(f"📱 Extracted from form - phone: '{phone}', message: '{message}'")
         
         logger.info(f"WhatsApp message from {phone}: {message[:50]}...")
@@ -100,7 +139,13 @@ async def whatsapp_webhook(request: Request):
         
         # Processa il messaggio con l'orchestrator
         try:
-            response = orchestrator.process_message(phone, message)
+            # Twilio retries on timeout: a redelivered MessageSid gets the cached reply
+            from .middleware.ordering import get_message_dedup
+            response, duplicate = await get_message_dedup().run_once(
+                message_sid, lambda: _whatsapp_turn(phone, message)
+            )
+            if duplicate and response is None:
+                return JSONResponse(content={"status": "duplicate", "phone": phone})
             logger.info(f"Processed message for {phone}: {response.get('reply', '')[:100]}...")
             
             return JSONResponse(content=response)
@@ -152,14 +197,14 @@ async def voice_webhook(request: Request):
         
         # Processa il messaggio vocale con l'orchestrator
         try:
-            response = orchestrator.process_message(phone, speech_result)
-            logger.info(f"Processed voice for {phone}: {response[:100]}...")
+            response = await orchestrator.aprocess_message(phone, speech_result, "voice")
+            logger.info(f"Processed voice for {phone}: {response.get('reply', '')[:100]}...")
             
             return JSONResponse(content={
-                "reply": response,
-                "intent": "PROCESSED",
-                "state": "ACTIVE",
-                "lang": "it"
+                "reply": response.get("reply", ""),
+                "intent": response.get("intent", "PROCESSED"),
+                "state": response.get("state", "ACTIVE"),
+                "lang": response.get("lang", "it")
             })
             
         except Exception as e:
@@ -185,9 +230,83 @@ async def voice_webhook(request: Request):
             status_code=500
         )
 
+# ─── Voice streaming (TwiML) ─────────────────────────────────────────────
+# La prima frase viene detta appena generata; <Redirect> porta Twilio alla
+# continuazione, che aspetta il resto della risposta sulla stessa istanza.
+_VOICE = {"voice": "Polly.Bianca", "language": "it-IT"}
+
+def _twiml(response) -> Response:
+    return Response(content=str(response), media_type="application/xml")
+
+def _listen(response):
+    """End of the reply: listen for the caller's next sentence"""
+    response.gather(input="speech", action="/webhook/voice/stream", method="POST",
+                    language=_VOICE["language"], speech_timeout="auto")
+
+@app.post("/webhook/voice/stream")
+async def voice_stream_webhook(request: Request):
+    """Voice webhook (TwiML) with early speech of the first sentence."""
+    from twilio.twiml.voice_response import VoiceResponse
+    from .middleware.voice_stream import get_voice_turns
+    response = VoiceResponse()
+    try:
+        form_data = await request.form()
+        phone = form_data.get("From", "").replace("client:", "")
+        speech_result = form_data.get("SpeechResult", "")
+        
+        if not orchestrator:
+            response.say("Sofia è temporaneamente non disponibile. Riprova tra qualche minuto.", **_VOICE)
+            return _twiml(response)
+        
+        turns = get_voice_turns()
+        first, turn_id, turn = await turns.start(
+            lambda: orchestrator.aprocess_message(phone, speech_result, "voice")
+        )
+        if first is None:
+            # Nothing streamed (template, cache, fallback): the reply is already complete
+            turns.pop(turn_id)
+            reply, _ = await turn.remainder()
+            response.say(reply, **_VOICE)
+            _listen(response)
+        else:
+            response.say(first, **_VOICE)
+            response.redirect(f"/webhook/voice/continue?turn={turn_id}", method="POST")
+        return _twiml(response)
+        
+    except Exception as e:
+        logger.error(f"Error in voice stream webhook: {e}")
+        response.say("Mi dispiace, c'è stato un errore nel processare la tua richiesta vocale. Riprova.", **_VOICE)
+        return _twiml(response)
+
+@app.post("/webhook/voice/continue")
+async def voice_continue_webhook(turn: str):
+    """Rest of a streamed voice reply."""
+    from twilio.twiml.voice_response import VoiceResponse
+    from .middleware.voice_stream import get_voice_turns
+    response = VoiceResponse()
+    voice_turn = get_voice_turns().pop(turn)
+    if voice_turn is None:
+        # Expired, or the redirect reached another instance
+        logger.warning(f"⚠️ Voice turn {turn} not found")
+        _listen(response)
+        return _twiml(response)
+    try:
+        rest, _ = await voice_turn.remainder()
+        if rest:
+            response.say(rest, **_VOICE)
+    except Exception as e:
+        logger.error(f"Error completing voice turn: {e}")
+        response.say("Mi dispiace, c'è stato un errore. Riprova.", **_VOICE)
+    _listen(response)
+    return _twiml(response)
+
 @app.get("/status")
 async def status():
     """Status endpoint per monitoraggio."""
+    from .middleware.llm import get_pool_stats
+    from .middleware.memory import get_context_cache_stats, get_write_stats
+    from .middleware.burst import get_burst_coalescer
+    from .middleware.ordering import get_message_dedup
     return {
         "service": "sofia-lite",
         "version": "1.0.0",
@@ -195,8 +314,14 @@ async def status():
         "endpoints": {
             "whatsapp": "/webhook/whatsapp",
             "voice": "/webhook/voice",
+            "voice_stream": "/webhook/voice/stream",
             "health": "/health"
-        }
+        },
+        "llm_pool": get_pool_stats(),
+        "context_writes": get_write_stats(),
+        "context_cache": get_context_cache_stats(),
+        "webhook_dedup": get_message_dedup().stats(),
+        "burst_coalescing": get_burst_coalescer().stats()
     }
 
 @app.get("/metrics")
@@ -1,4 +1,4 @@
-from prometheus_client import Counter
+from prometheus_client import Counter, Gauge
 
 new_leads          = Counter("sofia_new_leads_total",
                              "Nuovi clienti indirizzati alla consulenza")
@@ -7,4 +7,25 @@ active_redirects   = Counter("sofia_active_app_redirect_total",
 bookings_confirmed = Counter("sofia_bookings_confirmed_total",
                              "Appuntamenti fissati")
 clarifies          = Counter("sofia_clarify_messages_total",
-                             "Messaggi di chiarimento inviati") 
\ No newline at end of file
+                             "Messaggi di chiarimento inviati")
+intent_hedge_wins  = Counter("sofia_intent_hedge_wins_total",
+                             "Classificazioni intent vinte per percorso",
+                             ["path"])
+cache_hits         = Counter("sofia_cache_hits_total",
+                             "Cache hit per cache",
+                             ["cache"])
+cache_misses       = Counter("sofia_cache_misses_total",
+                             "Cache miss per cache",
+                             ["cache"])
+cache_evictions    = Counter("sofia_cache_evictions_total",
+                             "Voci rimosse per LRU per cache",
+                             ["cache"])
+cache_size         = Gauge("sofia_cache_size",
+                           "Voci presenti per cache",
+                           ["cache"])
+context_cache_lookups = Counter("sofia_context_cache_lookups_total",
+                                "Letture contesto dalla hot cache per esito",
+                                ["result"])
+enrichment_stages  = Counter("sofia_enrichment_stages_total",
+                             "Stadi di arricchimento per turno, eseguiti o saltati",
+                             ["stage", "result"])
@@ -0,0 +1,149 @@
+"""
+Sofia Lite - Burst coalescing
+Messaggi WhatsApp ravvicinati dello stesso numero vengono uniti in un solo
+turno: il primo messaggio apre una finestra, i successivi la estendono e
+solo il primo risponde. La finestra si adatta al ritmo di scrittura dell'utente.
+I messaggi uniti aspettano la chiusura della finestra: se la richiesta del
+primo viene cancellata, il messaggio successivo prende il burst e risponde.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger("sofia.burst")
+
+# Finestra base (0 = coalescing disattivato)
+BURST_WINDOW_MS = float(os.getenv("SOFIA_BURST_WINDOW_MS", "0"))
+# Durata massima di un burst dal primo messaggio
+BURST_MAX_WINDOW_MS = float(os.getenv("SOFIA_BURST_MAX_WINDOW_MS", "3000"))
+# Oltre questo numero di messaggi il turno parte subito
+BURST_MAX_MESSAGES = int(os.getenv("SOFIA_BURST_MAX_MESSAGES", "5"))
+
+# Peso dell'ultimo intervallo nella media mobile per numero
+_GAP_ALPHA = 0.3
+# La finestra adattiva copre 1.5× l'intervallo tipico tra messaggi del burst
+_GAP_FACTOR = 1.5
+
+class _Burst:
+    def __init__(self, text: str, now: float, deadline: float):
+        self.messages: List[str] = [text]
+        self.started = now
+        self.deadline = deadline
+        self.full = asyncio.Event()
+        # Messages merged into the burst: True = take over the burst, False = merged
+        self.followers: List[asyncio.Future] = []
+
+class BurstCoalescer:
+    """Per-phone coalescing window with an adaptive length"""
+
+    def __init__(self, window_ms: float = BURST_WINDOW_MS, max_window_ms: float = BURST_MAX_WINDOW_MS,
+                 max_messages: int = BURST_MAX_MESSAGES):
+        self.window = window_ms / 1000.0
+        self.max_window = max_window_ms / 1000.0
+        self.max_messages = max_messages
+        self._open: Dict[str, _Burst] = {}
+        self._last_seen: Dict[str, float] = {}
+        self._gap: Dict[str, float] = {}
+        self.bursts = 0
+        self.merged = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def _observe(self, phone: str, now: float):
+        """Track the typical gap between a user's rapid-fire messages (EWMA)"""
+        last = self._last_seen.get(phone)
+        self._last_seen[phone] = now
+        if last is not None and now - last <= self.max_window:
+            gap = now - last
+            previous = self._gap.get(phone)
+            self._gap[phone] = gap if previous is None else (1 - _GAP_ALPHA) * previous + _GAP_ALPHA * gap
+        if len(self._last_seen) > 10_000:
+            # Dimentica i numeri inattivi
+            cutoff = now - 60 * self.max_window
+            for key in [k for k, t in self._last_seen.items() if t < cutoff]:
+                self._last_seen.pop(key, None)
+                self._gap.pop(key, None)
+
+    def window_for(self, phone: str) -> float:
+        """Window in seconds: base, widened for users who type in bursts"""
+        gap = self._gap.get(phone)
+        if gap is None:
+            return self.window
+        return min(self.max_window, max(self.window, _GAP_FACTOR * gap))
+
+    async def collect(self, phone: str, text: str) -> Tuple[Optional[str], bool]:
+        """
+        (merged text, True) for the message that answers the burst, once its
+        window has closed; (None, False) for messages merged into it.
+        """
+        if not self.enabled:
+            return text, True
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._observe(phone, now)
+
+        burst = self._open.get(phone)
+        if burst is None:
+            burst = self._open[phone] = _Burst(text, now, now + self.window_for(phone))
+            self.bursts += 1
+            return await self._lead(phone, burst)
+
+        burst.messages.append(text)
+        burst.deadline = min(burst.started + self.max_window, now + self.window_for(phone))
+        self.merged += 1
+        if len(burst.messages) >= self.max_messages:
+            burst.full.set()
+        follower = loop.create_future()
+        burst.followers.append(follower)
+        if not await follower:
+            return None, False
+        log.info(f"🧺 Burst of {phone} taken over by a merged message")
+        return await self._lead(phone, burst)
+
+    async def _lead(self, phone: str, burst: _Burst) -> Tuple[str, bool]:
+        """Wait for the window to close, then answer the whole burst"""
+        loop = asyncio.get_running_loop()
+        try:
+            # The deadline moves while messages keep arriving
+            while (remaining := burst.deadline - loop.time()) > 0 and not burst.full.is_set():
+                try:
+                    await asyncio.wait_for(burst.full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            # Request of the answering message gone: the next waiting one answers
+            while burst.followers:
+                successor = burst.followers.pop(0)
+                if not successor.done():
+                    successor.set_result(True)
+                    raise
+            del self._open[phone]
+            raise
+        del self._open[phone]
+        for follower in burst.followers:
+            if not follower.done():
+                follower.set_result(False)
+        if len(burst.messages) > 1:
+            log.info(f"🧺 Coalesced {len(burst.messages)} messages from {phone} into one turn")
+        return "\n".join(burst.messages), True
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "enabled": self.enabled,
+            "bursts": self.bursts,
+            "merged": self.merged,
+            "open": len(self._open),
+        }
+
+_burst_coalescer: Optional[BurstCoalescer] = None
+
+def get_burst_coalescer() -> BurstCoalescer:
+    global _burst_coalescer
+    if _burst_coalescer is None:
+        _burst_coalescer = BurstCoalescer()
+    return _burst_coalescer
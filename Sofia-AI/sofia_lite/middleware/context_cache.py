@@ -0,0 +1,250 @@
+"""
+Sofia Lite - Hot context cache
+LRU per istanza dei contesti utente; Firestore resta la fonte di verità.
+Entro FRESH_SECONDS il contesto è servito dalla memoria senza letture; fino a
+STALE_SECONDS è servito subito e rivalidato in background (update_time di
+users/{phone}), così il turno non aspetta mai l'RPC; oltre, la rivalidazione
+precede il turno. Le voci con una scrittura propria in coda restano fissate in
+memoria (né TTL né LRU) finché la scrittura non è confermata. Le scritture concorrenti restano coperte dalla precondizione
+last_update_time delle write (memory.save_user_deltas).
+"""
+
+import asyncio
+
+import copy
+import logging
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from ..metrics import context_cache_lookups
+from .workers import submit
+from ..utils.memo import get_cache
+
+log = logging.getLogger("sofia.context_cache")
+
+# Finestra in cui un contesto in cache è servito senza alcuna lettura
+FRESH_SECONDS = float(os.getenv("SOFIA_CONTEXT_FRESH_S", "10"))
+# Oltre FRESH_SECONDS e fino a qui: servito subito, rivalidato in background
+# (copre la pausa tipica tra due turni di una conversazione WhatsApp)
+STALE_SECONDS = float(os.getenv("SOFIA_CONTEXT_STALE_S", "900"))
+
+# update_time sentinel used when revalidation fails (forces a reload)
+_MISMATCH = object()
+
+class HotContextCache:
+    """
+    Cache of persisted-field snapshots keyed by phone. Entries:
+    snapshot, update_time of the users doc, version (bumped on own writes),
+    pending (own write queued, not committed yet), checked_at.
+    Entries live for stale_seconds; pending ones are also pinned in _pending
+    so the unsaved state survives TTL/LRU eviction until the write commits.
+    """
+
+    def __init__(self, name: str = "context", fresh_seconds: float = FRESH_SECONDS,
+                 stale_seconds: float = STALE_SECONDS):
+        self.cache = get_cache(name)
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        self._pending: Dict[str, dict] = {}  # phone → entry with an uncommitted own write
+        self._lock = threading.Lock()
+        self.counts = {"fresh": 0, "background": 0, "revalidated": 0, "stale": 0, "miss": 0}
+        self.background_stale = 0  # background checks that found a foreign write
+        self._background: set = set()  # in-flight background checks (futures / tasks)
+
+    def _ttl(self) -> float:
+        return max(self.fresh_seconds, self.stale_seconds, self.cache.ttl)
+
+    def _entry(self, phone: str) -> Optional[dict]:
+        """Cached entry; a pinned pending entry is put back if the cache evicted it"""
+        entry = self.cache.get(phone)
+        if entry is None:
+            entry = self._pending.get(phone)
+            if entry is not None:
+                self.cache.set(phone, entry, ttl=self._ttl())
+        return entry
+
+    def _count(self, result: str):
+        with self._lock:
+            self.counts[result] += 1
+        context_cache_lookups.labels(result=result).inc()
+
+    def _lookup(self, phone: str):
+        """
+        (snapshot, None) when fresh; (snapshot, entry) when served now and
+        revalidated in background; (None, entry) when it must be revalidated
+        first; (None, None) on miss.
+        """
+        entry = self._entry(phone)
+        if entry is None:
+            self._count("miss")
+            return None, None
+        age = time.monotonic() - entry["checked_at"]
+        if entry["pending"] or age < self.fresh_seconds:
+            # Own write not committed yet: this instance has the newest state
+            self._count("fresh")
+            return copy.deepcopy(entry["snapshot"]), None
+        if age < self.stale_seconds:
+            self._count("background")
+            with self._lock:
+                check = not entry.get("checking")
+                entry["checking"] = True
+            return copy.deepcopy(entry["snapshot"]), entry if check else None
+        return None, entry
+
+    def _checked(self, phone: str, entry: dict, update_time: Any):
+        """Outcome of a background check: a foreign write drops the entry (next load reloads)"""
+        with self._lock:
+            entry["checking"] = False
+            current = self._entry(phone)
+            if current is not entry:
+                return
+            if update_time == entry["update_time"]:
+                entry["checked_at"] = time.monotonic()
+                return
+        self.cache.delete(phone)
+        self.background_stale += 1
+        log.info(f"🔄 Context of {phone} changed elsewhere: reloaded on the next turn")
+
+    def _check(self, phone: str, entry: dict, update_time_fn: Callable[[str], Any]):
+        try:
+            update_time = update_time_fn(phone)
+        except Exception as e:
+            log.warning(f"⚠️ Background revalidation failed for {phone}: {e}")
+            update_time = _MISMATCH
+        self._checked(phone, entry, update_time)
+
+    async def _acheck(self, phone: str, entry: dict, update_time_fn: Callable[[str], Awaitable[Any]]):
+        try:
+            update_time = await update_time_fn(phone)
+        except Exception as e:
+            log.warning(f"⚠️ Background revalidation failed for {phone}: {e}")
+            update_time = _MISMATCH
+        self._checked(phone, entry, update_time)
+
+    def _track(self, job):
+        self._background.add(job)
+        job.add_done_callback(self._background.discard)
+
+    def _revalidate(self, phone: str, entry: dict, update_time: Any) -> Optional[dict]:
+        with self._lock:
+            current = self._entry(phone)
+            if current is entry and update_time == entry["update_time"]:
+                entry["checked_at"] = time.monotonic()
+                matched = True
+            else:
+                matched = False
+        if not matched:
+            self.cache.delete(phone)
+            self._count("stale")
+            return None
+        self._count("revalidated")
+        return copy.deepcopy(entry["snapshot"])
+
+    def get(self, phone: str, update_time_fn: Callable[[str], Any]) -> Optional[dict]:
+        """
+        Snapshot for phone (a copy) or None on miss/stale. update_time_fn
+        reads the current update_time of users/{phone} for revalidation.
+        """
+        snapshot, entry = self._lookup(phone)
+        if entry is None:
+            return snapshot
+        if snapshot is not None:
+            self._track(submit(self._check, phone, entry, update_time_fn))
+            return snapshot
+        try:
+            update_time = update_time_fn(phone)
+        except Exception as e:
+            log.warning(f"⚠️ Context revalidation failed for {phone}: {e}")
+            update_time = _MISMATCH
+        return self._revalidate(phone, entry, update_time)
+
+    async def aget(self, phone: str, update_time_fn: Callable[[str], Awaitable[Any]]) -> Optional[dict]:
+        """Async get: update_time_fn is a coroutine function"""
+        snapshot, entry = self._lookup(phone)
+        if entry is None:
+            return snapshot
+        if snapshot is not None:
+            self._track(asyncio.get_running_loop().create_task(self._acheck(phone, entry, update_time_fn)))
+            return snapshot
+        try:
+            update_time = await update_time_fn(phone)
+        except Exception as e:
+            log.warning(f"⚠️ Context revalidation failed for {phone}: {e}")
+            update_time = _MISMATCH
+        return self._revalidate(phone, entry, update_time)
+
+    def loaded(self, phone: str, snapshot: dict, update_time: Any):
+        """Store a snapshot just read from Firestore"""
+        with self._lock:
+            if phone in self._pending:
+                return  # own write still queued: the pinned entry is newer
+        self.cache.set(phone, {
+            "snapshot": copy.deepcopy(snapshot),
+            "update_time": update_time,
+            "version": 0,
+            "pending": False,
+            "checked_at": time.monotonic(),
+        }, ttl=self._ttl())
+
+    def written(self, phone: str, snapshot: dict) -> int:
+        """Write-through of an own write; returns the version to confirm on commit"""
+        with self._lock:
+            entry = self._entry(phone)
+            version = entry["version"] + 1 if entry else 1
+            update_time = entry["update_time"] if entry else None
+            entry = {
+                "snapshot": copy.deepcopy(snapshot),
+                "update_time": update_time,
+                "version": version,
+                "pending": True,
+                "checked_at": time.monotonic(),
+            }
+            self._pending[phone] = entry
+            self.cache.set(phone, entry, ttl=self._ttl())
+        return version
+
+    def committed(self, phone: str, version: int, update_time: Any, conflict: bool = False):
+        """
+        Own write committed: record its update_time (still pending if a newer
+        write is queued). On a write conflict the entry is dropped once no own
+        write is pending, so the next load reads the merged doc.
+        """
+        drop = False
+        with self._lock:
+            entry = self._entry(phone)
+            if entry is not None:
+                entry["update_time"] = update_time
+                entry["conflict"] = entry.get("conflict") or conflict
+                if entry["version"] == version:
+                    entry["pending"] = False
+                    entry["checked_at"] = time.monotonic()
+                    self._pending.pop(phone, None)
+                    drop = entry["conflict"]
+        if drop:
+            self.cache.delete(phone)
+            log.info(f"🔄 Context of {phone} was also written elsewhere: reloaded on the next turn")
+
+    def update_time(self, phone: str) -> Any:
+        """update_time of the users doc as last read/written by this instance (None if unknown)"""
+        entry = self._entry(phone)
+        return entry["update_time"] if entry is not None else None
+
+    def invalidate(self, phone: str):
+        with self._lock:
+            self._pending.pop(phone, None)
+        self.cache.delete(phone)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        lookups = sum(counts.values())
+        return {
+            **counts,
+            "size": len(self.cache),
+            "pinned": len(self._pending),
+            "hit_rate": (counts["fresh"] + counts["background"] + counts["revalidated"]) / lookups if lookups else 0.0,
+            "stale_rate": counts["stale"] / lookups if lookups else 0.0,
+            "background_stale": self.background_stale,
+        }
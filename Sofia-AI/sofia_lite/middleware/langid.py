@@ -0,0 +1,171 @@
+"""
+Sofia Lite - Layered language identification
+1. Scrittura Unicode: arabo/devanagari/bengali risolti subito (urdu vs arabo
+   dalle lettere caratteristiche)
+2. Lingue in alfabeto latino: profili di n-grammi di caratteri precalcolati
+   dal catalogo messaggi (policy/language_support.py)
+3. Lingua "sticky" per conversazione: si cambia solo con confidenza alta,
+   o con la stessa lingua candidata per due turni di fila
+Nessun langdetect: tutto in memoria, deterministico.
+"""
+
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+log = logging.getLogger("sofia.langid")
+
+LATIN_LANGS = ["it", "en", "fr", "es", "wo"]
+
+# Lettere usate in urdu ma non in arabo, e viceversa
+_URDU_LETTERS = set("ٹڈڑںےہھۓپچژگکی")
+_ARABIC_LETTERS = set("ةىكي")
+
+# Cambio lingua immediato sopra questa confidenza; sopra PENDING serve conferma al turno dopo
+SWITCH_CONFIDENCE = float(os.getenv("SOFIA_LANG_SWITCH_CONFIDENCE", "0.9"))
+PENDING_CONFIDENCE = float(os.getenv("SOFIA_LANG_PENDING_CONFIDENCE", "0.6"))
+# Messaggi più corti ("ok", un nome) non spostano mai la lingua della conversazione
+SWITCH_MIN_TOKENS = int(os.getenv("SOFIA_LANG_SWITCH_MIN_TOKENS", "3"))
+
+# Pendenza della softmax sulla log-verosimiglianza media per n-gramma
+_SHARPNESS = 8.0
+# N-grammi per evidenza piena (~4 parole): sotto, la confidenza scala in proporzione
+_FULL_EVIDENCE_NGRAMS = 60
+_WORD = re.compile(r"[^\W\d_]+")
+
+def _script_of(ch: str) -> Optional[str]:
+    code = ord(ch)
+    if 0x0600 <= code <= 0x06FF or 0x0750 <= code <= 0x077F or 0xFB50 <= code <= 0xFEFF:
+        return "arabic"
+    if 0x0900 <= code <= 0x097F:
+        return "devanagari"
+    if 0x0980 <= code <= 0x09FF:
+        return "bengali"
+    if ch.isalpha():
+        return "latin"
+    return None
+
+def script_lang(text: str) -> Optional[Tuple[str, float]]:
+    """(lang, confidence) when a non-Latin script dominates the text, else None"""
+    scripts = Counter(s for s in map(_script_of, text) if s)
+    if not scripts:
+        return None
+    script, count = scripts.most_common(1)[0]
+    if script == "latin":
+        return None
+    confidence = count / sum(scripts.values())
+    if script == "devanagari":
+        return "hi", confidence
+    if script == "bengali":
+        return "bn", confidence
+    urdu = sum(ch in _URDU_LETTERS for ch in text)
+    arabic = sum(ch in _ARABIC_LETTERS for ch in text)
+    return ("ur" if urdu > arabic else "ar"), confidence
+
+def char_ngrams(text: str, sizes: Iterable[int] = (1, 2, 3)) -> List[str]:
+    """Character n-grams of every word, padded with spaces at word edges"""
+    grams = []
+    for word in _WORD.findall(text.lower()):
+        padded = f" {word} "
+        for n in sizes:
+            grams.extend(g for g in (padded[i:i + n] for i in range(len(padded) - n + 1)) if g.strip())
+    return grams
+
+class NgramProfiles:
+    """Per-language character n-gram log-probabilities (add-one smoothing)"""
+
+    def __init__(self, samples: Dict[str, List[str]]):
+        counts = {lang: Counter(g for text in texts for g in char_ngrams(text)) for lang, texts in samples.items()}
+        vocab = len(set().union(*counts.values())) or 1
+        self.langs = list(counts)
+        self._logprob: Dict[str, Dict[str, float]] = {}
+        self._unseen: Dict[str, float] = {}
+        for lang, counter in counts.items():
+            denominator = sum(counter.values()) + vocab
+            self._logprob[lang] = {g: math.log((c + 1) / denominator) for g, c in counter.items()}
+            self._unseen[lang] = math.log(1 / denominator)
+
+    def classify(self, text: str) -> Optional[Tuple[str, float]]:
+        """
+        (lang, confidence) or None when the text has no letters. The softmax
+        is overconfident on a word or two: confidence is scaled by the evidence.
+        """
+        grams = char_ngrams(text)
+        if not grams:
+            return None
+        scores = {}
+        for lang in self.langs:
+            table, unseen = self._logprob[lang], self._unseen[lang]
+            scores[lang] = _SHARPNESS * sum(table.get(g, unseen) for g in grams) / len(grams)
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(s - scores[best]) for s in scores.values())
+        return best, min(1.0, len(grams) / _FULL_EVIDENCE_NGRAMS) / total
+
+# Parole frequenti delle risposte brevi: il catalogo da solo copre male
+# "va bene", "quiero", "vale", ... (il seed pesa come una frase del catalogo)
+_SEED_WORDS = {
+    "it": "si sì no va bene ok grazie vorrei voglio posso ho sono il lo la le gli un una di da del della "
+          "per con che come quando dove perché anche ancora molto allora certo perfetto esatto prego "
+          "rinnovare permesso soggiorno cittadinanza ricongiungimento domani oggi mattina pomeriggio sera",
+    "en": "yes no ok okay thanks thank you please i want would like need can have am is are the a an "
+          "of to for with what how when where why also still very sure fine great right "
+          "renew permit residence citizenship family tomorrow today morning afternoon evening",
+    "fr": "oui non d'accord merci je veux voudrais peux ai suis est le la les un une des du de pour avec "
+          "que comment quand où pourquoi aussi encore très bien parfait exactement "
+          "renouveler titre séjour nationalité regroupement demain aujourd'hui matin après-midi soir",
+    "es": "sí si no vale bueno gracias quiero quisiera puedo tengo soy estoy el la los las un una de del "
+          "para con que cómo cuando dónde por qué también todavía muy claro perfecto exacto "
+          "renovar permiso residencia ciudadanía reagrupación mañana hoy tarde noche",
+    "wo": "waaw déedéet jërëjëf dama bëgg mën am naa nga la ci ak ngir lan naka kañ fan waaw "
+          "yëgël bataaxal dëkk réew njaboot suba tey ngoon guddi",
+}
+
+def _catalogue_samples() -> Dict[str, List[str]]:
+    from ..policy.language_support import _MSG
+    return {
+        lang: [messages[lang] for messages in _MSG.values() if lang in messages] + [_SEED_WORDS[lang]]
+        for lang in LATIN_LANGS
+    }
+
+_profiles: Optional[NgramProfiles] = None
+
+def get_profiles() -> NgramProfiles:
+    """Latin-script profiles, built once from the message catalogue"""
+    global _profiles
+    if _profiles is None:
+        _profiles = NgramProfiles(_catalogue_samples())
+        log.info(f"🌍 Language profiles built for {_profiles.langs}")
+    return _profiles
+
+def identify(text: str) -> Optional[Tuple[str, float]]:
+    """(lang, confidence): script first, then the Latin n-gram profiles"""
+    return script_lang(text) or get_profiles().classify(text)
+
+def sticky_lang(slots: Dict, detected: str, confidence: float, tokens: Optional[int] = None) -> str:
+    """
+    Conversation language with hysteresis, kept in ctx.slots: a different
+    language wins only with high confidence, or when it is the candidate
+    of two consecutive turns; messages under SWITCH_MIN_TOKENS never count.
+    """
+    current = slots.get("lang_confirmed")
+    if current is None or detected == current:
+        slots["lang_confirmed"] = detected
+        slots.pop("lang_pending", None)
+        return detected
+    if tokens is not None and tokens < SWITCH_MIN_TOKENS:
+        return current
+    if confidence >= SWITCH_CONFIDENCE or (
+        confidence >= PENDING_CONFIDENCE and slots.get("lang_pending") == detected
+    ):
+        log.info(f"🔀 Language switch {current} -> {detected} (conf: {confidence:.2f})")
+        slots["lang_confirmed"] = detected
+        slots.pop("lang_pending", None)
+        return detected
+    if confidence >= PENDING_CONFIDENCE:
+        slots["lang_pending"] = detected
+    else:
+        slots.pop("lang_pending", None)
+    return current
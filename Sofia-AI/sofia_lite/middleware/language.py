@@ -4,78 +4,61 @@ Sofia Lite - Language Detection Middleware
 
 import logging
 import functools
-from typing import Optional
+from typing import Optional, Tuple
+from .langid import identify, sticky_lang
 from .latency import track_latency
+from ..utils.name_extract import needs_name
 from ..utils.memo import ttl_cache
 
 log = logging.getLogger("sofia.language")
 
+# Sotto questa confidenza il riconoscimento per parole chiave ha la precedenza
+KEYWORD_OVERRIDE_CONFIDENCE = 0.5
+
 # TTL cache per language detection - Δmini optimization
-@ttl_cache(ttl=30, maxsize=256)
-def _cached_detect_lang(text: str) -> str:
-    """Cached language detection with TTL 1 hour (handled by LRU)"""
+@ttl_cache(name="lang")
+def _cached_identify(text: str) -> Tuple[str, float]:
+    """Cached layered detection: (lang, confidence)"""
     return _detect_lang_impl(text)
 
-def _detect_lang_impl(text: str) -> str:
+def _detect_lang_impl(text: str) -> Tuple[str, float]:
     """
-    Detect language from text with double fallback.
-    Returns ISO-2 language code (it, en, fr, es, ar, hi, ur, bn, wo)
+    Layered detection: Unicode script → Latin n-gram profiles → keywords.
+    Returns (ISO-2 code among it, en, fr, es, ar, hi, ur, bn, wo; confidence)
     """
-    try:
-        from langdetect import detect as langdetect_detect
-        
-        # Clean text for better detection
-        clean_text = text.strip()[:100]  # Use first 100 chars
-        
-        if not clean_text:
-            return "it"  # Default to Italian
-        
-        # Fallback 1: langdetect (fast probabilistic)
-        try:
-            lang = langdetect_detect(clean_text)
-            lang_map = {
-                "it": "it",  # Italian
-                "en": "en",  # English
-                "fr": "fr",  # French
-                "es": "es",  # Spanish
-                "ar": "ar",  # Arabic
-                "hi": "hi",  # Hindi
-                "ur": "ur",  # Urdu
-                "bn": "bn",  # Bengali
-                "wo": "wo",  # Wolof
-            }
-            
-            detected_lang = lang_map.get(lang, None)
-            if detected_lang:
-                log.info(f"🌍 Langdetect: {lang} -> {detected_lang}")
-                return detected_lang
-                
-        except Exception as e:
-            log.warning(f"Langdetect failed: {e}")
-        
-        # Fallback 2: keyword-based detection
-        detected_lang = detect_by_keywords(clean_text)
-        if detected_lang:
-            log.info(f"🔍 Keyword detection: {detected_lang}")
-            return detected_lang
-        
-        # Fallback 3: default to Italian
-        log.warning("All language detection failed, defaulting to Italian")
-        return "it"
-        
-    except Exception as e:
-        log.error(f"Language detection completely failed: {e}, defaulting to Italian")
-        return "it"
+    clean_text = text.strip()[:100]  # Use first 100 chars
+    if not clean_text:
+        return "it", 0.0  # Default to Italian
+    
+    result = identify(clean_text)
+    if result and result[1] >= KEYWORD_OVERRIDE_CONFIDENCE:
+        log.info(f"🌍 Language: {result[0]} (conf: {result[1]:.2f})")
+        return result
+    
+    # Fallback: keyword-based detection
+    detected_lang = detect_by_keywords(clean_text)
+    if detected_lang:
+        log.info(f"🔍 Keyword detection: {detected_lang}")
+        return detected_lang, KEYWORD_OVERRIDE_CONFIDENCE
+    
+    if result:
+        return result
+    
+    # Fallback: default to Italian
+    log.warning("All language detection failed, defaulting to Italian")
+    return "it", 0.0
+
+def identify_lang(text: str) -> Tuple[str, float]:
+    """(lang, confidence) with the shared "lang" cache"""
+    return _cached_identify(" ".join(text.lower().split())[:100])
 
 @track_latency("LANG")
 def detect_lang(text: str) -> str:
     """
-    Detect language from text with micro-cache LRU(512).
+    Detect language from text (cached, no langdetect on the hot path).
     Returns ISO-2 language code (it, en, fr, es, ar, hi, ur, bn, wo)
     """
-    # Use cached detection with text[:32] for cache key
-    cache_key = text[:32]
-    return _cached_detect_lang(cache_key)
+    return identify_lang(text)[0]
 
 def heuristic_lang(text: str) -> Optional[str]:
     """
@@ -113,11 +96,13 @@ def detect_lang_with_heuristics(text: str, ctx=None) -> tuple[str, Optional[str]
     Detect language with post-detect heuristics and 1-shot cache.
     Returns (lang, extra_tag) where extra_tag can be "GREETING_QUICK"
     """
-    # Check 1-shot cache first
+    # Conversation language known: sticky, switches only on confident evidence
     if ctx and ctx.slots.get("lang_confirmed"):
-        cached_lang = ctx.slots["lang_confirmed"]
-        log.info(f"🔄 Using cached language: {cached_lang}")
-        return cached_lang, None
+        if needs_name(ctx):
+            # ASK_NAME: the reply is usually just a name, no evidence of a language
+            return ctx.slots["lang_confirmed"], None
+        detected, confidence = identify_lang(text)
+        return sticky_lang(ctx.slots, detected, confidence, len(text.split())), None
     
     # Try heuristic detection first
     heuristic_result = heuristic_lang(text)
@@ -4,6 +4,7 @@ F21 PERFORMANCE SWAT - Profiling e ottimizzazioni
 """
 
 import time
+import asyncio
 import functools
 import logging
 from typing import Callable, Any, Dict
@@ -22,60 +23,78 @@ def track_latency(tag: str):
         tag: Tag identificativo per il tipo di operazione (LLM, LANG, RAG, TOTAL)
     """
     def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs) -> Any:
+                start_time = time.time()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    _record_error(tag, func, start_time, e)
+                    raise
+                _record_success(tag, func, start_time)
+                return result
+            
+            return async_wrapper
+        
         @functools.wraps(func)
         def wrapper(*args, **kwargs) -> Any:
             start_time = time.time()
-            start_ms = int(start_time * 1000)
-            
             try:
                 result = func(*args, **kwargs)
-                end_time = time.time()
-                duration_ms = int((end_time - start_time) * 1000)
-                
-                # Log strutturato per Cloud Run
-                log.info(
-                    f"LATENCY_TRACK",
-                    extra={
-                        "tag": tag,
-                        "function": func.__name__,
-                        "start_ms": start_ms,
-                        "end_ms": int(end_time * 1000),
-                        "duration_ms": duration_ms,
-                        "success": True,
-                        "timestamp": datetime.now().isoformat()
-                    }
-                )
-                
-                # Aggiorna statistiche globali
-                if tag not in _latency_stats:
-                    _latency_stats[tag] = []
-                _latency_stats[tag].append(duration_ms)
-                
-                return result
-                
             except Exception as e:
-                end_time = time.time()
-                duration_ms = int((end_time - start_time) * 1000)
-                
-                # Log errori
-                log.error(
-                    f"LATENCY_TRACK_ERROR",
-                    extra={
-                        "tag": tag,
-                        "function": func.__name__,
-                        "start_ms": start_ms,
-                        "end_ms": int(end_time * 1000),
-                        "duration_ms": duration_ms,
-                        "success": False,
-                        "error": str(e),
-                        "timestamp": datetime.now().isoformat()
-                    }
-                )
+                _record_error(tag, func, start_time, e)
                 raise
+            _record_success(tag, func, start_time)
+            return result
                 
         return wrapper
     return decorator
 
+def _record_success(tag: str, func: Callable, start_time: float):
+    """Logga e registra una misura di latency riuscita"""
+    end_time = time.time()
+    duration_ms = int((end_time - start_time) * 1000)
+    
+    # Log strutturato per Cloud Run
+    log.info(
+        f"LATENCY_TRACK",
+        extra={
+            "tag": tag,
+            "function": func.__name__,
+            "start_ms": int(start_time * 1000),
+            "end_ms": int(end_time * 1000),
+            "duration_ms": duration_ms,
+            "success": True,
+            "timestamp": datetime.now().isoformat()
+        }
+    )
+    
+    # Aggiorna statistiche globali
+    if tag not in _latency_stats:
+        _latency_stats[tag] = []
+    _latency_stats[tag].append(duration_ms)
+
+def _record_error(tag: str, func: Callable, start_time: float, error: Exception):
+    """Logga una misura di latency fallita"""
+    end_time = time.time()
+    duration_ms = int((end_time - start_time) * 1000)
+    
+    # Log errori
+    log.error(
+        f"LATENCY_TRACK_ERROR",
+        extra={
+            "tag": tag,
+            "function": func.__name__,
+            "start_ms": int(start_time * 1000),
+            "end_ms": int(end_time * 1000),
+            "duration_ms": duration_ms,
+            "success": False,
+            "error": str(error),
+            "timestamp": datetime.now().isoformat()
+        }
+    )
+
 def get_latency_stats() -> Dict[str, Dict[str, float]]:
     """
     Restituisce le statistiche di latency aggregate.
@@ -1,89 +1,205 @@
-import openai, json, functools, asyncio, logging, tenacity
-from typing import Tuple
+import openai, httpx, json, functools, asyncio, logging, os, re, threading, tenacity
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
 from .. import get_config
 from .latency import track_latency
-from .http_session import get_session
+from ..utils.memo import get_cache
 
 log = logging.getLogger("sofia.llm")
 
-# Initialize OpenAI client with error handling
-_CLIENT = None
 _SEMAPHORE = asyncio.Semaphore(5)  # Max 5 concurrent calls
-_CACHE = {}  # Simple in-memory cache
 
 # Circuit breaker state
 _CIRCUIT = {"fail": 0, "open_until": 0}  # naïve CB
 _CB_TIMEOUT = 60  # sec
 
-def _get_client_sync():
-    """Get OpenAI client synchronously"""
-    global _CLIENT
-    if _CLIENT is None:
+# ─── OpenAI client registry ──────────────────────────────────────────────
+# One keep-alive pool (sync + async) shared by every timeout profile:
+# no more per-call OpenAI()/httpx.Client() construction and TLS handshakes.
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "classify_fast": {"timeout": 0.8, "max_retries": 0},
+    "chat":          {"timeout": 12.0, "max_retries": 1},  # F22 voice transcription support
+    "embeddings":    {"timeout": 10.0, "max_retries": 2},
+    "whisper":       {"timeout": 30.0, "max_retries": 1},
+}
+
+_POOL_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("SOFIA_LLM_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("SOFIA_LLM_MAX_KEEPALIVE", "20")),
+    keepalive_expiry=float(os.getenv("SOFIA_LLM_KEEPALIVE_EXPIRY", "45")),
+)
+
+_HTTP_SYNC: httpx.Client | None = None
+_HTTP_ASYNC: httpx.AsyncClient | None = None
+_SYNC_CLIENTS: Dict[str, openai.OpenAI] = {}
+_ASYNC_CLIENTS: Dict[str, openai.AsyncOpenAI] = {}
+_REGISTRY_LOCK = threading.Lock()
+_POOL_STATS = {
+    "sync": {"requests": 0, "errors": 0, "in_flight": 0, "peak_in_flight": 0},
+    "async": {"requests": 0, "errors": 0, "in_flight": 0, "peak_in_flight": 0},
+}
+_STATS_LOCK = threading.Lock()
+
+def _api_key() -> str:
+    api_key = get_config()["OPENAI_KEY"]
+    if not api_key:
+        raise RuntimeError("missing OPENAI_API_KEY")
+    return api_key
+
+def _on_request(kind: str):
+    def hook(request):
+        with _STATS_LOCK:
+            _POOL_STATS[kind]["requests"] += 1
+    return hook
+
+def _on_response(kind: str):
+    def hook(response):
+        if response.status_code >= 400:
+            with _STATS_LOCK:
+                _POOL_STATS[kind]["errors"] += 1
+    return hook
+
+def _async_hook(hook):
+    async def wrapper(obj):
+        hook(obj)
+    return wrapper
+
+def _track_in_flight(kind: str, delta: int):
+    with _STATS_LOCK:
+        stats = _POOL_STATS[kind]
+        stats["in_flight"] += delta
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+
+class _CountingTransport(httpx.HTTPTransport):
+    """Pooled transport that counts requests holding a connection (public transport API only)"""
+    def handle_request(self, request):
+        _track_in_flight("sync", 1)
         try:
-            cfg = get_config()
-            api_key = cfg["OPENAI_KEY"]
-            if not api_key:
-                raise RuntimeError("missing OPENAI_API_KEY")
-            
-            # Create client without async session
-            _CLIENT = openai.OpenAI(api_key=api_key)
-        except Exception as e:
-            print(f"⚠️ OpenAI client initialization failed: {e}")
-            raise RuntimeError("missing OPENAI_API_KEY")
-    return _CLIENT
+            return super().handle_request(request)
+        finally:
+            _track_in_flight("sync", -1)
 
-async def _get_client():
-    """Get OpenAI client with HTTP session reuse - Δmini optimization"""
-    global _CLIENT
-    if _CLIENT is None:
+class _AsyncCountingTransport(httpx.AsyncHTTPTransport):
+    """Async counterpart of _CountingTransport"""
+    async def handle_async_request(self, request):
+        _track_in_flight("async", 1)
         try:
-            cfg = get_config()
-            api_key = cfg["OPENAI_KEY"]
-            if not api_key:
-                raise RuntimeError("missing OPENAI_API_KEY")
-            
-            # Reuse HTTP session for better performance
-            session = await get_session()
-            _CLIENT = openai.OpenAI(
-                api_key=api_key,
-                http_client=session._client  # Reuse aiohttp session
-            )
-        except Exception as e:
-            print(f"⚠️ OpenAI client initialization failed: {e}")
-            raise RuntimeError("missing OPENAI_API_KEY")
-    return _CLIENT
-
-def _cache_key(func_name: str, *args) -> str:
-    """Generate cache key for function calls"""
-    return f"{func_name}:{hash(str(args))}"
+            return await super().handle_async_request(request)
+        finally:
+            _track_in_flight("async", -1)
 
-def _get_cached(key: str, ttl: int = 30) -> any:
-    """Get cached value if not expired"""
-    import time
-    if key in _CACHE:
-        value, timestamp = _CACHE[key]
-        if time.time() - timestamp < ttl:
-            return value
-        else:
-            del _CACHE[key]
-    return None
+def _get_http_sync() -> httpx.Client:
+    global _HTTP_SYNC
+    if _HTTP_SYNC is None or _HTTP_SYNC.is_closed:
+        _HTTP_SYNC = httpx.Client(
+            transport=_CountingTransport(limits=_POOL_LIMITS),
+            event_hooks={"request": [_on_request("sync")], "response": [_on_response("sync")]},
+        )
+    return _HTTP_SYNC
 
-def _set_cached(key: str, value: any):
-    """Set cached value with timestamp"""
-    import time
-    _CACHE[key] = (value, time.time())
+def _get_http_async() -> httpx.AsyncClient:
+    global _HTTP_ASYNC
+    if _HTTP_ASYNC is None or _HTTP_ASYNC.is_closed:
+        _HTTP_ASYNC = httpx.AsyncClient(
+            transport=_AsyncCountingTransport(limits=_POOL_LIMITS),
+            event_hooks={"request": [_async_hook(_on_request("async"))],
+                         "response": [_async_hook(_on_response("async"))]},
+        )
+    return _HTTP_ASYNC
+
+def get_openai_client(profile: str = "chat") -> openai.OpenAI:
+    """Shared sync OpenAI client for a timeout profile (classify_fast, chat, embeddings, whisper)"""
+    client = _SYNC_CLIENTS.get(profile)
+    if client is None:
+        with _REGISTRY_LOCK:
+            client = _SYNC_CLIENTS.get(profile)
+            if client is None:
+                opts = PROFILES[profile]
+                client = openai.OpenAI(
+                    api_key=_api_key(),
+                    http_client=_get_http_sync(),
+                    timeout=opts["timeout"],
+                    max_retries=opts["max_retries"],
+                )
+                _SYNC_CLIENTS[profile] = client
+                log.info(f"✅ OpenAI sync client ready (profile={profile})")
+    return client
+
+def get_async_openai_client(profile: str = "chat") -> openai.AsyncOpenAI:
+    """Shared async OpenAI client for a timeout profile"""
+    client = _ASYNC_CLIENTS.get(profile)
+    if client is None:
+        with _REGISTRY_LOCK:
+            client = _ASYNC_CLIENTS.get(profile)
+            if client is None:
+                opts = PROFILES[profile]
+                client = openai.AsyncOpenAI(
+                    api_key=_api_key(),
+                    http_client=_get_http_async(),
+                    timeout=opts["timeout"],
+                    max_retries=opts["max_retries"],
+                )
+                _ASYNC_CLIENTS[profile] = client
+                log.info(f"✅ OpenAI async client ready (profile={profile})")
+    return client
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Connection-pool usage for the shared OpenAI clients"""
+    return {
+        "limits": {
+            "max_connections": _POOL_LIMITS.max_connections,
+            "max_keepalive_connections": _POOL_LIMITS.max_keepalive_connections,
+            "keepalive_expiry": _POOL_LIMITS.keepalive_expiry,
+        },
+        "profiles": {"sync": sorted(_SYNC_CLIENTS), "async": sorted(_ASYNC_CLIENTS)},
+        "sync": dict(_POOL_STATS["sync"]),
+        "async": dict(_POOL_STATS["async"]),
+    }
+
+def close_clients():
+    """Close the sync pool (scripts / lifespan shutdown)"""
+    global _HTTP_SYNC
+    with _REGISTRY_LOCK:
+        _SYNC_CLIENTS.clear()
+        if _HTTP_SYNC is not None:
+            _HTTP_SYNC.close()
+            _HTTP_SYNC = None
+
+async def aclose_clients():
+    """Close both pools (FastAPI lifespan shutdown)"""
+    global _HTTP_ASYNC
+    close_clients()
+    with _REGISTRY_LOCK:
+        _ASYNC_CLIENTS.clear()
+        http_async, _HTTP_ASYNC = _HTTP_ASYNC, None
+    if http_async is not None:
+        await http_async.aclose()
+    log.info("🔒 OpenAI client pools closed")
+
+def _get_client_sync():
+    """Get OpenAI client synchronously"""
+    return get_openai_client("chat")
+
+async def _get_client():
+    """Get async OpenAI client sharing the keep-alive pool"""
+    return get_async_openai_client("chat")
+
+def _cache_key(func_name: str, *args) -> tuple:
+    """Generate cache key for function calls"""
+    return (func_name,) + args
 
 _SYS = ("Return ONLY JSON: "
         '{"intent":"<INTENT>","confidence":<0-1>}  '
         "INTENT=GREET,ASK_NAME,ASK_SERVICE,PROPOSE_CONSULT,"
         "ASK_CHANNEL,ASK_SLOT,ASK_PAYMENT,CONFIRM,ROUTE_ACTIVE,CLARIFY,ABUSE.")
 
-@functools.lru_cache(maxsize=2048)
 async def _classify_async(msg: str, lang="it") -> Tuple[str, float]:
     """Classify intent with TTL 5 min cache - Δmini optimization"""
     # Check cache first
+    cache = get_cache("classify")
     cache_key = _cache_key("classify", msg, lang)
-    cached_result = _get_cached(cache_key, ttl=30)
+    cached_result = cache.get(cache_key)
     if cached_result:
         return cached_result
     
@@ -95,11 +211,10 @@ async def _classify_async(msg: str, lang="it") -> Tuple[str, float]:
         if "PROPOSE_CONSULT" in _SYS or "ASK_PAYMENT" in _SYS:
             max_tokens = 48  # Keep 48 only for complex intents
         
-        chat = client.chat.completions.create(
+        chat = await client.chat.completions.create(
             model="gpt-4o-mini",
             temperature=0,
             messages=[{"role":"user","content":f"{_SYS}\nUser({lang}): {msg}"}],
-            timeout=12.0,  # 12 second timeout - F22 voice transcription support
             max_tokens=max_tokens,  # Dynamic token budget - Δmini optimization
             stream=False  # Disable streaming for now
         )
@@ -107,7 +222,7 @@ async def _classify_async(msg: str, lang="it") -> Tuple[str, float]:
         result = (data["intent"], float(data["confidence"]))
         
         # Cache the result
-        _set_cached(cache_key, result)
+        cache.set(cache_key, result)
         return result
         
     except Exception as e:
@@ -120,8 +235,9 @@ def classify(msg: str, lang="it") -> Tuple[str, float]:
         client = _get_client_sync()
         
         # Check cache first
+        cache = get_cache("classify")
         cache_key = _cache_key("classify", msg, lang)
-        cached_result = _get_cached(cache_key, ttl=30)
+        cached_result = cache.get(cache_key)
         if cached_result:
             return cached_result
         
@@ -134,7 +250,6 @@ def classify(msg: str, lang="it") -> Tuple[str, float]:
             model="gpt-4o-mini",
             temperature=0,
             messages=[{"role":"user","content":f"{_SYS}\nUser({lang}): {msg}"}],
-            timeout=12.0,  # 12 second timeout - F22 voice transcription support
             max_tokens=max_tokens,  # Dynamic token budget - Δmini optimization
             stream=False  # Disable streaming for now
         )
@@ -142,13 +257,80 @@ def classify(msg: str, lang="it") -> Tuple[str, float]:
         result = (data["intent"], float(data["confidence"]))
         
         # Cache the result
-        _set_cached(cache_key, result)
+        cache.set(cache_key, result)
         return result
         
     except Exception as e:
         log.error(f"Classification failed: {e}")
         return "CLARIFY", 0.1
 
+def _chat_params(sys_prompt: str, user_prompt: str) -> Dict[str, Any]:
+    # Δmini optimization: Compact prompts & token budget
+    max_tokens = 24  # Reduced for intents/greet/ask-XXX
+    if "PROPOSE_CONSULT" in sys_prompt or "ASK_PAYMENT" in sys_prompt:
+        max_tokens = 48  # Keep 48 only for complex intents
+    return dict(
+        model="gpt-4o-mini",
+        temperature=0.3,
+        messages=[{"role":"system","content":sys_prompt},
+                  {"role":"user","content":user_prompt}],
+        max_tokens=max_tokens,  # Dynamic token budget - Δmini optimization
+    )
+
+# ─── Streaming ───────────────────────────────────────────────────────────
+# Fine frase: punteggiatura (anche ur/hi/bn/ar) seguita da spazio
+_SENTENCE_END = re.compile(r"(?<=[.!?…。؟۔।])\s+")
+
+# Sink delle frasi per il turno corrente (voice pipeline); run_blocking/submit
+# copiano il contextvars.Context, quindi arriva anche agli skill nel pool
+_SENTENCE_SINK: contextvars.ContextVar[Optional[Callable[[str], None]]] = \
+    contextvars.ContextVar("sofia_sentence_sink", default=None)
+
+@contextmanager
+def reply_stream(sink: Callable[[str], None]):
+    """While active, LLM replies are streamed and each sentence is passed to sink"""
+    token = _SENTENCE_SINK.set(sink)
+    try:
+        yield
+    finally:
+        _SENTENCE_SINK.reset(token)
+
+def stream_chat(sys_prompt: str, user_prompt: str) -> Iterator[str]:
+    """Yield reply tokens as they are generated (no cache, no fallback)"""
+    client = _get_client_sync()
+    stream = client.chat.completions.create(**_chat_params(sys_prompt, user_prompt), stream=True)
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def iter_sentences(tokens: Iterable[str]) -> Iterator[str]:
+    """Group a token stream into sentences, yielding each as soon as it ends"""
+    buffer = ""
+    for token in tokens:
+        buffer += token
+        while (match := _SENTENCE_END.search(buffer)) is not None:
+            sentence, buffer = buffer[:match.start()].strip(), buffer[match.end():]
+            if sentence:
+                yield sentence
+    if buffer.strip():
+        yield buffer.strip()
+
+def stream_sentences(sys_prompt: str, user_prompt: str) -> Iterator[str]:
+    """Yield the reply sentence by sentence while it is generated"""
+    return iter_sentences(stream_chat(sys_prompt, user_prompt))
+
+def _streamed_chat(sys_prompt: str, user_prompt: str, sink: Callable[[str], None]) -> str:
+    tokens = []
+
+    def collect():
+        for token in stream_chat(sys_prompt, user_prompt):
+            tokens.append(token)
+            yield token
+
+    for sentence in iter_sentences(collect()):
+        sink(sentence)
+    return "".join(tokens).strip()
+
 @track_latency("LLM")
 def _raw_chat(sys_prompt: str, user_prompt: str) -> str:
     """For skill replies (slow path, full ParaHelp)."""
@@ -156,36 +338,28 @@ def _raw_chat(sys_prompt: str, user_prompt: str) -> str:
     log.info(f"📋 System prompt preview: {sys_prompt[:200]}...")
     
     # Check cache first
+    cache = get_cache("chat")
     cache_key = _cache_key("chat", sys_prompt, user_prompt)
-    cached_result = _get_cached(cache_key, ttl=30)
+    cached_result = cache.get(cache_key)
     if cached_result:
         log.info(f"💾 Using cached result: {cached_result[:100]}...")
         return cached_result
     
-    client = _get_client_sync()
-    
     try:
         log.info(f"🚀 Making OpenAI API call...")
-        # Δmini optimization: Compact prompts & token budget
-        max_tokens = 24  # Reduced for intents/greet/ask-XXX
-        if "PROPOSE_CONSULT" in sys_prompt or "ASK_PAYMENT" in sys_prompt:
-            max_tokens = 48  # Keep 48 only for complex intents
-        
-        rsp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            temperature=0.3,
-            messages=[{"role":"system","content":sys_prompt},
-                      {"role":"user","content":user_prompt}],
-            timeout=12.0,  # 12 second timeout - F22 voice transcription support
-            max_tokens=max_tokens,  # Dynamic token budget - Δmini optimization
-            stream=False  # Disable streaming for now
-        )
-        result = rsp.choices[0].message.content.strip()
+        sink = _SENTENCE_SINK.get()
+        if sink is not None:
+            # Voice: sentences reach TTS while the rest is still generating
+            result = _streamed_chat(sys_prompt, user_prompt, sink)
+        else:
+            client = _get_client_sync()
+            rsp = client.chat.completions.create(**_chat_params(sys_prompt, user_prompt), stream=False)
+            result = rsp.choices[0].message.content.strip()
         
         log.info(f"✅ LLM Response: {result[:100]}...")
         
         # Cache the result
-        _set_cached(cache_key, result)
+        cache.set(cache_key, result)
         return result
         
     except Exception as e:
@@ -211,21 +385,73 @@ def _fallback(messages) -> str:
         log.error(f"❌ Fallback failed: {e}")
         return "Mi dispiace, c'è stato un errore. Riprova tra qualche minuto."
 
-def chat(sys_prompt: str, user_prompt: str) -> str:
-    """Circuit breaker wrapper for LLM chat (synchronous for compatibility)"""
+def _chat_with_status(sys_prompt: str, user_prompt: str) -> Tuple[str, bool]:
+    """Circuit breaker wrapper: returns (reply, True) from the LLM or (fallback, False)"""
     import time
     now = time.time()
     if _CIRCUIT["open_until"] > now:
         log.warning("LLM CB OPEN – serving fallback")
-        return _fallback([{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}])
+        return _fallback([{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}]), False
 
     try:
         rsp = _raw_chat(sys_prompt, user_prompt)
         _CIRCUIT["fail"] = 0
-        return rsp
+        return rsp, True
     except Exception as e:
         _CIRCUIT["fail"] += 1
         if _CIRCUIT["fail"] >= 3:
             _CIRCUIT["open_until"] = now + _CB_TIMEOUT
         log.error("LLM failure %s – using fallback", e)
-        return _fallback([{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}]) 
\ No newline at end of file
+        return _fallback([{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}]), False
+
+def chat(sys_prompt: str, user_prompt: str) -> str:
+    """Circuit breaker wrapper for LLM chat (synchronous for compatibility)"""
+    return _chat_with_status(sys_prompt, user_prompt)[0]
+
+# ─── Reply cache ─────────────────────────────────────────────────────────
+# Keyed on the template identity (template id, state, lang, normalized
+# message), not on the rendered prompt: the user's name is stored as a
+# placeholder and slotted back in after retrieval. Prompts carrying the
+# user's conversation summary are personal and never go through the cache.
+_NAME_SLOT = "{name}"
+# Nomi più corti ("Al", "Jo") coincidono con parole comuni ("Al momento"): risposta non in cache
+_MIN_SLOTTED_NAME = 3
+
+def _slot_name(reply: str, name: str) -> Optional[str]:
+    """Reply with the user's name (whole words only) as the placeholder; None if not cacheable"""
+    if len(name) < _MIN_SLOTTED_NAME:
+        return None if re.search(rf"\b{re.escape(name)}\b", reply) else reply
+    return re.sub(rf"\b{re.escape(name)}\b", _NAME_SLOT, reply)
+
+def _reply_cache_key(template_id: str, ctx, message: str, extra: Tuple) -> Tuple:
+    normalized = " ".join(message.lower().split())
+    return (template_id, ctx.state, ctx.lang, bool(ctx.name), normalized) + tuple(extra)
+
+def template_chat(template_id: str, ctx, sys_prompt: str, user_prompt: str,
+                  message: str = "", extra: Tuple = ()) -> str:
+    """
+    chat() con reply cache condivisa tra conversazioni.
+
+    Args:
+        template_id: Identità del template (es. "GREET/intro")
+        ctx: Context (state, lang, name)
+        message: Messaggio utente, solo se la risposta dipende da esso
+        extra: Altri slot che cambiano la risposta (es. servizio scelto)
+    """
+    if getattr(ctx, "summary", ""):
+        # Personalized by the user's own history: not shareable
+        return chat(sys_prompt, user_prompt)
+    
+    cache = get_cache("reply")
+    key = _reply_cache_key(template_id, ctx, message, extra)
+    cached = cache.get(key)
+    if cached is not None:
+        log.info(f"💾 Reply cache hit: {template_id}")
+        return cached.replace(_NAME_SLOT, ctx.name or "")
+
+    reply, from_llm = _chat_with_status(sys_prompt, user_prompt)
+    if from_llm:
+        template = _slot_name(reply, ctx.name) if ctx.name else reply
+        if template is not None:
+            cache.set(key, template)
+    return reply
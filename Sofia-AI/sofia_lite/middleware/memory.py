@@ -2,129 +2,77 @@
 import logging
 import os
 import json
-import numpy as np
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
 from typing import List, Dict, Any
-from tenacity import retry, stop_after_attempt, wait_exponential
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
 from google.cloud import firestore
 from google.oauth2 import service_account
 from ..agents.context import Context
+from ..agents.history import compact_history
 from .. import get_config
+from .context_cache import HotContextCache
 from .latency import track_latency
+from .vector_store import PartitionedVectorStore, VectorStore, get_backend
+from .workers import run_blocking
+from .write_behind import WriteBehindQueue, WriteQueueFull, buffer_in_turn, turn_scope
 
 log = logging.getLogger("sofia.memory")
 
-class VectorStore:
-    """Vector store for RAG using FAISS - γ5 optimization with local cache"""
-    
+FIRESTORE_BATCH_LIMIT = 500  # max operations per Firestore batch
+MESSAGE_CLAIM_TTL_HOURS = int(os.getenv("SOFIA_MESSAGE_CLAIM_TTL_HOURS", "24"))
+
+def _user_context_from_docs(phone: str, docs) -> dict:
+    """Map get_all snapshots (returned in any order) to the get_user_context dict"""
+    by_collection = {doc.reference.parent.id: doc for doc in docs}
+
+    def data(name):
+        doc = by_collection.get(name)
+        return doc.to_dict() if doc is not None and doc.exists else {}
+
+    user_doc = by_collection.get('users')
+    return {
+        "user": data('users'),
+        "history": data('history'),
+        "rag": data('rag'),
+        "update_time": user_doc.update_time if user_doc is not None and user_doc.exists else None
+    }
+
+class FirestoreMemoryGateway:
     def __init__(self):
-        self.index = None
-        self.texts = []
-        self.metadata = []
+        self.db = None
+        self.adb = None  # AsyncClient, created in the FastAPI lifespan (ainitialize)
+        self.write_conflicts = 0
         self._initialized = False
-        # γ5 optimization: Local cache LRU 4096 / TTL 30s
-        self._local_cache = {}
-        self._cache_ttl = 30  # seconds
-    
-    def _initialize(self):
-        """Lazy initialization of FAISS index"""
-        if self._initialized:
-            return
-            
-        try:
-            import faiss
-            # Create FAISS index for inner product (cosine similarity)
-            dimension = 1536  # OpenAI text-embedding-3-small dimension
-            self.index = faiss.IndexFlatIP(dimension)
-            self._initialized = True
-            log.info("✅ FAISS vector store initialized")
-        except ImportError:
-            log.warning("⚠️ FAISS not available, using dummy vector store")
-            self._initialized = True
+        self.vector_store = PartitionedVectorStore(backend=get_backend())
     
-    def _get_embedding(self, text: str) -> np.ndarray:
-        """Get embedding for text using OpenAI or test mode"""
+    def _client_args(self) -> dict:
+        """Project + credentials shared by the sync and async clients"""
+        # Check for TEST_MODE
         if os.getenv("TEST_MODE") == "true":
-            # Test mode: return deterministic random vector
-            import hashlib
-            seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
-            np.random.seed(seed)
-            return np.random.normal(0, 1, 1536).astype(np.float32)
-        else:
-            # Production mode: use OpenAI embeddings
-            return self._get_openai_embedding(text)
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def _get_openai_embedding(self, text: str) -> np.ndarray:
-        """Get embedding from OpenAI with retry logic"""
-        try:
-            import openai
-            cfg = get_config()
-            client = openai.OpenAI(api_key=cfg["OPENAI_API_KEY"])
-            
-            response = client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-            return np.array(response.data[0].embedding, dtype=np.float32)
-        except Exception as e:
-            log.error(f"❌ OpenAI embedding error: {e}")
-            raise
-    
-    def add(self, text: str, metadata: Dict[str, Any] = None) -> str:
-        """Add text to vector store and return ID"""
-        if not self._initialized:
-            self._initialize()
+            # Use emulator for testing
+            if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+                os.environ["FIRESTORE_EMULATOR_HOST"] = "localhost:8080"
+            return {"project": "test-sofia"}
         
-        if not self.index:
-            # Fallback if FAISS not available
-            return "dummy_id"
+        # Production mode
+        cfg = get_config()
+        project_id = cfg["GCLOUD_PROJECT"]
+        if not project_id:
+            raise RuntimeError("missing GOOGLE_PROJECT_ID")
         
-        # Get embedding
-        embedding = self._get_embedding(text)
-        
-        # Add to FAISS index
-        self.index.add(embedding.reshape(1, -1))
-        
-        # Store text and metadata
-        text_id = f"text_{len(self.texts)}"
-        self.texts.append(text)
-        self.metadata.append(metadata or {})
-        
-        log.info(f"✅ Added text to vector store: {text[:50]}...")
-        return text_id
-    
-    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
-        """Search for similar texts"""
-        if not self._initialized:
-            self._initialize()
-        
-        if not self.index or len(self.texts) == 0:
-            return []
-        
-        # Get query embedding
-        query_embedding = self._get_embedding(query)
-        
-        # Search in FAISS index
-        scores, indices = self.index.search(query_embedding.reshape(1, -1), k)
-        
-        # Return results
-        results = []
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx < len(self.texts):
-                results.append({
-                    "text": self.texts[idx],
-                    "score": float(score),
-                    "metadata": self.metadata[idx]
-                })
-        
-        log.info(f"🔍 Vector search returned {len(results)} results")
-        return results
-
-class FirestoreMemoryGateway:
-    def __init__(self):
-        self.db = None
-        self._initialized = False
-        self.vector_store = VectorStore()
+        # Try to get credentials from environment variable first
+        credentials_json = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+        if credentials_json and credentials_json.startswith("{"):
+            # Credentials are provided as JSON string
+            try:
+                credentials_info = json.loads(credentials_json)
+            except json.JSONDecodeError:
+                raise RuntimeError("Invalid JSON in GOOGLE_APPLICATION_CREDENTIALS")
+            credentials = service_account.Credentials.from_service_account_info(credentials_info)
+            return {"project": project_id, "credentials": credentials}
+        # File path or Application Default Credentials
+        return {"project": project_id}
     
     def _initialize(self):
         """Lazy initialization to avoid premature setup during imports"""
@@ -132,42 +80,8 @@ class FirestoreMemoryGateway:
             return
             
         try:
-            # Check for TEST_MODE
-            if os.getenv("TEST_MODE") == "true":
-                # Use emulator for testing
-                project_id = "test-sofia"
-                self.db = firestore.Client(project=project_id)
-                # Set emulator host if not already set
-                if not os.getenv("FIRESTORE_EMULATOR_HOST"):
-                    os.environ["FIRESTORE_EMULATOR_HOST"] = "localhost:8080"
-                log.info("✅ Firestore emulator connection established")
-            else:
-                # Production mode
-                cfg = get_config()
-                project_id = cfg["GCLOUD_PROJECT"]
-                if not project_id:
-                    raise RuntimeError("missing GOOGLE_PROJECT_ID")
-                
-                # Try to get credentials from environment variable first
-                credentials_json = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-                if credentials_json and credentials_json.startswith("{"):
-                    # Credentials are provided as JSON string
-                    try:
-                        credentials_info = json.loads(credentials_json)
-                        credentials = service_account.Credentials.from_service_account_info(credentials_info)
-                        self.db = firestore.Client(project=project_id, credentials=credentials)
-                        log.info("✅ Firestore connection established with JSON credentials")
-                    except json.JSONDecodeError:
-                        raise RuntimeError("Invalid JSON in GOOGLE_APPLICATION_CREDENTIALS")
-                elif credentials_json and os.path.exists(credentials_json):
-                    # Credentials are provided as file path
-                    self.db = firestore.Client(project=project_id)
-                    log.info("✅ Firestore connection established with file credentials")
-                else:
-                    # Use default credentials (Application Default Credentials)
-                    self.db = firestore.Client(project=project_id)
-                    log.info("✅ Firestore connection established with default credentials")
-            
+            self.db = firestore.Client(**self._client_args())
+            log.info("✅ Firestore connection established")
             self._initialized = True
         except Exception as e:
             log.error(f"❌ Firestore connection failed: {e}")
@@ -177,6 +91,52 @@ class FirestoreMemoryGateway:
             else:
                 raise RuntimeError(f"Firestore initialization failed: {e}")
     
+    async def ainitialize(self, probe: bool = True):
+        """
+        Create the AsyncClient on the running event loop and warm it up with
+        a probe read (credentials, DNS, TLS, HTTP/2). The gRPC channel keeps
+        the library's options: the public API has no argument for them.
+        """
+        if self.adb is not None:
+            return
+        client = firestore.AsyncClient(**self._client_args())
+        if probe:
+            await client.collection('users').document('_warmup').get()
+        self.adb = client
+        log.info("✅ Firestore async client ready (channel warmed)")
+    
+    async def aclose(self):
+        """Release the async client (public close(); the channel goes with the process)"""
+        client, self.adb = self.adb, None
+        if client is not None:
+            client.close()
+    
+    async def aclaim_message(self, sid: str) -> bool:
+        """
+        Claim a webhook MessageSid across instances (create fails if it exists).
+        Fails open: without the async client or on errors the message is processed.
+        """
+        if self.adb is None:
+            return True
+        try:
+            await self.adb.collection('webhook_messages').document(sid).create({
+                'claimed_at': firestore.SERVER_TIMESTAMP,
+                # Campo per la TTL policy di Firestore sulla collection
+                'expire_at': datetime.now(timezone.utc) + timedelta(hours=MESSAGE_CLAIM_TTL_HOURS)
+            })
+            return True
+        except AlreadyExists:
+            return False
+        except Exception as e:
+            log.warning(f"⚠️ MessageSid claim failed for {sid}: {e}")
+            return True
+    
+    async def arelease_message(self, sid: str):
+        """Drop the claim of a MessageSid whose processing failed (Twilio will redeliver)"""
+        if self.adb is None:
+            return
+        await self.adb.collection('webhook_messages').document(sid).delete()
+    
     @track_latency("RAG")
     def get_user_context(self, phone: str):
         """Get user context from Firestore - Δmini optimization with batched get"""
@@ -191,21 +151,139 @@ class FirestoreMemoryGateway:
             rag_ref = self.db.collection('rag').document(phone)
             
             # Single batch request instead of 3 individual calls
-            user_doc, hist_doc, rag_doc = self.db.get_all([users_ref, hist_ref, rag_ref])
-            
-            user_data = user_doc.to_dict() if user_doc.exists else {}
-            hist_data = hist_doc.to_dict() if hist_doc.exists else {}
-            rag_data = rag_doc.to_dict() if rag_doc.exists else {}
-            
-            return {
-                "user": user_data,
-                "history": hist_data,
-                "rag": rag_data
-            }
+            return _user_context_from_docs(phone, self.db.get_all([users_ref, hist_ref, rag_ref]))
         except Exception as e:
             log.error(f"❌ Firestore get error: {e}")
             return None
     
+    async def aget_user_context(self, phone: str):
+        """Async get_user_context on the AsyncClient (thread pool fallback before warm-up)"""
+        if self.adb is None:
+            return await run_blocking(self.get_user_context, phone)
+        try:
+            refs = [self.adb.collection(name).document(phone) for name in ('users', 'history', 'rag')]
+            docs = [doc async for doc in self.adb.get_all(refs)]
+            return _user_context_from_docs(phone, docs)
+        except Exception as e:
+            log.error(f"❌ Firestore async get error: {e}")
+            return None
+    
+    def get_user_update_time(self, phone: str):
+        """update_time of users/{phone} (None if missing) - hot cache revalidation"""
+        if not self._initialized:
+            self._initialize()
+        if not self.db:
+            return None
+        # Field mask with a single small field: no need to transfer history
+        doc = self.db.collection('users').document(phone).get(field_paths=['state'])
+        return doc.update_time if doc.exists else None
+    
+    async def aget_user_update_time(self, phone: str):
+        if self.adb is None:
+            return await run_blocking(self.get_user_update_time, phone)
+        doc = await self.adb.collection('users').document(phone).get(field_paths=['state'])
+        return doc.update_time if doc.exists else None
+    
+    def _delta_writes(self, phone: str, delta: dict) -> list:
+        """Firestore writes of one delta: (ref, data, expected update_time or None, owner, base)"""
+        user_ref = self.db.collection('users').document(phone)
+        writes = []
+        data = dict(delta['fields'])
+        if delta['history_set'] is not None:
+            data['history'] = delta['history_set']
+        elif delta['history_append']:
+            data['history'] = firestore.ArrayUnion(delta['history_append'])
+        if data:
+            writes.append((user_ref, data, delta.get('expected_update_time'), phone, delta.get('base') or {}))
+        if delta.get('archive'):
+            archive_ref = user_ref.collection('history_archive').document()
+            writes.append((archive_ref, {
+                'messages': delta['archive'],
+                'archived_at': firestore.SERVER_TIMESTAMP
+            }, None, None, None))
+        return writes
+    
+    def _commit_writes(self, writes: list, check: bool = True) -> Dict[str, Any]:
+        batch = self.db.batch()
+        for ref, data, expected, owner, _ in writes:
+            if owner is None:
+                batch.set(ref, data)
+            elif check and expected is not None:
+                # Optimistic check: fails if another instance wrote the doc since our read
+                batch.update(ref, data, option=self.db.write_option(last_update_time=expected))
+            else:
+                # merge=<fields>: listed fields are replaced, the rest of the doc is untouched
+                batch.set(ref, data, merge=list(data))
+        results = batch.commit()
+        return {owner: result.update_time
+                for (_, _, _, owner, _), result in zip(writes, results) if owner is not None}
+    
+    def save_user_deltas(self, deltas: Dict[str, dict]) -> Dict[str, Any]:
+        """
+        Write only the changed fields of several users with Firestore batch
+        writes: set(merge=<changed fields>), history appended via ArrayUnion,
+        messages moved out of the inline history added to users/{phone}/history_archive.
+        Users read at a known update_time are written with a last_update_time
+        precondition; on conflict the doc is re-read and only the fields the
+        other writer left untouched are written (history appends are kept),
+        then that user is reported with update_time None.
+        Returns phone → update_time of the users doc written.
+        """
+        if not self._initialized:
+            self._initialize()
+        if not self.db or not deltas:
+            return {}
+        update_times = {}
+        groups = [self._delta_writes(phone, delta) for phone, delta in deltas.items()]
+        chunk = []
+        for group in groups + [None]:
+            if chunk and (group is None or len(chunk) + len(group) > FIRESTORE_BATCH_LIMIT):
+                try:
+                    update_times.update(self._commit_writes([w for g in chunk for w in g]))
+                except FailedPrecondition:
+                    # A batch is atomic: find the conflicting users one by one
+                    for g in chunk:
+                        update_times.update(self._commit_group(g))
+                chunk = []
+            if group:
+                chunk.append(group)
+        log.info(f"💾 Saved {len(deltas)} context deltas in one batch write")
+        return update_times
+    
+    def _commit_group(self, writes: list) -> Dict[str, Any]:
+        try:
+            return self._commit_writes(writes)
+        except FailedPrecondition:
+            pass
+        phones = [owner for _, _, _, owner, _ in writes if owner is not None]
+        self.write_conflicts += 1
+        try:
+            rebased = [w for w in (self._rebase_write(w) for w in writes) if w is not None]
+            if rebased:
+                self._commit_writes(rebased)
+        except FailedPrecondition:
+            log.warning(f"⚠️ {phones} changed again while rebasing: write dropped")
+        return {phone: None for phone in phones}  # conflict: the hot cache reloads the doc
+    
+    def _rebase_write(self, write: tuple) -> tuple | None:
+        """
+        Conflicting write re-applied on the current doc: a field is written
+        only if the other writer left it at our base value. None if nothing is left.
+        """
+        ref, data, expected, owner, base = write
+        if owner is None or expected is None:
+            return write
+        doc = ref.get()
+        current = (doc.to_dict() or {}) if doc.exists else {}
+        kept = {name: value for name, value in data.items()
+                if name not in base or current.get(name) == base[name]}
+        dropped = sorted(set(data) - set(kept))
+        log.warning(f"⚠️ Concurrent update of {owner}: kept the other instance's {dropped or 'fields'}, "
+                    f"re-applied {sorted(kept)}")
+        if not kept:
+            return None
+        return ref, kept, doc.update_time, owner, base
+    
     def save_user_context(self, phone: str, user_data: dict):
         """Save user context to Firestore"""
         if not self._initialized:
@@ -224,10 +302,17 @@ class FirestoreMemoryGateway:
         except Exception as e:
             log.error(f"❌ Vector store add error: {e}")
     
-    def search_similar(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
-        """Search for similar texts in vector store"""
+    def add_to_knowledge_base(self, text: str, metadata: dict = None):
+        """Add a studio document to the shared KB partition"""
+        try:
+            self.vector_store.add_to_kb(text, metadata)
+        except Exception as e:
+            log.error(f"❌ Knowledge base add error: {e}")
+    
+    def search_similar(self, query: str, k: int = 3, phone: str = None) -> List[Dict[str, Any]]:
+        """Search the user's partition and the KB"""
         try:
-            return self.vector_store.search(query, k)
+            return self.vector_store.search(query, k, phone=phone)
         except Exception as e:
             log.error(f"❌ Vector store search error: {e}")
             return []
@@ -242,111 +327,263 @@ def _get_memory_gateway():
         _memory_gateway = FirestoreMemoryGateway()
     return _memory_gateway
 
+_hot_contexts = HotContextCache()
+
+def _context_from_snapshot(phone: str, snapshot: dict) -> Context:
+    ctx = Context(phone=phone, **snapshot)
+    ctx.mark_saved()
+    return ctx
+
+def _new_context(phone: str) -> Context:
+    return Context(
+        phone=phone,
+        lang='it',
+        name=None,
+        client_type='new',
+        state='GREETING',
+        asked_name=False,
+        slots={},
+        history=[]
+    )
+
+def _context_from_user_data(phone: str, user_data: dict | None) -> Context:
+    user_doc = (user_data or {}).get('user')
+    if user_doc:
+        # Force GREETING state for new users to avoid ASK_CLARIFICATION issues
+        state = user_doc.get('state', 'GREETING')
+        client_type = user_doc.get('client_type', 'new')
+        if client_type == 'new' and state == 'ASK_CLARIFICATION':
+            log.info(f"🔄 Forcing GREETING state for existing new user {phone}")
+            state = 'GREETING'
+        print(f"[DEBUG] get_or_create_context: phone={phone}, state={state}, client_type={client_type}")
+        ctx = Context(
+            phone=phone,
+            lang=user_doc.get('lang', 'it'),
+            name=user_doc.get('name'),
+            client_type=client_type,
+            state=state,
+            asked_name=user_doc.get('asked_name', False),
+            slots=user_doc.get('slots', {}),
+            history=user_doc.get('history', []),
+            summary=user_doc.get('summary', '')
+        )
+        # Dirty tracking: the next save only writes what changes from here
+        ctx.mark_saved()
+        _hot_contexts.loaded(phone, ctx._saved, user_data.get('update_time'))
+        return ctx
+    # Create new context with GREETING state
+    print(f"[DEBUG] get_or_create_context: phone={phone}, state=GREETING, client_type=new (CREATED)")
+    return _new_context(phone)
+
 def get_or_create_context(phone: str) -> Context:
-    """Get or create context for phone number"""
+    """Get or create context for phone number (hot cache first, then Firestore)"""
     try:
         gateway = _get_memory_gateway()
-        user_data = gateway.get_user_context(phone)
-        if user_data:
-            # Force GREETING state for new users to avoid ASK_CLARIFICATION issues
-            state = user_data.get('state', 'GREETING')
-            client_type = user_data.get('client_type', 'new')
-            if client_type == 'new' and state == 'ASK_CLARIFICATION':
-                log.info(f"🔄 Forcing GREETING state for existing new user {phone}")
-                state = 'GREETING'
-            print(f"[DEBUG] get_or_create_context: phone={phone}, state={state}, client_type={client_type}")
-            return Context(
-                phone=phone,
-                lang=user_data.get('lang', 'it'),
-                name=user_data.get('name'),
-                client_type=client_type,
-                state=state,
-                asked_name=user_data.get('asked_name', False),
-                slots=user_data.get('slots', {}),
-                history=user_data.get('history', [])
-            )
-        else:
-            # Create new context with GREETING state
-            print(f"[DEBUG] get_or_create_context: phone={phone}, state=GREETING, client_type=new (CREATED)")
-            return Context(
-                phone=phone,
-                lang='it',
-                name=None,
-                client_type='new',
-                state='GREETING',
-                asked_name=False,
-                slots={},
-                history=[]
-            )
+        snapshot = _hot_contexts.get(phone, gateway.get_user_update_time)
+        if snapshot is not None:
+            return _context_from_snapshot(phone, snapshot)
+        return _context_from_user_data(phone, gateway.get_user_context(phone))
     except Exception as e:
         log.error(f"❌ Context creation error: {e}")
         # Fallback: create new context
         print(f"[DEBUG] get_or_create_context: phone={phone}, state=GREETING, client_type=new (FALLBACK)")
-        return Context(
-            phone=phone,
-            lang='it',
-            name=None,
-            client_type='new',
-            state='GREETING',
-            asked_name=False,
-            slots={},
-            history=[]
-        )
+        return _new_context(phone)
+
+async def aget_or_create_context(phone: str) -> Context:
+    """Async get_or_create_context: Firestore reads go through the AsyncClient"""
+    try:
+        gateway = _get_memory_gateway()
+        snapshot = await _hot_contexts.aget(phone, gateway.aget_user_update_time)
+        if snapshot is not None:
+            return _context_from_snapshot(phone, snapshot)
+        return _context_from_user_data(phone, await gateway.aget_user_context(phone))
+    except Exception as e:
+        log.error(f"❌ Context creation error: {e}")
+        log.warning(f"⚠️ New context for {phone} (fallback)")
+        return _new_context(phone)
 
 def load_context(phone: str) -> Context | None:
     """Load context for phone number (legacy function)"""
     return get_or_create_context(phone)
 
+async def aload_context(phone: str) -> Context | None:
+    return await aget_or_create_context(phone)
+
+def _delta(ctx: Context) -> dict:
+    """
+    Changed fields since the last load/save. History is sent as an append
+    (ArrayUnion) while the saved history is a prefix of the current one;
+    new_messages are the messages not yet persisted (for RAG indexing).
+    The baseline is the last queued snapshot, else the last committed one.
+    """
+    current = ctx.snapshot()
+    saved = ctx._queued if ctx._queued is not None else ctx._saved
+    fields = {name: value for name, value in current.items()
+              if name != 'history' and (saved is None or value != saved.get(name))}
+    old_history = saved['history'] if saved is not None else []
+    new_history = current['history']
+    if new_history[:len(old_history)] == old_history:
+        history_set, history_append = None, new_history[len(old_history):]
+        new_messages = history_append
+    else:
+        history_set, history_append = new_history, []
+        new_messages = [m for m in new_history if m not in old_history]
+    # Values the fields had at the baseline: on a write conflict, a field
+    # the other instance changed meanwhile is left to it (see _rebase_write)
+    base = {name: saved.get(name) for name in fields} if saved is not None else {}
+    if history_set is not None and saved is not None:
+        base['history'] = old_history
+    return {'fields': fields, 'history_set': history_set, 'history_append': history_append,
+            'new_messages': new_messages, 'archive': [], 'snapshots': [(ctx, current)], 'base': base}
+
+def _merge_deltas(old: dict, new: dict) -> dict:
+    """Coalesce two queued deltas for the same phone"""
+    merged = {
+        'fields': {**old['fields'], **new['fields']},
+        'base': {**new['base'], **old['base']},  # the older baseline is the one in Firestore
+        'new_messages': old['new_messages'] + new['new_messages'],
+        'archive': old['archive'] + new['archive'],
+        'snapshots': old['snapshots'] + new['snapshots'],
+        'version': new['version'],
+    }
+    if new['history_set'] is not None:
+        merged.update(history_set=new['history_set'], history_append=[])
+    elif old['history_set'] is not None:
+        merged.update(history_set=old['history_set'] + new['history_append'], history_append=[])
+    else:
+        merged.update(history_set=None, history_append=old['history_append'] + new['history_append'])
+    return merged
+
+def _write_contexts(batch: Dict[str, dict]):
+    """Write-behind flush: one Firestore batch of deltas, then index the new user messages"""
+    gateway = _get_memory_gateway()
+    for phone, delta in batch.items():
+        # Version this instance last read/wrote: precondition for the write
+        delta['expected_update_time'] = _hot_contexts.update_time(phone)
+    # On failure the queue requeues the batch; the hot cache entries stay
+    # pending, so this instance keeps serving the unsaved state until the retry
+    update_times = gateway.save_user_deltas(batch) or {}
+    for phone, delta in batch.items():
+        # update_time None for a written user: another instance wrote it meanwhile
+        conflict = phone in update_times and update_times[phone] is None
+        _hot_contexts.committed(phone, delta['version'], update_times.get(phone), conflict=conflict)
+        for ctx, snapshot in delta['snapshots']:
+            ctx.mark_saved(snapshot)
+    for phone, delta in batch.items():
+        # Add new user messages to vector store for RAG
+        for message in delta['new_messages']:
+            if isinstance(message, dict) and 'text' in message and message.get('role', 'user') == 'user':
+                metadata = {
+                    'phone': phone,
+                    'timestamp': message.get('timestamp'),
+                    'role': 'user'
+                }
+                gateway.add_to_vector_store(message['text'], metadata)
+
+_write_queue = WriteBehindQueue(_write_contexts, merge=_merge_deltas)
+
+def _enqueue_save(ctx: Context):
+    archived = compact_history(ctx)
+    delta = _delta(ctx)
+    delta['archive'] = archived
+    if not delta['fields'] and delta['history_set'] is None and not delta['history_append']:
+        return  # nothing changed
+    snapshot = delta['snapshots'][-1][1]
+    ctx.mark_queued(snapshot)
+    # Write-through: the next load on this instance sees the write before it is flushed
+    delta['version'] = _hot_contexts.written(ctx.phone, snapshot)
+    try:
+        _write_queue.put(ctx.phone, delta)
+    except WriteQueueFull:
+        # Not queued: nothing to serve from memory, the next turn reads Firestore
+        _hot_contexts.invalidate(ctx.phone)
+        ctx._queued = None
+        log.error(f"❌ Write-behind queue full, save of {ctx.phone} rejected")
+        raise
+
 def save_context(ctx: Context):
-    """Save context to memory"""
+    """Save context to memory (buffered in the current turn, then written behind)"""
     try:
         if not ctx.phone:
             log.error("Missing phone in context, skip save")
             return
         print(f"[DEBUG] save_context: phone={ctx.phone}, state={ctx.state}, client_type={ctx.client_type}")
-        gateway = _get_memory_gateway()
-        user_data = {
-            'lang': ctx.lang,
-            'name': ctx.name,
-            'client_type': ctx.client_type,
-            'state': ctx.state,
-            'asked_name': ctx.asked_name,
-            'slots': ctx.slots,
-            'history': ctx.history
-        }
-        gateway.save_user_context(ctx.phone, user_data)
-        # Add recent messages to vector store for RAG
-        if ctx.history and len(ctx.history) > 0:
-            # Add the last message to vector store
-            last_message = ctx.history[-1]
-            if isinstance(last_message, dict) and 'text' in last_message:
-                metadata = {
-                    'phone': ctx.phone,
-                    'timestamp': last_message.get('timestamp'),
-                    'role': last_message.get('role', 'user')
-                }
-                gateway.add_to_vector_store(last_message['text'], metadata)
+        if buffer_in_turn(ctx.phone, ctx):
+            return
+        _enqueue_save(ctx)
     except Exception as e:
         log.error(f"❌ Save context error: {e}")
         pass
 
+@contextmanager
+def context_turn():
+    """
+    Scope of one conversation turn: save_context calls made inside are
+    coalesced per phone and queued once when the turn ends.
+    """
+    with turn_scope() as buffered:
+        try:
+            yield
+        finally:
+            for ctx in buffered.values():
+                _enqueue_save(ctx)
+
+def flush_pending_writes():
+    """Write every queued context now (lifespan shutdown)"""
+    _write_queue.flush()
+
+def get_write_stats() -> Dict[str, int]:
+    """Write-behind queue counters + optimistic-check conflicts"""
+    conflicts = _memory_gateway.write_conflicts if _memory_gateway is not None else 0
+    return {**_write_queue.stats(), "conflicts": conflicts}
+
+def get_context_cache_stats() -> Dict[str, Any]:
+    """Hot context cache hits, revalidations and stale reloads"""
+    return _hot_contexts.stats()
+
+async def aclaim_message(sid: str) -> bool:
+    """Cross-instance MessageSid claim (see MessageDedup)"""
+    return await _get_memory_gateway().aclaim_message(sid)
+
+async def arelease_message(sid: str):
+    """Release a MessageSid claim after a failed turn (see MessageDedup)"""
+    await _get_memory_gateway().arelease_message(sid)
+
 def patch_context(phone: str, old_state: str):
     """Patch context state if flow fails"""
     try:
         gateway = _get_memory_gateway()
         user_data = gateway.get_user_context(phone)
-        if user_data:
-            user_data['state'] = old_state
-            gateway.save_user_context(phone, user_data)
+        if user_data and user_data.get('user'):
+            # Only the users doc fields: not the read wrapper (history, rag, update_time)
+            gateway.save_user_context(phone, dict(user_data['user'], state=old_state))
+            _hot_contexts.invalidate(phone)
             log.info(f"🔄 Patched context state back to {old_state} for {phone}")
     except Exception as e:
         log.error(f"❌ Patch context error: {e}")
 
-def search_similar(query: str, k: int = 3) -> List[Dict[str, Any]]:
-    """Search for similar texts in vector store"""
+async def warm_up_firestore():
+    """Create and warm the Firestore AsyncClient (FastAPI lifespan)"""
+    await _get_memory_gateway().ainitialize()
+
+async def aclose_firestore():
+    if _memory_gateway is not None:
+        await _memory_gateway.aclose()
+
+def flush_vector_store():
+    """Persist pending vector store appends (lifespan shutdown)"""
+    if _memory_gateway is not None:
+        _memory_gateway.vector_store.flush()
+
+def add_to_knowledge_base(text: str, metadata: dict = None):
+    """Add a studio document to the shared knowledge base"""
+    _get_memory_gateway().add_to_knowledge_base(text, metadata)
+
+def search_similar(query: str, k: int = 3, phone: str = None) -> List[Dict[str, Any]]:
+    """Search for similar texts in the user's partition + knowledge base"""
     try:
         gateway = _get_memory_gateway()
-        return gateway.search_similar(query, k)
+        return gateway.search_similar(query, k, phone=phone)
     except Exception as e:
         log.error(f"❌ Search similar error: {e}")
         return [] 
\ No newline at end of file
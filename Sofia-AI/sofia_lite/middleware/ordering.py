@@ -0,0 +1,128 @@
+"""
+Sofia Lite - Per-phone ordering + webhook idempotency
+Un turno alla volta per numero (lock async per chiave) e dedup dei
+webhook Twilio ritrasmessi tramite MessageSid.
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from ..utils.memo import get_cache
+
+log = logging.getLogger("sofia.ordering")
+
+class KeyedAsyncLock:
+    """One asyncio.Lock per key, dropped when nobody holds or waits for it"""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._users: Dict[Hashable, int] = {}
+        self.waits = 0
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+        if lock.locked():
+            self.waits += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+class MessageDedup:
+    """
+    Process each MessageSid once. A redelivery returns the cached result
+    (or awaits the in-flight one); claim_fn optionally claims the sid across
+    instances and returns False if another instance already took it;
+    release_fn drops that claim when processing fails, so a redelivery
+    (here or on another instance) processes the message again.
+    """
+
+    def __init__(self, name: str = "message_sid",
+                 claim_fn: Optional[Callable[[str], Awaitable[bool]]] = None,
+                 release_fn: Optional[Callable[[str], Awaitable[None]]] = None):
+        self.cache = get_cache(name)
+        self.claim_fn = claim_fn
+        self.release_fn = release_fn
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.duplicates = 0
+
+    async def run_once(self, sid: Optional[str],
+                       fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(result, duplicate): fn runs only for the first delivery of sid"""
+        if not sid:
+            return await fn(), False
+
+        cached = self.cache.get(sid)
+        if cached is not None:
+            self.duplicates += 1
+            log.info(f"🔁 Duplicate webhook {sid}: cached result")
+            return cached, True
+        inflight = self._inflight.get(sid)
+        if inflight is not None:
+            self.duplicates += 1
+            log.info(f"🔁 Duplicate webhook {sid}: waiting for the first delivery")
+            return await asyncio.shield(inflight), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[sid] = future
+        claimed = False
+        try:
+            if self.claim_fn is not None:
+                if not await self.claim_fn(sid):
+                    self.duplicates += 1
+                    log.info(f"🔁 Duplicate webhook {sid}: handled by another instance")
+                    future.set_result(None)
+                    return None, True
+                claimed = True
+            result = await fn()
+            self.cache.set(sid, result)
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            # Not cached and claim released: a later redelivery may retry
+            if claimed and self.release_fn is not None:
+                await self._release(sid)
+            future.set_exception(e)
+            future.exception()  # retrieved: no "never retrieved" warning without waiters
+            raise
+        finally:
+            del self._inflight[sid]
+
+    async def _release(self, sid: str):
+        try:
+            await self.release_fn(sid)
+        except Exception as e:
+            log.warning(f"⚠️ MessageSid claim release failed for {sid}: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {"duplicates": self.duplicates, "inflight": len(self._inflight), "cached": len(self.cache)}
+
+_phone_locks: Optional[KeyedAsyncLock] = None
+_message_dedup: Optional[MessageDedup] = None
+
+def get_phone_locks() -> KeyedAsyncLock:
+    global _phone_locks
+    if _phone_locks is None:
+        _phone_locks = KeyedAsyncLock()
+    return _phone_locks
+
+def get_message_dedup() -> MessageDedup:
+    """Shared MessageSid dedup, claiming across instances through Firestore"""
+    global _message_dedup
+    if _message_dedup is None:
+        from .memory import aclaim_message, arelease_message
+        _message_dedup = MessageDedup(claim_fn=aclaim_message, release_fn=arelease_message)
+    return _message_dedup
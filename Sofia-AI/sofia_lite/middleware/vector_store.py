@@ -0,0 +1,526 @@
+"""
+Sofia Lite - Persistent Vector Store
+Indice FAISS su disco (locale o GCS) con warm start in mmap e append a batch.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from tenacity import retry, stop_after_attempt, wait_exponential
+
+from .llm import get_openai_client
+from .workers import submit
+from ..utils.memo import get_cache
+
+log = logging.getLogger("sofia.vector_store")
+
+DIMENSION = 1536  # OpenAI text-embedding-3-small dimension
+
+# Dove persistere l'indice: "" (solo memoria), path / file:///path, gs://bucket/prefix
+STORE_URI = os.getenv("SOFIA_VECTOR_STORE_URI", "")
+# Copia locale per i backend remoti (l'indice va in mmap da disco locale)
+LOCAL_CACHE_DIR = os.getenv("SOFIA_VECTOR_STORE_CACHE_DIR", "/tmp/sofia-vectors")
+# Tipo di indice: auto | flat | ivf | hnsw
+INDEX_TYPE = os.getenv("SOFIA_VECTOR_INDEX", "auto")
+# Oltre questa soglia il flat viene ricostruito come HNSW (auto) o IVF (ivf)
+UPGRADE_AT = int(os.getenv("SOFIA_VECTOR_UPGRADE_AT", "20000"))
+FLUSH_EVERY = int(os.getenv("SOFIA_VECTOR_FLUSH_EVERY", "32"))
+# Partizioni per-utente tenute in memoria (LRU, flush quando escono)
+MAX_PARTITIONS = int(os.getenv("SOFIA_VECTOR_MAX_PARTITIONS", "1024"))
+IVF_NPROBE = int(os.getenv("SOFIA_VECTOR_NPROBE", "16"))
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+
+INDEX_FILE = "index.faiss"
+META_FILE = "store.json"
+
+# ─── Storage backends ────────────────────────────────────────────────────
+
+class LocalDiskBackend:
+    """Index files live directly under root"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def local_path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def pull(self, name: str) -> Optional[str]:
+        """Return the local path of name if it exists"""
+        path = self.local_path(name)
+        return path if os.path.exists(path) else None
+
+    def push(self, name: str):
+        """Nothing to upload: local_path is already the source of truth"""
+
+    def child(self, name: str) -> "LocalDiskBackend":
+        """Backend for a sub-directory (one per partition)"""
+        return LocalDiskBackend(os.path.join(self.root, name))
+
+class GCSBackend(LocalDiskBackend):
+    """Blob in GCS, copia di lavoro in locale per il mmap"""
+
+    def __init__(self, bucket: str, prefix: str = "", cache_dir: str = LOCAL_CACHE_DIR):
+        super().__init__(os.path.join(cache_dir, bucket, prefix))
+        from google.cloud import storage
+        self.bucket = storage.Client().bucket(bucket)
+        self.prefix = prefix.strip("/")
+
+    def _blob(self, name: str):
+        return self.bucket.blob(f"{self.prefix}/{name}" if self.prefix else name)
+
+    def pull(self, name: str) -> Optional[str]:
+        blob = self._blob(name)
+        if not blob.exists():
+            return None
+        path = self.local_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blob.download_to_filename(path)
+        return path
+
+    def push(self, name: str):
+        self._blob(name).upload_from_filename(self.local_path(name))
+
+    def child(self, name: str) -> "GCSBackend":
+        sub = copy.copy(self)  # shares the storage client and bucket
+        sub.root = os.path.join(self.root, name)
+        sub.prefix = f"{self.prefix}/{name}" if self.prefix else name
+        return sub
+
+def get_backend(uri: str = STORE_URI) -> Optional[LocalDiskBackend]:
+    """Build the storage backend from a URI ("" → no persistence)"""
+    if not uri:
+        return None
+    if uri.startswith("gs://"):
+        bucket, _, prefix = uri[len("gs://"):].partition("/")
+        return GCSBackend(bucket, prefix)
+    if uri.startswith("file://"):
+        uri = uri[len("file://"):]
+    return LocalDiskBackend(uri)
+
+# ─── Embeddings ──────────────────────────────────────────────────────────
+# Le richieste concorrenti vengono raccolte per BATCH_WINDOW_MS (o BATCH_SIZE
+# testi) e inviate con una sola embeddings.create; cache per hash del testo.
+BATCH_WINDOW_MS = float(os.getenv("SOFIA_EMBED_BATCH_WINDOW_MS", "15"))
+BATCH_SIZE = int(os.getenv("SOFIA_EMBED_BATCH_SIZE", "64"))
+# Attesa massima del batch: oltre, il testo viene embeddato da solo
+EMBED_TIMEOUT_S = float(os.getenv("SOFIA_EMBED_TIMEOUT_S", "12"))
+
+def _text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+def _get_openai_embeddings(texts: List[str]) -> List[np.ndarray]:
+    """Get embeddings for a batch of texts from OpenAI with retry logic"""
+    try:
+        client = get_openai_client("embeddings")
+
+        response = client.embeddings.create(
+            model="text-embedding-3-small",
+            input=texts
+        )
+        rows = sorted(response.data, key=lambda item: item.index)
+        return [np.array(item.embedding, dtype=np.float32) for item in rows]
+    except Exception as e:
+        log.error(f"❌ OpenAI embedding error: {e}")
+        raise
+
+class EmbeddingBatcher:
+    """Collects concurrent embed requests and sends them as one batched call"""
+
+    def __init__(self, window_ms: float = BATCH_WINDOW_MS, max_batch: int = BATCH_SIZE):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: "OrderedDict[str, Tuple[str, Future]]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="sofia-embed-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue text; identical texts already in flight share one future"""
+        key = _text_key(text)
+        with self._cond:
+            pending = self._queue.get(key)
+            if pending is not None:
+                return pending[1]
+            future: Future = Future()
+            self._queue[key] = (text, future)
+            self._ensure_thread()
+            self._cond.notify()
+            return future
+
+    def embed(self, text: str, timeout: float = EMBED_TIMEOUT_S) -> np.ndarray:
+        """Batched embedding; a stalled or slow batch falls back to a direct call"""
+        try:
+            return self.submit(text).result(timeout=timeout)
+        except TimeoutError:
+            log.warning(f"⏱️ Embedding batch timed out after {timeout}s, embedding directly")
+            embedding = _get_openai_embeddings([text])[0]
+            get_cache("embeddings").set(_text_key(text), embedding)
+            return embedding
+
+    def _take_batch(self) -> List[Tuple[str, str, Future]]:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = time.monotonic() + self.window
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = []
+            while self._queue and len(batch) < self.max_batch:
+                key, (text, future) = self._queue.popitem(last=False)
+                batch.append((key, text, future))
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                vectors = _get_openai_embeddings([text for _, text, _ in batch])
+                cache = get_cache("embeddings")
+                for (key, _, future), vector in zip(batch, vectors):
+                    cache.set(key, vector)
+                    future.set_result(vector)
+                log.info(f"📦 Embedded batch of {len(batch)} texts")
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+
+_batcher: Optional[EmbeddingBatcher] = None
+_batcher_lock = threading.Lock()
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """Get or create the shared embedding batcher"""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = EmbeddingBatcher()
+    return _batcher
+
+def embed(text: str) -> np.ndarray:
+    """Get embedding for text using OpenAI or test mode"""
+    if os.getenv("TEST_MODE") == "true":
+        # Test mode: return deterministic random vector
+        seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+        np.random.seed(seed)
+        return np.random.normal(0, 1, DIMENSION).astype(np.float32)
+    else:
+        # Production mode: shared cache by text hash, then the batcher
+        embedding = get_cache("embeddings").get(_text_key(text))
+        if embedding is None:
+            embedding = get_embedding_batcher().embed(text)
+        return embedding
+
+# ─── Vector store ────────────────────────────────────────────────────────
+
+def _build_index(index_type: str, vectors: Optional[np.ndarray] = None):
+    """Create an empty (or trained and filled) index of the given type"""
+    import faiss
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(DIMENSION, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif index_type == "ivf" and vectors is not None and len(vectors) > 0:
+        nlist = max(1, int(4 * np.sqrt(len(vectors))))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(DIMENSION), DIMENSION, nlist,
+                                   faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.nprobe = IVF_NPROBE
+    else:
+        index = faiss.IndexFlatIP(DIMENSION)
+
+    if vectors is not None and len(vectors) > 0:
+        index.add(vectors)
+    return index
+
+class VectorStore:
+    """Vector store for RAG using FAISS - persistent, batched appends"""
+
+    def __init__(self, backend: Optional[LocalDiskBackend] = None, index_type: str = INDEX_TYPE,
+                 flush_every: int = FLUSH_EVERY):
+        self.index = None
+        self.index_type = index_type
+        self.texts: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self.backend = backend
+        self.flush_every = flush_every
+        self._pending = 0
+        self._initialized = False
+        self._lock = threading.RLock()
+
+    def _initialize(self):
+        """Lazy initialization of FAISS index (warm start from the backend)"""
+        if self._initialized:
+            return
+
+        with self._lock:
+            if self._initialized:
+                return
+            try:
+                import faiss
+            except ImportError:
+                log.warning("⚠️ FAISS not available, using dummy vector store")
+                self._initialized = True
+                return
+
+            if not self._load():
+                kind = "flat" if self.index_type in ("auto", "ivf") else self.index_type
+                self.index = _build_index(kind)
+            self._initialized = True
+            log.info(f"✅ FAISS vector store initialized ({self.index.ntotal} vectors)")
+
+    def _load(self) -> bool:
+        """Load index (mmap) and metadata from the backend, if present"""
+        if self.backend is None:
+            return False
+        import faiss
+
+        try:
+            index_path = self.backend.pull(INDEX_FILE)
+            meta_path = self.backend.pull(META_FILE)
+            if not index_path or not meta_path:
+                return False
+
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+            if index.ntotal != len(meta["texts"]):
+                log.warning("⚠️ Vector store files out of sync, starting empty")
+                return False
+
+            self.index = index
+            self.texts = meta["texts"]
+            self.metadata = meta["metadata"]
+            self._tune(index)
+            log.info(f"💾 Vector store loaded: {index.ntotal} vectors")
+            return True
+        except Exception as e:
+            log.warning(f"⚠️ Vector store load failed, starting empty: {e}")
+            return False
+
+    def _tune(self, index):
+        """Restore search-time parameters that are not persisted"""
+        if hasattr(index, "nprobe"):
+            index.nprobe = IVF_NPROBE
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+
+    def _maybe_upgrade(self):
+        """Rebuild a growing flat index as IVF/HNSW (requested or auto)"""
+        import faiss
+
+        if not isinstance(self.index, faiss.IndexFlat):
+            return
+        n = self.index.ntotal
+        if n < UPGRADE_AT or self.index_type not in ("auto", "ivf"):
+            return
+        target = "hnsw" if self.index_type == "auto" else "ivf"
+
+        vectors = self.index.reconstruct_n(0, n)
+        self.index = _build_index(target, vectors)
+        log.info(f"🔄 Vector index rebuilt as {target} ({n} vectors)")
+
+    def flush(self):
+        """Persist index + metadata atomically, then push to the backend"""
+        if self.backend is None or self.index is None:
+            return
+        import faiss
+
+        with self._lock:
+            if self._pending == 0:
+                return
+            try:
+                self._maybe_upgrade()
+                os.makedirs(self.backend.root, exist_ok=True)
+
+                index_path = self.backend.local_path(INDEX_FILE)
+                meta_path = self.backend.local_path(META_FILE)
+                faiss.write_index(self.index, f"{index_path}.tmp")
+                with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+                    json.dump({"texts": self.texts, "metadata": self.metadata}, f, ensure_ascii=False)
+                os.replace(f"{index_path}.tmp", index_path)
+                os.replace(f"{meta_path}.tmp", meta_path)
+
+                self.backend.push(INDEX_FILE)
+                self.backend.push(META_FILE)
+                self._pending = 0
+                log.info(f"💾 Vector store flushed: {self.index.ntotal} vectors")
+            except Exception as e:
+                log.error(f"❌ Vector store flush failed: {e}")
+
+    def _get_embedding(self, text: str) -> np.ndarray:
+        """Get embedding for text using OpenAI or test mode"""
+        return embed(text)
+
+    def add(self, text: str, metadata: Dict[str, Any] = None) -> str:
+        """Add text to vector store and return ID (persisted every flush_every adds)"""
+        if not self._initialized:
+            self._initialize()
+
+        if not self.index:
+            # Fallback if FAISS not available
+            return "dummy_id"
+
+        # Get embedding (outside the lock: it may be a network call)
+        return self.add_vector(text, self._get_embedding(text), metadata)
+
+    def add_vector(self, text: str, embedding: np.ndarray, metadata: Dict[str, Any] = None) -> str:
+        """Add an already embedded text"""
+        if not self._initialized:
+            self._initialize()
+
+        if not self.index:
+            return "dummy_id"
+
+        with self._lock:
+            # Add to FAISS index
+            self.index.add(embedding.reshape(1, -1))
+
+            # Store text and metadata
+            text_id = f"text_{len(self.texts)}"
+            self.texts.append(text)
+            self.metadata.append(metadata or {})
+            self._pending += 1
+            should_flush = self.backend is not None and self._pending >= self.flush_every
+
+        if should_flush:
+            submit(self.flush)
+
+        log.info(f"✅ Added text to vector store: {text[:50]}...")
+        return text_id
+
+    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        """Search for similar texts"""
+        if not self._initialized:
+            self._initialize()
+
+        if not self.index or len(self.texts) == 0:
+            return []
+
+        # Get query embedding
+        return self.search_vector(self._get_embedding(query), k)
+
+    def search_vector(self, query_embedding: np.ndarray, k: int = 3) -> List[Dict[str, Any]]:
+        """Search with an already embedded query"""
+        if not self._initialized:
+            self._initialize()
+
+        if not self.index or len(self.texts) == 0:
+            return []
+
+        with self._lock:
+            # Search in FAISS index
+            scores, indices = self.index.search(query_embedding.reshape(1, -1), k)
+
+            # Return results
+            results = []
+            for score, idx in zip(scores[0], indices[0]):
+                if 0 <= idx < len(self.texts):
+                    results.append({
+                        "text": self.texts[idx],
+                        "score": float(score),
+                        "metadata": self.metadata[idx]
+                    })
+
+        log.info(f"🔍 Vector search returned {len(results)} results")
+        return results
+
+# ─── Partitioned store ───────────────────────────────────────────────────
+
+KB_PARTITION = "kb"
+
+def partition_for(phone: Optional[str]) -> str:
+    """Partition name for a phone number (KB when missing)"""
+    if not phone:
+        return KB_PARTITION
+    return "u_" + re.sub(r"[^0-9A-Za-z]", "", phone)
+
+class PartitionedVectorStore:
+    """
+    One VectorStore per user (+ shared knowledge base for studio documents).
+    Searches only scan the caller's partition and the KB.
+    """
+
+    def __init__(self, backend: Optional[LocalDiskBackend] = None,
+                 max_partitions: int = MAX_PARTITIONS):
+        self.backend = backend
+        self.max_partitions = max_partitions
+        self._partitions: "OrderedDict[str, VectorStore]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def partition(self, name: str) -> VectorStore:
+        """Get (or load) a partition, evicting the least recently used ones"""
+        evicted = []
+        with self._lock:
+            store = self._partitions.get(name)
+            if store is not None:
+                self._partitions.move_to_end(name)
+                return store
+
+            backend = self.backend.child(name) if self.backend else None
+            # Gli indici per-utente restano piccoli: sempre flat
+            index_type = INDEX_TYPE if name == KB_PARTITION else "flat"
+            store = VectorStore(backend=backend, index_type=index_type)
+            self._partitions[name] = store
+            while len(self._partitions) > self.max_partitions:
+                evicted.append(self._partitions.popitem(last=False)[1])
+
+        for old in evicted:
+            old.flush()
+        return store
+
+    def add(self, text: str, metadata: Dict[str, Any] = None) -> str:
+        """Add text to the partition of metadata['phone'] (KB without phone)"""
+        name = partition_for((metadata or {}).get("phone"))
+        return f"{name}:{self.partition(name).add(text, metadata)}"
+
+    def add_to_kb(self, text: str, metadata: Dict[str, Any] = None) -> str:
+        """Add a studio document to the shared knowledge base"""
+        return f"{KB_PARTITION}:{self.partition(KB_PARTITION).add(text, metadata)}"
+
+    def search(self, query: str, k: int = 3, phone: Optional[str] = None,
+               include_kb: bool = True) -> List[Dict[str, Any]]:
+        """Search the user's partition (+ KB), merged by score"""
+        names = []
+        if phone:
+            names.append(partition_for(phone))
+        if include_kb:
+            names.append(KB_PARTITION)
+
+        stores = [self.partition(name) for name in names]
+        for store in stores:
+            store._initialize()
+        if not any(store.texts for store in stores):
+            return []
+
+        query_embedding = embed(query)
+        results = []
+        for store in stores:
+            results.extend(store.search_vector(query_embedding, k))
+        results.sort(key=lambda r: r["score"], reverse=True)
+        return results[:k]
+
+    def flush(self):
+        """Persist every loaded partition"""
+        with self._lock:
+            stores = list(self._partitions.values())
+        for store in stores:
+            store.flush()
@@ -0,0 +1,101 @@
+"""
+Sofia Lite - Streaming voice turns
+La risposta vocale parte alla prima frase: il webhook restituisce TwiML con
+<Say> della prima frase + <Redirect> alla continuazione, mentre l'LLM
+continua a generare il resto in background.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .llm import reply_stream
+
+log = logging.getLogger("sofia.voice_stream")
+
+# Turni non ripresi dalla continuazione entro questo tempo vengono scartati
+VOICE_TURN_TTL_S = float(os.getenv("SOFIA_VOICE_TURN_TTL_S", "60"))
+
+class VoiceTurn:
+    """One caller turn: the orchestrator task plus the sentences already spoken"""
+
+    def __init__(self, task: "asyncio.Task", sentences: "asyncio.Queue[str]"):
+        self.task = task
+        self.sentences = sentences
+        self.first: Optional[str] = None
+        self.created = time.monotonic()
+
+    async def first_sentence(self) -> Optional[str]:
+        """First streamed sentence, or None if the turn finished without streaming"""
+        getter = asyncio.ensure_future(self.sentences.get())
+        done, _ = await asyncio.wait({getter, self.task}, return_when=asyncio.FIRST_COMPLETED)
+        if getter in done:
+            self.first = getter.result()
+            return self.first
+        getter.cancel()
+        return None
+
+    async def remainder(self) -> Tuple[str, Dict[str, Any]]:
+        """Wait for the whole turn; returns (text not spoken yet, orchestrator result)"""
+        result = await self.task
+        reply = result.get("reply", "")
+        if self.first is None:
+            return reply, result
+        if reply.startswith(self.first):
+            return reply[len(self.first):].strip(), result
+        # The skill replaced the streamed text (e.g. LLM fallback): say the final reply
+        log.warning("⚠️ Final voice reply differs from the streamed first sentence")
+        return reply, result
+
+class VoiceTurnRegistry:
+    """Turns waiting for their <Redirect> continuation (per instance)"""
+
+    def __init__(self, ttl: float = VOICE_TURN_TTL_S):
+        self.ttl = ttl
+        self._turns: Dict[str, VoiceTurn] = {}
+
+    async def start(self, run_turn: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Optional[str], str, VoiceTurn]:
+        """
+        Start a turn with streaming enabled. Returns (first sentence or None,
+        turn id, turn) as soon as the first sentence is ready.
+        """
+        self._expire()
+        loop = asyncio.get_running_loop()
+        sentences: "asyncio.Queue[str]" = asyncio.Queue()
+
+        def sink(sentence: str):
+            # Called from the worker thread running the skill
+            loop.call_soon_threadsafe(sentences.put_nowait, sentence)
+
+        # The task copies the current context, reply_stream included
+        with reply_stream(sink):
+            task = asyncio.create_task(run_turn())
+        turn = VoiceTurn(task, sentences)
+        turn_id = uuid.uuid4().hex
+        self._turns[turn_id] = turn
+        first = await turn.first_sentence()
+        return first, turn_id, turn
+
+    def pop(self, turn_id: str) -> Optional[VoiceTurn]:
+        return self._turns.pop(turn_id, None)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        for turn_id in [t for t, turn in self._turns.items() if turn.created < cutoff]:
+            turn = self._turns.pop(turn_id)
+            if not turn.task.done():
+                turn.task.cancel()
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+_registry: Optional[VoiceTurnRegistry] = None
+
+def get_voice_turns() -> VoiceTurnRegistry:
+    global _registry
+    if _registry is None:
+        _registry = VoiceTurnRegistry()
+    return _registry
@@ -1,84 +1,201 @@
 """
 Voice Transcription Middleware - F22 WhatsApp Voice Notes
 Trascrive note audio WhatsApp usando OpenAI Whisper
+Pipeline in memoria: download a chunk su sessione HTTP condivisa, formato
+dai primi bytes, OGG/Opus & co. inviati a Whisper così come sono; gli altri
+formati transcodificati da ffmpeg via pipe (nessun file temporaneo).
+Download una volta sola, retry solo su Whisper; trascrizioni in cache per
+hash del contenuto + lingua (redelivery Twilio e retry tornano subito).
 """
 
+import hashlib
 import os
-import tempfile
+import shutil
+import subprocess
+import threading
 import tenacity
 import logging
 import requests
-import io
-from typing import Optional
-from pydub import AudioSegment
+from requests.adapters import HTTPAdapter
+from typing import Optional, Tuple
 import openai
-from .. import get_config
+from .llm import get_openai_client
+from ..utils.memo import get_cache
 
 log = logging.getLogger("sofia.voice_transcript")
 
 # Configurazione Whisper
 WHISPER_MODEL = os.getenv("WHISPER_MODEL", "whisper-1")
+# Formati accettati direttamente da Whisper
+WHISPER_FORMATS = {"flac", "m4a", "mp3", "mp4", "mpeg", "mpga", "oga", "ogg", "wav", "webm"}
+# Limite upload Whisper (25 MB)
+MAX_AUDIO_BYTES = int(os.getenv("SOFIA_VOICE_MAX_BYTES", str(25 * 1024 * 1024)))
+DOWNLOAD_CHUNK = 64 * 1024
+FFMPEG = os.getenv("SOFIA_FFMPEG", "ffmpeg")
+
+_MIME = {
+    "ogg": "audio/ogg", "mp3": "audio/mpeg", "wav": "audio/wav", "flac": "audio/flac",
+    "m4a": "audio/mp4", "webm": "audio/webm",
+}
+
+# ─── Download ────────────────────────────────────────────────────────────
+_HTTP_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
+def _get_http_session() -> requests.Session:
+    """Shared keep-alive session for media downloads (Twilio CDN)"""
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None:
+        with _SESSION_LOCK:
+            if _HTTP_SESSION is None:
+                session = requests.Session()
+                pool_size = int(os.getenv("SOFIA_MEDIA_POOL_SIZE", "20"))
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _HTTP_SESSION = session
+    return _HTTP_SESSION
+
+@tenacity.retry(
+    stop=tenacity.stop_after_attempt(3),
+    wait=tenacity.wait_fixed(2),
+    retry=tenacity.retry_if_exception_type(requests.RequestException),
+    reraise=True
+)
+def download_audio(url: str) -> bytes:
+    """Download the audio in chunks into memory (bounded by MAX_AUDIO_BYTES)"""
+    with _get_http_session().get(url, timeout=10, stream=True) as resp:
+        resp.raise_for_status()
+        buffer = bytearray()
+        for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK):
+            buffer += chunk
+            if len(buffer) > MAX_AUDIO_BYTES:
+                raise ValueError(f"Audio too large (> {MAX_AUDIO_BYTES} bytes)")
+    return bytes(buffer)
+
+# ─── Formato + transcodifica ─────────────────────────────────────────────
+
+def detect_audio_format(audio_bytes: bytes) -> str:
+    """
+    Rileva il formato audio dai primi bytes.
+
+    Args:
+        audio_bytes: Bytes del file audio (bastano i primi 12)
+
+    Returns:
+        Formato audio rilevato (ogg, mp3, wav, etc.) o "unknown"
+    """
+    head = audio_bytes[:12]
+    if head.startswith(b'OggS'):
+        return "ogg"
+    if head.startswith(b'ID3') or head[:2] in (b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'):
+        return "mp3"
+    if head.startswith(b'RIFF'):
+        return "wav"
+    if head.startswith(b'fLaC'):
+        return "flac"
+    if head[4:8] == b'ftyp':
+        return "m4a"
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return "webm"
+    if head.startswith(b'#!AMR'):
+        return "amr"
+    log.warning("⚠️ Impossibile rilevare formato audio dai primi bytes")
+    return "unknown"
+
+def transcode_audio(audio_bytes: bytes) -> bytes:
+    """Transcode to FLAC mono 16 kHz through ffmpeg pipes (input format probed by ffmpeg)"""
+    if shutil.which(FFMPEG) is None:
+        raise RuntimeError("ffmpeg not available for audio transcoding")
+    proc = subprocess.run(
+        [FFMPEG, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+         "-ac", "1", "-ar", "16000", "-f", "flac", "pipe:1"],
+        input=audio_bytes, capture_output=True, timeout=30,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {proc.stderr.decode(errors='ignore')[:200]}")
+    return proc.stdout
+
+def prepare_audio(audio_bytes: bytes) -> Tuple[str, bytes, str]:
+    """(filename, bytes, mime) ready for Whisper: passthrough when the format is accepted"""
+    audio_format = detect_audio_format(audio_bytes)
+    log.info(f"🎵 Audio format detected: {audio_format}")
+    if audio_format in WHISPER_FORMATS:
+        return f"audio.{audio_format}", audio_bytes, _MIME.get(audio_format, "application/octet-stream")
+    log.info("🔄 Converting audio format...")
+    return "audio.flac", transcode_audio(audio_bytes), _MIME["flac"]
+
+# ─── Whisper ─────────────────────────────────────────────────────────────
+
+def transcript_key(audio_bytes: bytes, lang_hint: Optional[str] = None) -> Tuple[str, str]:
+    """Cache key: content hash of the downloaded audio + language hint"""
+    return hashlib.sha256(audio_bytes).hexdigest(), lang_hint or ""
 
 @tenacity.retry(
     stop=tenacity.stop_after_attempt(3),
     wait=tenacity.wait_fixed(2),
-    retry=tenacity.retry_if_exception_type((requests.RequestException, openai.APIError))
+    retry=tenacity.retry_if_exception_type(openai.APIError),
+    reraise=True
 )
+def _whisper(audio_file: Tuple[str, bytes, str], lang_hint: Optional[str] = None) -> str:
+    log.info(f"🤖 Transcribing with Whisper model: {WHISPER_MODEL}")
+
+    # Client OpenAI condiviso (pool keep-alive, profilo whisper)
+    client = get_openai_client("whisper")
+
+    # Parametri Whisper
+    whisper_args = {
+        "model": WHISPER_MODEL,
+        "file": audio_file
+    }
+
+    # Aggiungi suggerimento lingua se disponibile
+    if lang_hint:
+        whisper_args["language"] = lang_hint
+        log.info(f"🌍 Language hint: {lang_hint}")
+
+    # Esegui trascrizione
+    result = client.audio.transcriptions.create(**whisper_args)
+    return result.text.strip()
+
 def transcribe_voice(url: str, lang_hint: Optional[str] = None) -> str:
     """
     Trascrive note audio WhatsApp usando OpenAI Whisper.
-    
+
     Args:
         url: URL firmato HTTPS di Twilio per il download audio
         lang_hint: Suggerimento lingua per migliorare accuratezza (opzionale)
-    
+
     Returns:
         Testo trascritto dall'audio
-        
+
     Raises:
-        Exception: Se la trascrizione fallisce dopo 3 tentativi
+        Exception: Se download o trascrizione falliscono dopo 3 tentativi
     """
     try:
         log.info(f"🎤 Iniziando trascrizione audio da: {url[:50]}...")
-        
-        # 1. Scarica l'audio da Twilio (url firmato HTTPS)
+
+        # 1. Scarica l'audio da Twilio (url firmato HTTPS), una volta sola
         log.info("📥 Downloading audio file...")
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        
-        # 2. Converti OGG/OPUS → WAV PCM 16-bit (Whisper-friendly)
-        log.info("🔄 Converting audio format...")
-        with tempfile.NamedTemporaryFile(suffix=".wav") as tmp:
-            # Carica audio da bytes e converti in WAV
-            audio = AudioSegment.from_file(io.BytesIO(resp.content), format="ogg")
-            audio.export(tmp.name, format="wav", parameters=["-ac", "1", "-ar", "16000"])
-            tmp.flush()
-            
-            # 3. Trascrizione con OpenAI Whisper
-            log.info(f"🤖 Transcribing with Whisper model: {WHISPER_MODEL}")
-            
-            # Configura OpenAI client
-            cfg = get_config()
-            client = openai.OpenAI(api_key=cfg["OPENAI_API_KEY"])
-            
-            # Parametri Whisper
-            whisper_args = {
-                "model": WHISPER_MODEL,
-                "file": open(tmp.name, "rb")
-            }
-            
-            # Aggiungi suggerimento lingua se disponibile
-            if lang_hint:
-                whisper_args["language"] = lang_hint
-                log.info(f"🌍 Language hint: {lang_hint}")
-            
-            # Esegui trascrizione
-            result = client.audio.transcriptions.create(**whisper_args)
-            transcript = result.text.strip()
-            
-            log.info(f"✅ Trascrizione completata: '{transcript[:50]}...'")
-            return transcript
-            
+        audio_bytes = download_audio(url)
+
+        # Stesso audio già trascritto (redelivery Twilio, retry del webhook)
+        cache = get_cache("transcript")
+        key = transcript_key(audio_bytes, lang_hint)
+        cached = cache.get(key)
+        if cached is not None:
+            log.info("💾 Transcript cache hit")
+            return cached
+
+        # 2. OGG/Opus (WhatsApp) va a Whisper senza conversione
+        audio_file = prepare_audio(audio_bytes)
+
+        # 3. Trascrizione con OpenAI Whisper (retry solo di questa chiamata)
+        transcript = _whisper(audio_file, lang_hint)
+        cache.set(key, transcript)
+        log.info(f"✅ Trascrizione completata: '{transcript[:50]}...'")
+        return transcript
+
     except requests.RequestException as e:
         log.error(f"❌ Errore download audio: {e}")
         raise
@@ -86,77 +203,16 @@ def transcribe_voice(url: str, lang_hint: Optional[str] = None) -> str:
         log.error(f"❌ Errore trascrizione: {e}")
         raise
 
-def detect_audio_format(audio_bytes: bytes) -> str:
-    """
-    Rileva il formato audio dai bytes.
-    
-    Args:
-        audio_bytes: Bytes del file audio
-        
-    Returns:
-        Formato audio rilevato (ogg, mp3, wav, etc.)
-    """
-    try:
-        # Prova a rilevare il formato dai primi bytes
-        if audio_bytes.startswith(b'OggS'):
-            return "ogg"
-        elif audio_bytes.startswith(b'ID3') or audio_bytes.startswith(b'\xff\xfb'):
-            return "mp3"
-        elif audio_bytes.startswith(b'RIFF'):
-            return "wav"
-        else:
-            # Fallback: prova con pydub
-            audio = AudioSegment.from_file(io.BytesIO(audio_bytes))
-            return audio.format.lower()
-    except Exception as e:
-        log.warning(f"⚠️ Impossibile rilevare formato audio: {e}")
-        return "ogg"  # Default per WhatsApp
-
-@tenacity.retry(
-    stop=tenacity.stop_after_attempt(2),
-    wait=tenacity.wait_fixed(1)
-)
 def transcribe_voice_with_fallback(url: str, lang_hint: Optional[str] = None) -> str:
     """
     Trascrizione con fallback per diversi formati audio.
-    
+    (Il rilevamento del formato ora è parte della pipeline principale.)
+
     Args:
         url: URL del file audio
         lang_hint: Suggerimento lingua
-        
+
     Returns:
         Testo trascritto
     """
-    try:
-        # Download audio
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        
-        # Rileva formato
-        audio_format = detect_audio_format(resp.content)
-        log.info(f"🎵 Audio format detected: {audio_format}")
-        
-        # Converti in WAV
-        with tempfile.NamedTemporaryFile(suffix=".wav") as tmp:
-            audio = AudioSegment.from_file(io.BytesIO(resp.content), format=audio_format)
-            audio.export(tmp.name, format="wav", parameters=["-ac", "1", "-ar", "16000"])
-            tmp.flush()
-            
-            # Trascrizione
-            cfg = get_config()
-            client = openai.OpenAI(api_key=cfg["OPENAI_API_KEY"])
-            
-            whisper_args = {
-                "model": WHISPER_MODEL,
-                "file": open(tmp.name, "rb")
-            }
-            
-            if lang_hint:
-                whisper_args["language"] = lang_hint
-            
-            result = client.audio.transcriptions.create(**whisper_args)
-            return result.text.strip()
-            
-    except Exception as e:
-        log.error(f"❌ Trascrizione fallback fallita: {e}")
-        raise 
\ No newline at end of file
+    return transcribe_voice(url, lang_hint)
@@ -0,0 +1,82 @@
+"""
+Shared Worker Pool - async pipeline
+Executor condiviso e limitato per lavoro bloccante / CPU-bound
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+log = logging.getLogger("sofia.workers")
+
+# Numero massimo di thread condivisi da tutte le conversazioni
+MAX_WORKERS = int(os.getenv("SOFIA_MAX_WORKERS", "16"))
+_THREAD_PREFIX = "sofia-worker"
+
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Restituisce il ThreadPoolExecutor condiviso (creato una sola volta).
+
+    Returns:
+        ThreadPoolExecutor limitato a MAX_WORKERS thread
+    """
+    global _EXECUTOR
+
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(
+                    max_workers=MAX_WORKERS,
+                    thread_name_prefix=_THREAD_PREFIX
+                )
+                log.info(f"✅ Shared worker pool created (max_workers={MAX_WORKERS})")
+
+    return _EXECUTOR
+
+def in_worker_thread() -> bool:
+    """True se il thread corrente appartiene al pool condiviso."""
+    return threading.current_thread().name.startswith(_THREAD_PREFIX)
+
+def submit(func: Callable, *args, **kwargs):
+    """
+    Sottomette func al pool condiviso propagando i contextvars.
+
+    Returns:
+        concurrent.futures.Future
+    """
+    ctx = contextvars.copy_context()
+    return get_executor().submit(ctx.run, functools.partial(func, *args, **kwargs))
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """
+    Esegue func sul pool condiviso senza bloccare l'event loop.
+
+    Args:
+        func: Funzione sincrona (I/O bloccante o CPU-bound)
+
+    Returns:
+        Il risultato di func
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor(), ctx.run, functools.partial(func, *args, **kwargs)
+    )
+
+def shutdown_executor(wait: bool = True):
+    """Chiude il pool condiviso (lifespan shutdown)."""
+    global _EXECUTOR
+
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is not None:
+            _EXECUTOR.shutdown(wait=wait)
+            _EXECUTOR = None
+            log.info("🔒 Shared worker pool closed")
@@ -0,0 +1,170 @@
+"""
+Sofia Lite - Write-behind persistence
+Buffer per turno + coda limitata che coalesce per chiave e scrive in batch.
+Un batch fallito torna in coda (sotto le scritture più recenti) e viene
+ritentato con backoff esponenziale: nessuna scrittura va persa in silenzio.
+Se lo store continua a fallire la coda non cresce oltre MAX_PENDING chiavi:
+le nuove chiavi vengono rifiutate con WriteQueueFull.
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Optional
+
+log = logging.getLogger("sofia.write_behind")
+
+# Chiavi distinte in attesa prima che il chiamante faccia flush da sé (back-pressure);
+# con lo store in errore è il tetto della coda
+MAX_PENDING = int(os.getenv("SOFIA_WRITE_QUEUE_SIZE", "500"))
+# Finestra di coalescenza del thread di flush
+FLUSH_INTERVAL_MS = float(os.getenv("SOFIA_WRITE_FLUSH_MS", "50"))
+# Tetto del backoff tra i tentativi dopo flush falliti
+MAX_RETRY_BACKOFF_S = float(os.getenv("SOFIA_WRITE_MAX_BACKOFF_S", "30"))
+
+# ─── Turn scope ──────────────────────────────────────────────────────────
+# Durante un turno le save vengono solo bufferizzate (l'ultima vince);
+# il buffer è condiviso con i thread del pool perché run_blocking/submit
+# copiano il contextvars.Context.
+_TURN_BUFFER: contextvars.ContextVar[Optional["OrderedDict[Hashable, Any]"]] = \
+    contextvars.ContextVar("sofia_turn_buffer", default=None)
+
+@contextmanager
+def turn_scope():
+    """Buffer writes made during one turn; yields the buffer to flush at exit"""
+    buffer: "OrderedDict[Hashable, Any]" = OrderedDict()
+    token = _TURN_BUFFER.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _TURN_BUFFER.reset(token)
+
+def buffer_in_turn(key: Hashable, item: Any) -> bool:
+    """Buffer item if a turn is open; False when there is no turn scope"""
+    buffer = _TURN_BUFFER.get()
+    if buffer is None:
+        return False
+    buffer[key] = item
+    buffer.move_to_end(key)
+    return True
+
+# ─── Write-behind queue ──────────────────────────────────────────────────
+
+class WriteQueueFull(RuntimeError):
+    """The store keeps failing and max_pending keys are already waiting"""
+
+class WriteBehindQueue:
+    """Coalescing write queue flushed in batches by a background thread"""
+
+    def __init__(self, flush_fn: Callable[[Dict[Hashable, Any]], None],
+                 max_pending: int = MAX_PENDING, interval_ms: float = FLUSH_INTERVAL_MS,
+                 name: str = "sofia-write-behind",
+                 merge: Optional[Callable[[Any, Any], Any]] = None):
+        self.flush_fn = flush_fn
+        self.merge = merge  # (pending, new) → coalesced item; None = last wins
+        self.max_pending = max_pending
+        self.interval = interval_ms / 1000.0
+        self.name = name
+        self._pending: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # one batch at a time: per-key order is kept
+        self._thread: Optional[threading.Thread] = None
+        self.enqueued = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.errors = 0
+        self.retried = 0
+        self.rejected = 0
+        self._failures = 0  # consecutive failed flushes (backoff exponent)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def put(self, key: Hashable, item: Any):
+        """
+        Queue item for key (replaces a pending item for the same key).
+        Raises WriteQueueFull for a new key when max_pending keys are already
+        waiting on a failing store: the caller's turn fails instead of the
+        queue growing without bound.
+        """
+        with self._cond:
+            if key not in self._pending and len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                raise WriteQueueFull(f"{len(self._pending)} writes waiting for a failing store")
+            self.enqueued += 1
+            if key in self._pending:
+                self.coalesced += 1
+                if self.merge is not None:
+                    item = self.merge(self._pending[key], item)
+                self._pending.move_to_end(key)
+            self._pending[key] = item
+            full = len(self._pending) >= self.max_pending
+            self._ensure_thread()
+            self._cond.notify()
+
+        if full and not self._failures:
+            # While the store is failing the flush thread retries with backoff
+            log.warning("⚠️ Write-behind queue full, flushing in caller")
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Small window so that bursts for the same key coalesce (longer after failures)
+            time.sleep(self._delay())
+            self.flush()
+
+    def _delay(self) -> float:
+        if not self._failures:
+            return self.interval
+        return min(MAX_RETRY_BACKOFF_S, max(self.interval, 0.1) * 2 ** self._failures)
+
+    def _requeue(self, batch: "OrderedDict[Hashable, Any]"):
+        """Put a failed batch back, with the items queued meanwhile merged on top"""
+        with self._cond:
+            requeued: "OrderedDict[Hashable, Any]" = OrderedDict()
+            for key, item in batch.items():
+                if key in self._pending:
+                    newer = self._pending.pop(key)
+                    item = self.merge(item, newer) if self.merge is not None else newer
+                requeued[key] = item
+            requeued.update(self._pending)
+            self._pending = requeued
+            self.retried += len(batch)
+
+    def flush(self):
+        """Write everything pending as one batch (also used at shutdown)"""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, OrderedDict()
+            if not batch:
+                return
+            try:
+                self.flush_fn(batch)
+                self.batches += 1
+                self._failures = 0
+            except Exception as e:
+                self.errors += 1
+                self._failures += 1
+                self._requeue(batch)
+                log.error(f"❌ Write-behind flush failed ({len(batch)} items), retry in {self._delay():.1f}s: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "batches": self.batches,
+                "errors": self.errors,
+                "retried": self.retried,
+                "rejected": self.rejected,
+            }
@@ -1,36 +1,123 @@
+"""
+Sofia Lite - Guardrails
+Lessici per lingua in config/guardrails/<lang>.json (versionati), compilati
+una sola volta in un'unica regex a trie: un solo passaggio sul messaggio
+restituisce tutte le categorie trovate, qualunque sia la dimensione dei lessici.
+"""
+
+import glob
+import json
+import logging
+import os
 import re
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
 from .language_support import T
 
-# Simple abuse detection patterns
-ABUSE_PATTERNS = [
-    r'\b(fuck|shit|bitch|asshole|dick|pussy|cunt)\b',
-    r'\b(merda|cazzo|stronzo|puttana|troia|vaffanculo)\b',
-    r'\b(putain|merde|con|salope|enculé)\b',
-    r'\b(mierda|puta|cabrón|gilipollas|joder)\b',
-    r'\b(كسم|زبي|شرموطة|عرص|خول)\b',
-    r'\b(चूत|मादरचोद|भेंस|गांड|लंड)\b',
-    r'\b(چوت|مادرجنده|کیر|کص|گه)\b',
-    r'\b(চুত|মাদারচোদ|ভেঁস|গাঁড়|লন্ড)\b',
-    r'\b(ndey|yéex|dafa|dégg)\b'
-]
+log = logging.getLogger("sofia.guardrails")
+
+LEXICON_DIR = os.getenv(
+    "SOFIA_GUARDRAILS_DIR",
+    os.path.join(os.path.dirname(__file__), '..', 'config', 'guardrails'),
+)
+
+def _trie_pattern(terms: Iterable[str]) -> str:
+    """Alternation factored on common prefixes: matching walks a trie, not the list"""
+    trie: Dict[str, dict] = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def walk(node: dict) -> str:
+        branches = [re.escape(ch) + walk(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # A term ends here: the longer continuations are optional
+            body = "(?:" + body + ")?"
+        return body
+
+    return walk(trie)
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+class GuardrailEngine:
+    """All lexicons compiled into one regex with a named group per category"""
+
+    def __init__(self, lexicons: Iterable[dict]):
+        # category → {(leading \b, trailing \b): terms}
+        buckets: Dict[str, Dict[tuple, set]] = {}
+        self.versions: Dict[str, int] = {}
+        for lexicon in lexicons:
+            self.versions[lexicon.get("lang", "?")] = lexicon.get("version", 0)
+            for mode in ("terms", "substrings"):
+                for category, terms in lexicon.get(mode, {}).items():
+                    for term in terms:
+                        term = term.lower().strip()
+                        if not term:
+                            continue
+                        # Word-bounded terms get \b only on sides that are word characters
+                        bounded = mode == "terms"
+                        key = (bounded and _is_word_char(term[0]), bounded and _is_word_char(term[-1]))
+                        buckets.setdefault(category, {}).setdefault(key, set()).add(term)
+
+        self.categories: List[str] = list(buckets)
+        groups = []
+        for category, by_boundary in buckets.items():
+            parts = []
+            for (lead, trail), terms in sorted(by_boundary.items()):
+                parts.append(("\\b" if lead else "") + _trie_pattern(terms) + ("\\b" if trail else ""))
+            groups.append(f"(?P<{category}>" + "|".join(parts) + ")")
+        self.pattern = re.compile("|".join(groups)) if groups else None
+
+    def scan(self, text: str) -> FrozenSet[str]:
+        """Every category matched by the text, in a single pass"""
+        if not text or self.pattern is None:
+            return frozenset()
+        return frozenset(m.lastgroup for m in self.pattern.finditer(text.lower()))
+
+def load_lexicons(directory: str = LEXICON_DIR) -> List[dict]:
+    """Load every <lang>.json lexicon from the guardrails config directory"""
+    lexicons = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lexicons.append(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            log.error(f"❌ Guardrail lexicon {path} not loaded: {e}")
+    if not lexicons:
+        log.error(f"❌ No guardrail lexicons found in {directory}")
+    return lexicons
+
+_engine: Optional[GuardrailEngine] = None
+
+def get_guardrails() -> GuardrailEngine:
+    """Compiled guardrail engine (lexicons loaded on first use)"""
+    global _engine
+    if _engine is None:
+        _engine = GuardrailEngine(load_lexicons())
+        log.info(f"🛡️ Guardrails compiled: {_engine.versions}")
+    return _engine
+
+def scan(text: str) -> FrozenSet[str]:
+    """Categories (abuse, ...) found in text"""
+    return get_guardrails().scan(text)
 
 def is_abusive(text: str) -> bool:
     """Check if text contains abusive language"""
-    text_lower = text.lower()
-    
-    for pattern in ABUSE_PATTERNS:
-        if re.search(pattern, text_lower):
-            return True
-    
-    return False
+    return "abuse" in scan(text)
 
 def close_message(lang: str) -> str:
     """Return abuse close message in specified language"""
     return T("abuse_close", lang)
 
 def is_inappropriate(text: str) -> bool:
-    """Alias for is_abusive for backward compatibility"""
-    return is_abusive(text)
+    """Any guardrail category matched (abuse for the shipped lexicons)"""
+    return bool(scan(text))
 
 def abuse_reply(lang: str) -> str:
     """Return abuse reply message in specified language"""
@@ -38,4 +125,4 @@ def abuse_reply(lang: str) -> str:
 
 def warning_reply(lang: str) -> str:
     """Return warning reply message in specified language"""
-    return T("warning_reply", lang) 
\ No newline at end of file
+    return T("warning_reply", lang)
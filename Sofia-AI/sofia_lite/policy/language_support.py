@@ -44,6 +44,50 @@ _MSG = {
         "bn": "আপনার কী ধরনের অভিবাসন সেবা প্রয়োজন? আমরা আপনাকে আবাসিক অনুমতি, নাগরিকত্ব, পারিবারিক পুনর্মিলন এবং অন্যান্য প্রক্রিয়ায় সাহায্য করতে পারি।",
         "wo": "Lan laa immigration service yi? Man may ndimbal ci residence permit, citizenship, family reunification ak procedures yi.",
     },
+    "greet_ask_name": {
+        "it": "Ciao! Sono Sofia di Studio Immigrato. Come ti chiami?",
+        "en": "Hello! I'm Sofia from Studio Immigrato. What's your name?",
+        "fr": "Bonjour ! Je suis Sofia du Studio Immigrato. Comment vous appelez-vous ?",
+        "es": "¡Hola! Soy Sofia del Studio Immigrato. ¿Cómo te llamas?",
+        "ar": "مرحبًا! أنا صوفيا من ستوديو إيمّيغرَاتو. ما اسمك؟",
+        "hi": "नमस्ते! मैं सोफिया, Studio Immigrato से। आपका नाम क्या है?",
+        "ur": "سلام! میں صوفیہ ہوں Studio Immigrato سے۔ آپ کا نام کیا ہے؟",
+        "bn": "হ্যালো! আমি সোফিয়া, Studio Immigrato থেকে। আপনার নাম কী?",
+        "wo": "Asalaamaalekum! Maa ngi tudd Sofia, Studio Immigrato. Naka nga tudd?",
+    },
+    "ask_service_named": {
+        "it": "Piacere di conoscerti, {name}! Quale servizio di immigrazione ti serve? Possiamo aiutarti con permessi di soggiorno, cittadinanza, ricongiungimento familiare e altre procedure.",
+        "en": "Nice to meet you, {name}! What immigration service do you need? We can help you with residence permits, citizenship, family reunification and other procedures.",
+        "fr": "Enchanté, {name} ! Quel service d'immigration vous faut-il? Nous pouvons vous aider avec les permis de séjour, la citoyenneté, le regroupement familial et autres procédures.",
+        "es": "¡Encantado, {name}! ¿Qué servicio de inmigración necesitas? Podemos ayudarte con permisos de residencia, ciudadanía, reunificación familiar y otros procedimientos.",
+        "ar": "تشرفت بمعرفتك يا {name}! ما هي خدمة الهجرة التي تحتاجها؟ يمكننا مساعدتك في تصاريح الإقامة والجنسية والتجمع العائلي والإجراءات الأخرى.",
+        "hi": "आपसे मिलकर खुशी हुई, {name}! आपको किस प्रकार की आव्रजन सेवा की आवश्यकता है? हम आपकी निवास परमिट, नागरिकता, पारिवारिक पुनर्मिलन और अन्य प्रक्रियाओं में मदद कर सकते हैं।",
+        "ur": "آپ سے مل کر خوشی ہوئی، {name}! آپ کو کس قسم کی امیگریشن سروس کی ضرورت ہے؟ ہم آپ کی رہائشی اجازت، شہریت، خاندانی اتحاد اور دیگر طریقہ کار میں مدد کر سکتے ہیں۔",
+        "bn": "আপনার সাথে দেখা করে খুশি, {name}! আপনার কী ধরনের অভিবাসন সেবা প্রয়োজন? আমরা আপনাকে আবাসিক অনুমতি, নাগরিকত্ব, পারিবারিক পুনর্মিলন এবং অন্যান্য প্রক্রিয়ায় সাহায্য করতে পারি।",
+        "wo": "Dafa am may gis, {name}! Lan laa immigration service yi? Man may ndimbal ci residence permit, citizenship, family reunification ak procedures yi.",
+    },
+    "ask_consult_mode": {
+        "it": "Preferisci una consulenza online o in presenza?",
+        "en": "Do you prefer an online or in-person consultation?",
+        "fr": "Préférez-vous une consultation en ligne ou en personne ?",
+        "es": "¿Prefieres una consulta online o presencial?",
+        "ar": "هل تفضل استشارة عبر الإنترنت أم حضورية؟",
+        "hi": "क्या आप ऑनलाइन परामर्श पसंद करेंगे या व्यक्तिगत रूप से?",
+        "ur": "کیا آپ آن لائن مشاورت پسند کریں گے یا ذاتی طور پر؟",
+        "bn": "আপনি কি অনলাইন পরামর্শ পছন্দ করেন নাকি সরাসরি?",
+        "wo": "Ban consultation nga bëgg: online walla ci yaram?",
+    },
+    "propose_slots": {
+        "it": "Ecco gli slot disponibili per la consulenza in presenza: {slots}. Quale preferisci?",
+        "en": "Here are the available slots for the in-person consultation: {slots}. Which do you prefer?",
+        "fr": "Voici les créneaux disponibles pour la consultation en personne : {slots}. Lequel préférez-vous ?",
+        "es": "Estos son los horarios disponibles para la consulta presencial: {slots}. ¿Cuál prefieres?",
+        "ar": "إليك المواعيد المتاحة للاستشارة الحضورية: {slots}. أيها تفضل؟",
+        "hi": "व्यक्तिगत परामर्श के लिए उपलब्ध स्लॉट ये हैं: {slots}। आप कौन सा पसंद करते हैं?",
+        "ur": "ذاتی مشاورت کے لیے دستیاب سلاٹ یہ ہیں: {slots}۔ آپ کون سا پسند کرتے ہیں؟",
+        "bn": "সরাসরি পরামর্শের জন্য উপলব্ধ স্লটগুলি: {slots}। আপনি কোনটি পছন্দ করেন?",
+        "wo": "Slots yi am ngir consultation ci yaram: {slots}. Ban nga bëgg?",
+    },
     "propose_consult": {
         "it": "Perfetto! Per assisterti al meglio, ti propongo una consulenza al costo di 60€. La consulenza può essere svolta online o in presenza. Quale preferisci?",
         "en": "Perfect! To assist you best, I propose a consultation at €60. The consultation can be done online or in person. Which do you prefer?",
@@ -222,5 +266,14 @@ _MSG = {
     },
 }
 
+class _Slots(dict):
+    """format_map helper: missing slots render as empty strings"""
+    def __missing__(self, key):
+        return ""
+
 def T(tag: str, lang: str) -> str:
-    return _MSG.get(tag, {}).get(lang, _MSG[tag]["en"]) 
\ No newline at end of file
+    return _MSG.get(tag, {}).get(lang, _MSG[tag]["en"])
+
+def render(tag: str, lang: str, **slots) -> str:
+    """T() with slot interpolation ({name}, {service}, {slots}, ...)"""
+    return T(tag, lang).format_map(_Slots(slots)) 
\ No newline at end of file
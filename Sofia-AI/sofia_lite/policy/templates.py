@@ -0,0 +1,43 @@
+import json
+import logging
+import os
+from typing import Dict
+
+from .language_support import _MSG, render
+
+log = logging.getLogger("sofia.templates")
+
+# Load template modes from config file
+def load_template_modes() -> Dict[str, bool]:
+    """Load per-intent template mode from config/templates.json"""
+    config_path = os.path.join(os.path.dirname(__file__), '..', 'config', 'templates.json')
+    
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return {intent: bool(enabled) for intent, enabled in json.load(f).items()}
+    except FileNotFoundError:
+        # No config → every skill goes through the LLM
+        return {}
+    except json.JSONDecodeError:
+        log.warning("⚠️ Invalid templates.json, template mode disabled")
+        return {}
+
+# Cache template modes
+_MODES = load_template_modes()
+
+def template_mode(intent: str) -> bool:
+    """True se la skill dell'intent risponde dal catalogo invece che dall'LLM"""
+    if os.getenv("SOFIA_TEMPLATE_MODE", "on").lower() == "off":
+        return False
+    return _MODES.get(intent, False)
+
+def render_reply(tag: str, ctx, **slots) -> str:
+    """
+    Render a catalogue reply in the user's language.
+    Uses the "<tag>_named" variant when the name is known and the variant exists.
+    """
+    if ctx.name and f"{tag}_named" in _MSG:
+        tag = f"{tag}_named"
+    reply = render(tag, ctx.lang, name=ctx.name or "", **slots)
+    log.info(f"📄 Template reply: {tag} ({ctx.lang})")
+    return reply
@@ -1,7 +1,10 @@
 from sofia_lite.agents.prompt_builder import build_intent_specific_prompt
 from sofia_lite.middleware.llm import chat
+from sofia_lite.policy.templates import render_reply, template_mode
 
 def run(ctx, user_msg):
+    if template_mode("ASK_CHANNEL"):
+        return render_reply("ask_consult_mode", ctx)
     sys = build_intent_specific_prompt(ctx, "ASK_CHANNEL")
     user = "Il cliente non ha specificato la modalità di consulenza. Chiedi se preferisce consulenza online o in presenza."
     return chat(sys, user) 
\ No newline at end of file
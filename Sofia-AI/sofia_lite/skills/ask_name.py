@@ -1,7 +1,8 @@
 import logging
 from ..agents.prompt_builder import build_intent_specific_prompt
-from ..middleware.llm import chat
+from ..middleware.llm import template_chat
 from ..utils.name_extract import extract_name
+from ..policy.templates import render_reply, template_mode
 
 log = logging.getLogger("sofia.ask_name")
 
@@ -32,18 +33,22 @@ def run(ctx, user_msg:str):
     # 3) se non abbiamo ancora chiesto il nome
     if not ctx.asked_name:
         ctx.asked_name = True
+        if template_mode("ASK_NAME"):
+            return render_reply("ask_name", ctx)
         sys = build_intent_specific_prompt(ctx, "ASK_NAME")
         user = "Il cliente non ha ancora fornito il suo nome. Chiedigli gentilmente il suo nome."
         log.info(f"💬 Asking for name - User prompt: {user}")
-        response = chat(sys, user)
+        response = template_chat("ASK_NAME/ask", ctx, sys, user)
         log.info(f"🤖 LLM Response: {response}")
         return response
 
     # 4) abbiamo già chiesto ma l'utente non risponde con nome → chiarimento
+    if template_mode("ASK_NAME"):
+        return render_reply("clarify_name", ctx)
     sys = build_intent_specific_prompt(ctx, "ASK_NAME")
     user = "Il cliente non ha fornito il suo nome nonostante la richiesta precedente. Chiedi chiarimenti in modo gentile."
     log.info(f"💬 Clarifying name request - User prompt: {user}")
-    response = chat(sys, user)
+    response = template_chat("ASK_NAME/clarify", ctx, sys, user)
     log.info(f"🤖 LLM Response: {response}")
     return response
 
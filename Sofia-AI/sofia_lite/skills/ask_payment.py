@@ -1,6 +1,7 @@
 from sofia_lite.agents.prompt_builder import build_intent_specific_prompt
 from sofia_lite.middleware.llm import chat
 from ..middleware.ocr import process_payment_image
+from ..agents.features import features_for
 import asyncio
 from ..utils.memo import ttl_cache
 
@@ -8,7 +9,7 @@ def run(ctx, user_msg):
     """Handle payment request with OCR for receipt validation"""
     
     # Check if user sent an image (payment receipt)
-    if ctx.slots.get("waiting_for_payment") and "image" in user_msg.lower():
+    if ctx.slots.get("waiting_for_payment") and "image" in features_for(user_msg).normalized:
         # Process payment receipt with OCR
         try:
             # TODO: Extract image URL from Twilio webhook
@@ -1,7 +1,9 @@
 import logging
 from sofia_lite.agents.prompt_builder import build_intent_specific_prompt
-from sofia_lite.middleware.llm import chat
+from sofia_lite.middleware.llm import template_chat
 from ..policy.exclusions import is_excluded
+from ..agents.features import features_for
+from ..policy.templates import render_reply, template_mode
 
 log = logging.getLogger("sofia.ask_service")
 
@@ -11,14 +13,16 @@ def run(ctx, text):
     
     if is_excluded(text, ctx.lang):
         log.info(f"❌ Service excluded: {text}")
+        if template_mode("ASK_SERVICE"):
+            return render_reply("service_excluded", ctx)
         sys = build_intent_specific_prompt(ctx, "ASK_SERVICE")
         user = "Il cliente ha fatto una richiesta che non possiamo soddisfare. Spiega gentilmente che non possiamo aiutare con questo tipo di richieste."
         log.info(f"💬 Excluded service - User prompt: {user}")
-        response = chat(sys, user)
+        response = template_chat("ASK_SERVICE/excluded", ctx, sys, user)
         log.info(f"🤖 LLM Response: {response}")
         return response
     
-    lowers = text.lower()
+    lowers = features_for(text).normalized
     if any(k in lowers for k in ["permesso","residence","permit"]):
         ctx.slots["service"] = "permesso"
     elif any(k in lowers for k in ["cittadinanza","citizenship"]):
@@ -32,10 +36,13 @@ def run(ctx, text):
         sys = build_intent_specific_prompt(ctx, "ASK_SERVICE")
         user = f"Il cliente {ctx.name or ''} ha scelto il servizio: {ctx.slots['service']}. Proponi una consulenza specifica per questo servizio."
         log.info(f"💬 Service identified - User prompt: {user}")
-        response = chat(sys, user)
+        response = template_chat("ASK_SERVICE/chosen", ctx, sys, user, extra=(ctx.slots["service"],))
         log.info(f"🤖 LLM Response: {response}")
         return response
     
+    if template_mode("ASK_SERVICE"):
+        return render_reply("ask_service", ctx)
+    
     # Se lang non è italiano, traduci la lista servizi
     if ctx.lang != "it":
         try:
@@ -49,6 +56,6 @@ def run(ctx, text):
     sys = build_intent_specific_prompt(ctx, "ASK_SERVICE")
     user = f"Il cliente non ha ancora specificato quale servizio desidera. Presenta i servizi disponibili: {services_text}"
     log.info(f"💬 Listing services - User prompt: {user}")
-    response = chat(sys, user)
+    response = template_chat("ASK_SERVICE/list", ctx, sys, user)
     log.info(f"🤖 LLM Response: {response}")
     return response 
\ No newline at end of file
@@ -1,5 +1,5 @@
 from sofia_lite.agents.prompt_builder import build_intent_specific_prompt
-from sofia_lite.middleware.llm import chat
+from sofia_lite.middleware.llm import template_chat
 
 def run(ctx, user_msg):
     # Incrementa il contatore clarify
@@ -17,4 +17,4 @@ def run(ctx, user_msg):
     
     sys = build_intent_specific_prompt(ctx, "CLARIFY")
     user = f"Il cliente ha inviato questo messaggio: '{user_msg}'. Se è un saluto, presentati come Sofia. Se è una domanda su chi sei, presentati. Se è una richiesta di servizi, chiedi di specificare quale servizio di immigrazione ti serve. Se non capisci, chiedi gentilmente chiarimenti."
-    return chat(sys, user) 
\ No newline at end of file
+    return template_chat("CLARIFY/ask", ctx, sys, user, message=user_msg) 
\ No newline at end of file
@@ -2,6 +2,7 @@ from sofia_lite.agents.prompt_builder import build_intent_specific_prompt
 from sofia_lite.middleware.llm import chat
 from ..middleware.calendar import book, create_calendar_event, send_reminder
 from sofia_lite.metrics import bookings_confirmed
+from ..agents.features import features_for
 import re
 
 def run(ctx, text):
@@ -57,7 +58,7 @@ def run(ctx, text):
 
 def extract_slot_choice(text: str, candidates: list) -> str:
     """Extract slot choice from user text"""
-    text_lower = text.lower()
+    text_lower = features_for(text).normalized
     
     # Check for number choice (1, 2, 3)
     for i, candidate in enumerate(candidates, 1):
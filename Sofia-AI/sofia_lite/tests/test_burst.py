@@ -0,0 +1,109 @@
+"""
+Test burst coalescing of rapid-fire messages
+"""
+
+import asyncio
+import pytest
+from sofia_lite.middleware.burst import BurstCoalescer
+
+@pytest.mark.asyncio
+async def test_disabled_passes_through():
+    """Test that a zero window answers every message on its own"""
+    coalescer = BurstCoalescer(window_ms=0)
+
+    assert await coalescer.collect("+391", "ciao") == ("ciao", True)
+
+@pytest.mark.asyncio
+async def test_burst_is_answered_once():
+    """Test that messages within the window merge into the first one's turn"""
+    coalescer = BurstCoalescer(window_ms=50, max_window_ms=500)
+
+    async def later(text, delay):
+        await asyncio.sleep(delay)
+        return await coalescer.collect("+391", text)
+
+    results = await asyncio.gather(
+        coalescer.collect("+391", "ciao"),
+        later("mi chiamo Ahmed", 0.02),
+        later("permesso di soggiorno", 0.04),
+        coalescer.collect("+392", "hello"),
+    )
+
+    assert results[0] == ("ciao\nmi chiamo Ahmed\npermesso di soggiorno", True)
+    assert results[1] == results[2] == (None, False)
+    assert results[3] == ("hello", True)
+    assert coalescer.stats()["bursts"] == 2 and coalescer.stats()["merged"] == 2
+
+@pytest.mark.asyncio
+async def test_window_adapts_and_caps():
+    """Test that the window widens for bursty users, bounded by the max window and message count"""
+    coalescer = BurstCoalescer(window_ms=10, max_window_ms=200, max_messages=3)
+    for t in (0.0, 0.1, 0.2):
+        coalescer._observe("+391", t)
+
+    assert coalescer.window_for("+391") == pytest.approx(0.15)
+    assert coalescer.window_for("+392") == pytest.approx(0.01)
+
+    async def later(text, delay):
+        await asyncio.sleep(delay)
+        return await coalescer.collect("+393", text)
+
+    start = asyncio.get_running_loop().time()
+    first, _, _ = await asyncio.gather(coalescer.collect("+393", "a"), later("b", 0.005), later("c", 0.008))
+
+    assert first == ("a\nb\nc", True)
+    assert asyncio.get_running_loop().time() - start < 0.1  # closed by max_messages
+
+@pytest.mark.asyncio
+async def test_cancelled_first_message_hands_over_the_burst():
+    """Test that a merged message answers the burst when the first request is cancelled"""
+    coalescer = BurstCoalescer(window_ms=50, max_window_ms=500)
+
+    first = asyncio.create_task(coalescer.collect("+391", "ciao"))
+    await asyncio.sleep(0.01)
+    second = asyncio.create_task(coalescer.collect("+391", "mi chiamo Ahmed"))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == ("ciao\nmi chiamo Ahmed", True)
+    assert first.cancelled()
+    assert coalescer.stats()["open"] == 0
+
+def test_served_webhook_coalesces(monkeypatch):
+    """Test that /webhook/whatsapp answers a burst with one orchestrator turn"""
+    from concurrent.futures import ThreadPoolExecutor
+    from contextlib import asynccontextmanager
+    from fastapi.testclient import TestClient
+    from sofia_lite import main
+    from sofia_lite.middleware import burst, ordering
+
+    turns = []
+
+    class FakeOrchestrator:
+        async def aprocess_message(self, phone, message, channel="whatsapp"):
+            turns.append(message)
+            return {"reply": f"ok: {message}", "intent": "GREET", "state": "GREETING", "lang": "it", "phone": phone}
+
+    @asynccontextmanager
+    async def no_lifespan(app):
+        yield
+
+    monkeypatch.setattr(main.app.router, "lifespan_context", no_lifespan)
+    monkeypatch.setattr(main, "orchestrator", FakeOrchestrator())
+    monkeypatch.setattr(burst, "_burst_coalescer", BurstCoalescer(window_ms=200, max_window_ms=1000))
+    dedup = ordering.MessageDedup(name="test_burst_sid")
+    dedup.cache.clear()
+    monkeypatch.setattr(ordering, "_message_dedup", dedup)
+
+    def send(client, sid, body, delay):
+        import time
+        time.sleep(delay)
+        return client.post("/webhook/whatsapp", json={"From": "whatsapp:+391", "Body": body, "MessageSid": sid}).json()
+
+    with TestClient(main.app) as client, ThreadPoolExecutor(2) as pool:
+        first = pool.submit(send, client, "SM_A", "ciao", 0)
+        second = pool.submit(send, client, "SM_B", "permesso di soggiorno", 0.05)
+        assert first.result()["reply"] == "ok: ciao\npermesso di soggiorno"
+        assert second.result() == {"status": "merged", "phone": "+391"}
+
+    assert turns == ["ciao\npermesso di soggiorno"]
@@ -0,0 +1,203 @@
+"""
+Test hot context cache
+"""
+
+import pytest
+from sofia_lite.middleware import memory
+from sofia_lite.middleware.context_cache import HotContextCache
+from sofia_lite.middleware.write_behind import WriteBehindQueue
+
+class FakeGateway:
+    def __init__(self):
+        self.docs = {"+391": {"state": "ASK_SERVICE", "name": "Mario", "client_type": "new"}}
+        self.update_time = 1
+        self.reads = 0
+        self.checks = 0
+
+    def get_user_context(self, phone):
+        self.reads += 1
+        return {"user": dict(self.docs.get(phone, {})), "update_time": self.update_time}
+
+    def get_user_update_time(self, phone):
+        self.checks += 1
+        return self.update_time
+
+    def save_user_deltas(self, deltas):
+        self.update_time += 1
+        for phone, delta in deltas.items():
+            self.docs.setdefault(phone, {}).update(delta["fields"])
+        return {phone: self.update_time for phone in deltas}
+
+    def add_to_vector_store(self, text, metadata=None):
+        pass
+
+@pytest.fixture
+def gateway(monkeypatch):
+    fake = FakeGateway()
+    hot = HotContextCache(fresh_seconds=60)
+    hot.cache.clear()
+    monkeypatch.setattr(memory, "_get_memory_gateway", lambda: fake)
+    monkeypatch.setattr(memory, "_hot_contexts", hot)
+    monkeypatch.setattr(memory, "_write_queue",
+                        WriteBehindQueue(memory._write_contexts, interval_ms=1000, merge=memory._merge_deltas))
+    return fake
+
+def test_repeated_loads_hit_memory(gateway):
+    """Test that a second load within the fresh window does not touch Firestore"""
+    first = memory.get_or_create_context("+391")
+    first.state = "MUTATED_LOCALLY"
+    second = memory.get_or_create_context("+391")
+
+    assert gateway.reads == 1 and gateway.checks == 0
+    assert second.state == "ASK_SERVICE"  # callers get independent copies
+    assert memory.get_context_cache_stats()["fresh"] == 1
+
+def test_revalidation_detects_foreign_writes(gateway):
+    """Test that past the stale window the update_time decides between hit and reload"""
+    memory._hot_contexts.fresh_seconds = 0
+    memory._hot_contexts.stale_seconds = 0
+    memory.get_or_create_context("+391")
+
+    memory.get_or_create_context("+391")
+    assert gateway.reads == 1 and gateway.checks == 1
+
+    gateway.update_time += 1  # written by another instance
+    gateway.docs["+391"]["state"] = "ASK_CHANNEL"
+    ctx = memory.get_or_create_context("+391")
+
+    assert gateway.reads == 2 and ctx.state == "ASK_CHANNEL"
+    stats = memory.get_context_cache_stats()
+    assert stats["revalidated"] == 1 and stats["stale"] == 1
+
+def test_background_revalidation_between_turns(gateway):
+    """Test that a turn past the fresh window is served from memory and checked in background"""
+    memory._hot_contexts.fresh_seconds = 0
+    memory.get_or_create_context("+391")
+
+    ctx = memory.get_or_create_context("+391")
+    for job in list(memory._hot_contexts._background):
+        job.result()
+    assert ctx.state == "ASK_SERVICE" and gateway.reads == 1 and gateway.checks == 1
+
+    gateway.update_time += 1  # written by another instance
+    gateway.docs["+391"]["state"] = "ASK_CHANNEL"
+    served = memory.get_or_create_context("+391")
+    for job in list(memory._hot_contexts._background):
+        job.result()
+    assert served.state == "ASK_SERVICE"  # this turn: the cached copy
+    assert memory.get_or_create_context("+391").state == "ASK_CHANNEL"  # next turn: reloaded
+    stats = memory.get_context_cache_stats()
+    assert stats["background"] == 2 and stats["background_stale"] == 1 and gateway.reads == 2
+
+@pytest.mark.asyncio
+async def test_async_background_revalidation(gateway):
+    """Test that the async path serves from memory and checks on the event loop"""
+    async def aupdate_time(phone):
+        return gateway.get_user_update_time(phone)
+
+    memory._hot_contexts.fresh_seconds = 0
+    memory.get_or_create_context("+391")
+    gateway.update_time += 1
+
+    assert (await memory._hot_contexts.aget("+391", aupdate_time)) is not None
+    for task in list(memory._hot_contexts._background):
+        await task
+    assert memory._hot_contexts.cache.get("+391") is None
+
+def test_patch_context_writes_the_user_fields(gateway, monkeypatch):
+    """Test that patch_context writes the users doc fields, not the get_user_context wrapper"""
+    written = {}
+    monkeypatch.setattr(gateway, "save_user_context", lambda phone, data: written.update(data), raising=False)
+
+    memory.patch_context("+391", "ASK_NAME")
+
+    assert written == {"state": "ASK_NAME", "name": "Mario", "client_type": "new"}
+
+def test_own_writes_are_read_back_before_flush(gateway):
+    """Test write-through: a queued save is visible to the next load and committed after flush"""
+    memory._hot_contexts.fresh_seconds = 0
+    memory._hot_contexts.stale_seconds = 0
+    ctx = memory.get_or_create_context("+391")
+    ctx.slots["payment_image_url"] = "https://example.com/r.jpg"
+    memory.save_context(ctx)
+
+    pending = memory.get_or_create_context("+391")
+    assert pending.slots["payment_image_url"] == "https://example.com/r.jpg"
+    assert gateway.reads == 1 and gateway.checks == 0
+
+    memory.flush_pending_writes()
+    memory.get_or_create_context("+391")
+
+    assert gateway.reads == 1 and gateway.checks == 1  # committed update_time matches
+
+def test_pending_write_survives_cache_ttl(gateway, monkeypatch):
+    """Test that an unsaved state stays pinned past the cache TTL until its write commits"""
+    import time
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    memory._hot_contexts.fresh_seconds = 0
+    memory._hot_contexts.stale_seconds = 30
+    monkeypatch.setattr(memory._hot_contexts.cache, "ttl", 30)
+    ctx = memory.get_or_create_context("+391")
+    ctx.state = "ASK_CHANNEL"
+    memory.save_context(ctx)
+
+    now[0] += 61  # write-behind still retrying
+    assert memory.get_or_create_context("+391").state == "ASK_CHANNEL"
+    assert gateway.reads == 1
+
+    memory.flush_pending_writes()
+    assert memory.get_context_cache_stats()["pinned"] == 0
+    now[0] += 61
+    assert memory.get_or_create_context("+391").state == "ASK_CHANNEL"
+    assert gateway.reads == 2  # committed: evicted normally and reloaded
+
+def test_entries_outlive_the_fresh_window(gateway, monkeypatch):
+    """Test that entries stay cached for the whole stale window, not the default cache TTL"""
+    import time
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    memory._hot_contexts.fresh_seconds = 10
+    memory._hot_contexts.stale_seconds = 900
+    memory.get_or_create_context("+391")
+
+    now[0] += 300
+    memory.get_or_create_context("+391")
+    for job in list(memory._hot_contexts._background):
+        job.result()
+
+    assert gateway.reads == 1 and gateway.checks == 1
+    assert memory.get_context_cache_stats()["background"] == 1
+
+def test_write_conflict_drops_the_entry(gateway, monkeypatch):
+    """Test that a conflicting write makes the next load read the merged doc"""
+    ctx = memory.get_or_create_context("+391")
+    ctx.state = "ASK_CHANNEL"
+    memory.save_context(ctx)
+    gateway.docs["+391"]["name"] = "Maria"  # written by another instance
+    monkeypatch.setattr(gateway, "save_user_deltas", lambda deltas: {phone: None for phone in deltas})
+
+    memory.flush_pending_writes()
+
+    assert memory.get_or_create_context("+391").name == "Maria"
+    assert gateway.reads == 2
+
+@pytest.mark.asyncio
+async def test_async_load_uses_async_gateway(gateway):
+    """Test that the async path revalidates through the async gateway methods"""
+    async def aget_user_context(phone):
+        return gateway.get_user_context(phone)
+
+    async def aget_user_update_time(phone):
+        return gateway.get_user_update_time(phone)
+
+    gateway.aget_user_context = aget_user_context
+    gateway.aget_user_update_time = aget_user_update_time
+    memory._hot_contexts.fresh_seconds = 0
+    memory._hot_contexts.stale_seconds = 0
+
+    first = await memory.aget_or_create_context("+391")
+    second = await memory.aget_or_create_context("+391")
+
+    assert first.name == second.name == "Mario"
+    assert gateway.reads == 1 and gateway.checks == 1
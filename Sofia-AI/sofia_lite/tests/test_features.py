@@ -0,0 +1,69 @@
+"""
+Test turn features: preprocessing del messaggio una volta per turno
+"""
+
+from sofia_lite.agents import executor, planner
+from sofia_lite.agents.context import Context
+from sofia_lite.agents.features import TurnFeatures, features_for, turn_features
+from sofia_lite.middleware import language
+
+def test_text_features():
+    """Testo normalizzato, token, primo token e flag saluto/nome"""
+    features = TurnFeatures("  Ciao,   MI CHIAMO Ahmed ")
+    assert features.normalized == "ciao, mi chiamo ahmed"
+    assert features.tokens == ("ciao,", "mi", "chiamo", "ahmed")
+    assert features.first_word == "ciao,"
+    assert features.script == "latin"
+    assert features.forced_greet and features.greeting and features.name_phrase
+    assert not TurnFeatures("vorrei il permesso").greeting
+
+def test_language_detected_once_per_turn(monkeypatch):
+    """Orchestrator e planner condividono un solo rilevamento lingua"""
+    calls = []
+    def fake_detect(text, ctx=None):
+        calls.append(text)
+        return "it", None
+    monkeypatch.setattr(language, "detect_lang_with_heuristics", fake_detect)
+    ctx = Context(phone="+39000", lang="unknown", state="ASK_NAME")
+    with turn_features("mi chiamo Marco", ctx) as features:
+        assert features_for("mi chiamo Marco", ctx) is features
+        assert planner._quick_intent("mi chiamo Marco", ctx) == ("it", ("GREET", 0.95))
+        assert features.lang == "it"
+    assert calls == ["mi chiamo Marco"]
+
+def test_features_scoped_to_turn():
+    """Fuori dal turno, o per un altro messaggio, le feature vengono ricalcolate"""
+    with turn_features("ciao") as features:
+        assert features_for("ciao") is features
+        assert features_for("salve") is not features
+        assert features_for("ciao", Context(phone="+39001")) is not features
+    assert features_for("ciao") is not features
+
+def test_lazy_features_do_not_share_a_lock(monkeypatch):
+    """Lingua di turni diversi calcolata in parallelo, una sola volta per turno"""
+    import threading
+    barrier = threading.Barrier(2, timeout=2)
+    calls = []
+    def fake_detect(text, ctx=None):
+        calls.append(text)
+        barrier.wait()  # both turns inside detection at the same time
+        return "it", None
+    monkeypatch.setattr(language, "detect_lang_with_heuristics", fake_detect)
+    turns = [TurnFeatures("ciao"), TurnFeatures("salve")]
+    threads = [threading.Thread(target=lambda f=f: f.lang) for f in turns]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(calls) == ["ciao", "salve"]
+    assert [f.lang for f in turns] == ["it", "it"] and len(calls) == 2
+
+def test_guardrails_read_from_features(monkeypatch):
+    """L'executor usa il risultato guardrail già calcolato per il turno"""
+    ctx = Context(phone="+39002", lang="it", state="ASK_SERVICE")
+    monkeypatch.setattr(executor, "save_context", lambda ctx: None)
+    monkeypatch.setattr(executor, "warning_reply", lambda lang: "warning")
+    with turn_features("testo qualsiasi", ctx) as features:
+        features._guardrails = frozenset({"abuse"})
+        assert executor.dispatch("ASK_SERVICE", ctx, "testo qualsiasi") == "warning"
+    assert ctx.slots["abuse_count"] == 1
@@ -0,0 +1,35 @@
+"""
+Test guardrails: lessici compilati in un'unica regex, un passaggio per messaggio
+"""
+
+from sofia_lite.policy.guardrails import GuardrailEngine, get_guardrails, is_abusive, is_inappropriate, scan
+
+def test_shipped_lexicons_detect_abuse():
+    """Lessici in config/guardrails: abusi rilevati in più lingue, case-insensitive"""
+    for text in ["Sei uno STRONZO", "fuck you", "putain", "gilipollas", "كسم"]:
+        assert is_abusive(text), text
+    assert not is_inappropriate("Ciao, vorrei un appuntamento per il permesso di soggiorno")
+    assert get_guardrails().versions.get("it", 0) >= 1
+
+def test_word_boundaries():
+    """I termini corrispondono solo a parole intere"""
+    assert scan("con") == {"abuse"}
+    assert scan("connu") == frozenset()
+    assert scan("") == frozenset()
+
+def test_every_category_in_one_pass():
+    """Tutte le categorie trovate in un solo scan"""
+    engine = GuardrailEngine([
+        {"lang": "it", "version": 2, "terms": {"abuse": ["stronzo"], "spam": ["compra ora", "clicca qui"]}},
+        {"lang": "xx", "version": 1, "substrings": {"threat": ["ammazz"]}},
+    ])
+    assert engine.scan("stronzo, clicca qui o ti ammazzo") == {"abuse", "spam", "threat"}
+    assert engine.scan("compra orale") == frozenset()
+    assert engine.versions == {"it": 2, "xx": 1}
+
+def test_shared_prefixes_compile_to_trie():
+    """Prefissi comuni fattorizzati: termine corto e lungo entrambi rilevati"""
+    engine = GuardrailEngine([{"lang": "fr", "version": 1, "terms": {"abuse": ["con", "connard", "conne"]}}])
+    assert engine.pattern.pattern.count("con") == 1
+    for text in ["con", "connard", "conne"]:
+        assert engine.scan(text) == {"abuse"}, text
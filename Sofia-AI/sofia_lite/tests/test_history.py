@@ -0,0 +1,73 @@
+"""
+Test bounded rolling history
+"""
+
+import pytest
+from sofia_lite.agents import history
+from sofia_lite.agents.context import Context
+from sofia_lite.agents.prompt_builder import build_intent_specific_prompt
+from sofia_lite.middleware import memory
+from sofia_lite.middleware.write_behind import WriteBehindQueue
+
+def _turns(n, start=0):
+    messages = []
+    for i in range(start, start + n):
+        messages.append({"role": "user", "text": f"domanda {i}"})
+        messages.append({"role": "assistant", "text": f"risposta {i}"})
+    return messages
+
+def test_compaction_keeps_last_messages_and_summarizes():
+    """Test that older messages move to the summary once the chunk is exceeded"""
+    ctx = Context(phone="+391", history=_turns(14))  # 28 messages
+
+    assert history.compact_history(ctx) == []  # within max + chunk
+
+    ctx.history += _turns(1, start=14)  # 30 messages
+    archived = history.compact_history(ctx)
+
+    assert len(archived) == 10 and len(ctx.history) == history.HISTORY_MAX_MESSAGES
+    assert ctx.history[0]["text"] == "domanda 5"
+    assert "domanda 0" in ctx.summary and "risposta 0" not in ctx.summary
+
+def test_summary_is_bounded():
+    """Test that the rolling summary drops its oldest lines past the limit"""
+    summary = ""
+    for i in range(100):
+        summary = history.summarize(summary, [{"role": "user", "text": f"messaggio numero {i} " * 20}], max_chars=300)
+
+    assert len(summary) <= 300
+    assert "messaggio numero 99" in summary and "messaggio numero 0 " not in summary
+
+def test_prompt_includes_summary():
+    """Test that the intent prompt carries the rolling summary"""
+    ctx = Context(phone="+391", summary="- vorrei rinnovare il permesso")
+
+    assert "vorrei rinnovare il permesso" in build_intent_specific_prompt(ctx, "ASK_SERVICE")
+    assert "Earlier in the conversation" not in build_intent_specific_prompt(Context(phone="+391"), "ASK_SERVICE")
+
+def test_save_archives_and_indexes_only_new_messages(monkeypatch):
+    """Test that a compacting save archives old turns and indexes only the new user message"""
+    batches, indexed = [], []
+
+    class FakeGateway:
+        def save_user_deltas(self, deltas):
+            batches.append(deltas)
+
+        def add_to_vector_store(self, text, metadata=None):
+            indexed.append(text)
+
+    monkeypatch.setattr(memory, "_get_memory_gateway", lambda: FakeGateway())
+    monkeypatch.setattr(memory, "_write_queue",
+                        WriteBehindQueue(memory._write_contexts, interval_ms=1000, merge=memory._merge_deltas))
+
+    ctx = Context(phone="+391", history=_turns(14))
+    ctx.mark_saved()
+    ctx.history += _turns(1, start=14)
+    memory.save_context(ctx)
+    memory.flush_pending_writes()
+
+    delta = batches[0]["+391"]
+    assert len(delta["archive"]) == 10
+    assert len(delta["history_set"]) == history.HISTORY_MAX_MESSAGES
+    assert "domanda 0" in delta["fields"]["summary"]
+    assert indexed == ["domanda 14"]
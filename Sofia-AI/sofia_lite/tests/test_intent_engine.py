@@ -2,8 +2,11 @@
 Test Intent Engine 2.0 functionality
 """
 
+import asyncio
 import pytest
 import os
+import time
+from sofia_lite.agents import planner
 from sofia_lite.agents.planner import classify_intent
 
 @pytest.fixture
@@ -99,4 +102,81 @@ def test_fallback_behavior(setup_test_env):
     # Should still return a valid intent and confidence
     assert intent in ["GREET", "ASK_SERVICE", "REQUEST_SERVICE", "ASK_COST", 
                      "ASK_NAME", "ASK_SLOT", "ASK_PAYMENT", "CONFIRM", "CLARIFY"]
-    assert 0 <= confidence <= 1 
\ No newline at end of file
+    assert 0 <= confidence <= 1 
+
+
+def _slow(result, delay):
+    """Build a blocking classifier that answers after delay seconds"""
+    def classifier(*args):
+        time.sleep(delay)
+        return result
+    return classifier
+
+
+def test_hedge_first_confident_answer_wins(monkeypatch):
+    """Test that the fast confident classifier wins the race"""
+    monkeypatch.setattr(planner, "_classify_with_openai_fast", _slow(("ASK_COST", 0.9), 0.5))
+    monkeypatch.setattr(planner, "_classify_with_similarity", _slow(("ASK_SERVICE", 0.8), 0.01))
+
+    intent, confidence, winner = planner._hedged_classify_sync("che servizi?", "it")
+
+    assert (intent, winner) == ("ASK_SERVICE", "similarity")
+
+
+def test_hedge_waits_past_low_confidence(monkeypatch):
+    """Test that an answer below the floor does not end the race"""
+    monkeypatch.setattr(planner, "_classify_with_openai_fast", _slow(("ASK_COST", 0.9), 0.1))
+    monkeypatch.setattr(planner, "_classify_with_similarity", _slow(("CLARIFY", 0.1), 0.01))
+
+    intent, confidence, winner = planner._hedged_classify_sync("quanto?", "it")
+
+    assert (intent, winner) == ("ASK_COST", "openai")
+
+
+def test_hedge_budget_enforced(monkeypatch):
+    """Test that the budget is enforced when both classifiers are slow"""
+    monkeypatch.setattr(planner, "_classify_with_openai_fast", _slow(("ASK_COST", 0.9), 1.0))
+    monkeypatch.setattr(planner, "_classify_with_similarity", _slow(("ASK_COST", 0.9), 1.0))
+
+    start = time.monotonic()
+    intent, confidence, winner = planner._hedged_classify_sync("quanto?", "it", budget=0.2)
+
+    assert (intent, winner) == ("CLARIFY", "timeout")
+    assert time.monotonic() - start < 0.5
+
+
+def test_classify_timeout_stays_in_budget(monkeypatch):
+    """Test that a hedge timeout returns CLARIFY without a second, sequential round"""
+    monkeypatch.setattr(planner, "CLASSIFY_BUDGET_S", 0.2)
+    monkeypatch.setattr(planner, "_classify_with_openai_fast", _slow(("ASK_COST", 0.9), 1.0))
+    monkeypatch.setattr(planner, "_classify_with_similarity", _slow(("ASK_COST", 0.9), 1.0))
+
+    start = time.monotonic()
+    intent, confidence = classify_intent("quanto costa il rinnovo?", "it")
+
+    assert intent == "CLARIFY"
+    assert time.monotonic() - start < 0.5
+    assert planner._intent_cache.get(planner._intent_cache_key("quanto costa il rinnovo?", "it")) is None
+
+
+@pytest.mark.asyncio
+async def test_hedge_async_cancels_loser(monkeypatch):
+    """Test that the async race cancels the slower classifier"""
+    cancelled = []
+
+    async def slow_openai(text, lang):
+        try:
+            await asyncio.sleep(1.0)
+        except asyncio.CancelledError:
+            cancelled.append("openai")
+            raise
+        return "ASK_COST", 0.9
+
+    monkeypatch.setattr(planner, "_classify_with_openai_fast_async", slow_openai)
+    monkeypatch.setattr(planner, "_classify_with_similarity", _slow(("ASK_SERVICE", 0.8), 0.01))
+
+    intent, confidence, winner = await planner._hedged_classify_async("che servizi?", "it")
+    await asyncio.sleep(0)
+
+    assert winner == "similarity"
+    assert cancelled == ["openai"]
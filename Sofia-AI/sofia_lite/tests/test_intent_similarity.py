@@ -0,0 +1,65 @@
+"""
+Test similarity intent classifier engine
+"""
+
+import json
+import numpy as np
+import pytest
+from sofia_lite.agents.intent_similarity import SimilarityClassifier
+
+EXAMPLES = {
+    "GREET": ["ciao", "hello"],
+    "ASK_COST": ["quanto costa", "how much"],
+    "EMPTY": [],
+}
+
+def bag_of_chars(texts):
+    """Deterministic toy encoder: character histogram"""
+    matrix = np.zeros((len(texts), 64), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for ch in text.lower():
+            matrix[i, ord(ch) % 64] += 1
+    return matrix
+
+@pytest.fixture
+def examples_file(tmp_path):
+    path = tmp_path / "intent_examples.json"
+    path.write_text(json.dumps(EXAMPLES), encoding="utf-8")
+    return str(path)
+
+def test_classify_nearest_example(examples_file):
+    """Test that the best matching example wins"""
+    clf = SimilarityClassifier(examples_path=examples_file, encoder=bag_of_chars)
+
+    intent, score = clf.classify("ciao!")
+    assert intent == "GREET"
+    assert 0.0 < score <= 1.0 + 1e-6
+
+    intent, _ = clf.classify("quanto costa?")
+    assert intent == "ASK_COST"
+
+def test_matrix_is_normalized_float32(examples_file):
+    """Test that the example matrix is built once, normalized, float32"""
+    clf = SimilarityClassifier(examples_path=examples_file, encoder=bag_of_chars)
+    clf.load()
+
+    assert clf.matrix.dtype == np.float32
+    assert clf.matrix.shape[0] == 4  # empty intents are skipped
+    assert np.allclose(np.linalg.norm(clf.matrix, axis=1), 1.0)
+
+def test_matrix_persisted_by_examples_hash(examples_file, tmp_path):
+    """Test that a second instance reuses the persisted matrix"""
+    cache_dir = tmp_path / "cache"
+    SimilarityClassifier(examples_path=examples_file, cache_dir=str(cache_dir),
+                         encoder=bag_of_chars).load()
+    assert len(list(cache_dir.glob("intent_examples_*.npz"))) == 1
+
+    calls = []
+    def counting_encoder(texts):
+        calls.append(len(texts))
+        return bag_of_chars(texts)
+
+    clf = SimilarityClassifier(examples_path=examples_file, cache_dir=str(cache_dir),
+                               encoder=counting_encoder)
+    clf.classify("hello")
+    assert calls == [1]  # only the query was encoded
@@ -0,0 +1,78 @@
+"""
+Test language ID a livelli: scrittura, profili n-grammi, lingua sticky
+"""
+
+import sys
+from sofia_lite.middleware.langid import NgramProfiles, identify, script_lang, sticky_lang
+from sofia_lite.middleware.language import detect_lang, detect_lang_with_heuristics
+from sofia_lite.agents.context import Context
+
+def test_script_resolves_non_latin_languages():
+    """Arabo/devanagari/bengali dalla scrittura, urdu dalle lettere caratteristiche"""
+    assert script_lang("أنا محمد")[0] == "ar"
+    assert script_lang("میرا نام علی")[0] == "ur"
+    assert script_lang("मेरा नाम राजेश")[0] == "hi"
+    assert script_lang("আমার নাম রাহুল")[0] == "bn"
+    assert script_lang("Mi chiamo Mario") is None
+
+def test_latin_profiles_from_catalogue():
+    """Profili n-grammi costruiti dal catalogo messaggi"""
+    cases = {
+        "Vorrei rinnovare il permesso di soggiorno": "it",
+        "I need help with my residence permit": "en",
+        "Je voudrais renouveler mon titre de séjour": "fr",
+        "Necesito ayuda con mi permiso de residencia": "es",
+    }
+    for text, lang in cases.items():
+        assert identify(text)[0] == lang, text
+    
+    profiles = NgramProfiles({"it": ["ciao come stai"], "en": ["hello how are you"]})
+    assert profiles.classify("come stai")[0] == "it"
+    assert profiles.classify("1234") is None
+
+def test_no_langdetect_on_hot_path():
+    """detect_lang non importa langdetect"""
+    sys.modules.pop("langdetect", None)
+    assert detect_lang("Buonasera, vorrei informazioni sulla cittadinanza") == "it"
+    assert "langdetect" not in sys.modules
+
+def test_sticky_language_switch():
+    """Messaggi brevi/ambigui non cambiano lingua; evidenza forte o ripetuta sì"""
+    slots = {"lang_confirmed": "it"}
+    assert sticky_lang(slots, "en", 0.3) == "it"
+    assert sticky_lang(slots, "en", 0.7) == "it"
+    assert slots["lang_pending"] == "en"
+    assert sticky_lang(slots, "en", 0.7) == "en"
+    assert "lang_pending" not in slots
+    assert sticky_lang(slots, "ar", 1.0) == "ar"
+
+def test_detection_uses_conversation_language():
+    """Con lingua confermata un "ok" resta nella lingua della conversazione"""
+    ctx = Context(phone="+393001234571", state="ASK_SERVICE")
+    ctx.slots["lang_confirmed"] = "it"
+    assert detect_lang_with_heuristics("ok", ctx) == ("it", None)
+    assert detect_lang_with_heuristics("أريد المساعدة في تصريح الإقامة", ctx) == ("ar", None)
+
+def test_short_inputs_are_not_overconfident():
+    """Un nome o un "ok" danno poca evidenza: confidenza sotto la soglia di attesa"""
+    from sofia_lite.middleware.langid import PENDING_CONFIDENCE
+    for text in ("Ahmed", "ok", "Maria", "Francesca Bianchi"):
+        assert identify(text)[1] < PENDING_CONFIDENCE, text
+    assert identify("Quiero renovar mi permiso")[0] == "es"
+    assert identify("va bene")[0] == "it"
+
+def test_italian_conversation_survives_short_replies():
+    """Nomi e risposte brevi non cambiano lingua; una frase chiara sì"""
+    ctx = Context(phone="+393001234572", state="ASK_SERVICE")
+    ctx.slots["lang_confirmed"] = "it"
+    for text in ("Ahmed", "ok", "ok", "Maria", "Francesca Bianchi", "va bene"):
+        assert detect_lang_with_heuristics(text, ctx) == ("it", None), text
+    assert "lang_pending" not in ctx.slots
+    assert detect_lang_with_heuristics("I need help with my residence permit", ctx) == ("en", None)
+
+def test_ask_name_skips_detection():
+    """In ASK_NAME la risposta è un nome: la lingua non viene rilevata"""
+    ctx = Context(phone="+393001234573", state="ASK_NAME")
+    ctx.slots["lang_confirmed"] = "it"
+    assert detect_lang_with_heuristics("My name is John Smith", ctx) == ("it", None)
+    assert ctx.slots["lang_confirmed"] == "it"
@@ -0,0 +1,67 @@
+"""
+Test shared OpenAI client registry
+"""
+
+import httpx
+import pytest
+from sofia_lite.middleware import llm
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Fresh registry with a fake API key"""
+    monkeypatch.setattr(llm, "get_config", lambda: {"OPENAI_KEY": "sk-test"})
+    llm.close_clients()
+    yield llm
+    llm.close_clients()
+
+def test_clients_are_reused_per_profile(registry):
+    """Test that a profile always returns the same client"""
+    fast = registry.get_openai_client("classify_fast")
+    assert registry.get_openai_client("classify_fast") is fast
+    assert fast.timeout == 0.8
+
+    chat = registry.get_openai_client("chat")
+    assert chat is not fast
+    assert chat.timeout == 12.0
+
+def test_profiles_share_one_pool(registry):
+    """Test that all sync profiles share one keep-alive pool"""
+    registry.get_openai_client("chat")
+    registry.get_openai_client("embeddings")
+
+    stats = registry.get_pool_stats()
+    assert stats["profiles"]["sync"] == ["chat", "embeddings"]
+    assert stats["limits"]["max_connections"] > 0
+
+def test_missing_key_raises(monkeypatch):
+    """Test that a missing key raises RuntimeError"""
+    monkeypatch.setattr(llm, "get_config", lambda: {"OPENAI_KEY": ""})
+    llm.close_clients()
+    with pytest.raises(RuntimeError):
+        llm.get_openai_client("chat")
+
+@pytest.mark.asyncio
+async def test_aclose_clients(registry):
+    """Test that lifespan shutdown closes both pools"""
+    registry.get_openai_client("chat")
+    registry.get_async_openai_client("chat")
+
+    await registry.aclose_clients()
+
+    stats = registry.get_pool_stats()
+    assert stats["profiles"] == {"sync": [], "async": []}
+
+def test_pool_stats_count_in_flight(registry, monkeypatch):
+    """Test that pool stats come from the transport, not from httpx internals"""
+    seen = []
+
+    def fake_send(self, request):
+        seen.append(llm.get_pool_stats()["sync"]["in_flight"])
+        return httpx.Response(200, request=request)
+
+    monkeypatch.setattr(httpx.HTTPTransport, "handle_request", fake_send)
+    registry._get_http_sync().get("https://api.openai.com/v1/models")
+
+    stats = registry.get_pool_stats()["sync"]
+    assert seen == [1]
+    assert stats["in_flight"] == 0 and stats["peak_in_flight"] >= 1
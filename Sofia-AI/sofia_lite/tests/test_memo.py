@@ -0,0 +1,63 @@
+"""
+Test LRU + TTL cache subsystem
+"""
+
+import threading
+import time
+from sofia_lite.utils.memo import TTLCache, get_cache, ttl_cache
+
+def test_lru_eviction_order():
+    """Test that the least recently used entry is evicted first"""
+    cache = TTLCache(ttl=60, maxsize=2, name="test_lru")
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the oldest
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_per_entry_ttl():
+    """Test that entries expire according to their own TTL"""
+    cache = TTLCache(ttl=60, maxsize=8, name="test_ttl")
+    cache.set("short", "x", ttl=0.01)
+    cache.set("long", "y")
+    time.sleep(0.02)
+
+    assert cache.get("short") is None
+    assert cache.get("long") == "y"
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+def test_concurrent_access_stays_bounded():
+    """Test that concurrent writers never exceed maxsize"""
+    cache = TTLCache(ttl=60, maxsize=64, name="test_threads")
+
+    def writer(offset):
+        for i in range(500):
+            cache.set(offset + i, i)
+            cache.get(offset + i // 2)
+
+    threads = [threading.Thread(target=writer, args=(n * 1000,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(cache) == 64
+
+def test_named_caches_and_decorator():
+    """Test named instances are shared and the decorator caches falsy results"""
+    assert get_cache("classify") is get_cache("classify")
+    calls = []
+
+    @ttl_cache(ttl=60, maxsize=4)
+    def lookup(x):
+        calls.append(x)
+        return 0
+
+    assert lookup(1) == 0 and lookup(1) == 0
+    assert calls == [1]
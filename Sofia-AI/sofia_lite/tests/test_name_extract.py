@@ -152,5 +152,55 @@ def test_unicode_support():
         if result:
             assert result == expected, f"Unicode test failed for '{text}': got '{result}', expected '{expected}'"
 
+def test_script_selects_candidate_languages():
+    """La scrittura del messaggio sceglie le lingue candidate"""
+    from sofia_lite.utils.name_extract import candidate_langs, detect_script
+    
+    assert detect_script("أنا محمد") == "arabic"
+    assert detect_script("मेरा नाम राजेश") == "devanagari"
+    assert detect_script("Mi chiamo Mario") == "latin"
+    assert candidate_langs("Mi chiamo Mario", "it") == ["it", "en", "fr", "es", "wo"]
+    assert candidate_langs("My name is John", "en") == ["en", "it", "fr", "es", "wo"]
+    assert candidate_langs("أنا محمد", "it") == ["ar", "ur"]
+    
+    # ctx.lang stale (it) but the user writes in Arabic script
+    ctx = Context(phone="+393001234568", lang="it", state="ASK_NAME")
+    assert extract_name("أنا محمد", ctx) == "محمد"
+
+    # Sticky language still it, the user answers in English
+    ctx = Context(phone="+393001234569", lang="it", state="ASK_NAME")
+    assert extract_name("my name is John", ctx) == "John"
+
+def test_original_casing_kept():
+    """Maiuscole digitate dall'utente conservate, minuscole capitalizzate"""
+    assert extract_name_regex("Mi chiamo Luca DiCaprio", "it") == "Luca DiCaprio"
+    assert extract_name_regex("mi chiamo luca rossi", "it") == "Luca Rossi"
+    assert extract_name_regex("MI CHIAMO LUCA", "it") == "Luca"
+    # Deciso parola per parola
+    assert extract_name_regex("mi chiamo Mario rossi", "it") == "Mario Rossi"
+    assert extract_name_regex("mi chiamo mario ROSSI", "it") == "Mario Rossi"
+    assert extract_name_regex("my name is ronald McDonald", "en") == "Ronald McDonald"
+
+def test_extract_name_once_per_turn():
+    """Orchestrator, executor e skill condividono una sola estrazione"""
+    from unittest.mock import patch
+    from sofia_lite.utils import name_extract
+    
+    ctx = Context(phone="+393001234569", lang="it", state="ASK_NAME")
+    with patch.object(name_extract, "extract_name_regex", wraps=name_extract.extract_name_regex) as spy:
+        assert extract_name("Sono Giulia", ctx) == "Giulia"
+        assert extract_name("Sono Giulia", ctx) == "Giulia"
+    assert spy.call_count == 1
+
+def test_orchestrator_extracts_only_when_name_needed():
+    """Fuori da ASK_NAME l'orchestrator non estrae il nome"""
+    from sofia_lite.agents.orchestrator import Orchestrator
+    
+    orchestrator = Orchestrator()
+    ctx = Context(phone="+393001234570", lang="it", state="ASK_SERVICE")
+    assert orchestrator._extract_name("Sono interessato al permesso", ctx) is None
+    ctx.state = "ASK_NAME"
+    assert orchestrator._extract_name("Sono Marco", ctx) == "Marco"
+
 if __name__ == "__main__":
     pytest.main([__file__])
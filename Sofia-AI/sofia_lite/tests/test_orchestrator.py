@@ -0,0 +1,56 @@
+"""
+Test Orchestrator async pipeline
+"""
+
+import asyncio
+import pytest
+from sofia_lite.agents import orchestrator
+from sofia_lite.agents.context import Context
+
+@pytest.fixture
+def patched_pipeline(monkeypatch):
+    """Mock context load, RAG, planner and skills to avoid external calls"""
+    def mock_get_context(phone):
+        return Context(phone=phone, lang="it", state="GREETING")
+
+    async def mock_aget_context(phone):
+        return mock_get_context(phone)
+
+    def mock_plan(ctx, message, chat):
+        return "GREET", "Intent Engine 2.0: GREET (confidence: 0.99)"
+
+    async def mock_aplan(ctx, message, chat):
+        return mock_plan(ctx, message, chat)
+
+    def mock_dispatch(intent, ctx, message):
+        return f"reply:{message}"
+
+    monkeypatch.setattr(orchestrator, "get_or_create_context", mock_get_context)
+    monkeypatch.setattr(orchestrator, "aget_or_create_context", mock_aget_context)
+    monkeypatch.setattr(orchestrator, "search_similar", lambda query, k=3, phone=None: [])
+    monkeypatch.setattr(orchestrator, "plan", mock_plan)
+    monkeypatch.setattr(orchestrator, "aplan", mock_aplan)
+    monkeypatch.setattr(orchestrator, "dispatch", mock_dispatch)
+    monkeypatch.setattr(orchestrator, "save_context", lambda ctx: None)
+
+@pytest.mark.asyncio
+async def test_aprocess_message(patched_pipeline):
+    """Test that the async path returns the same payload as the sync one"""
+    orch = orchestrator.Orchestrator()
+
+    result = await orch.aprocess_message("+393001234567", "Ciao")
+
+    assert result["reply"] == "reply:Ciao"
+    assert result["intent"] == "GREET"
+    assert result["phone"] == "+393001234567"
+    assert result == orch.process_message("+393001234567", "Ciao")
+
+@pytest.mark.asyncio
+async def test_aprocess_message_concurrent(patched_pipeline):
+    """Test that concurrent conversations are served side by side"""
+    orch = orchestrator.Orchestrator()
+    phones = [f"+3930000000{i:02d}" for i in range(20)]
+
+    results = await asyncio.gather(*(orch.aprocess_message(p, "Ciao") for p in phones))
+
+    assert [r["phone"] for r in results] == phones
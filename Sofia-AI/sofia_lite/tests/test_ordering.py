@@ -0,0 +1,263 @@
+"""
+Test per-phone ordering, MessageSid dedup and optimistic context writes
+"""
+
+import asyncio
+import pytest
+from google.api_core.exceptions import FailedPrecondition
+from sofia_lite.middleware.memory import FirestoreMemoryGateway
+from sofia_lite.middleware.ordering import KeyedAsyncLock, MessageDedup
+
+@pytest.mark.asyncio
+async def test_keyed_lock_serializes_per_key():
+    """Test that turns for one phone run one at a time, other phones in parallel"""
+    locks = KeyedAsyncLock()
+    events = []
+
+    async def turn(phone, n):
+        async with locks.hold(phone):
+            events.append(("start", phone, n))
+            await asyncio.sleep(0.01)
+            events.append(("end", phone, n))
+
+    await asyncio.gather(turn("+391", 1), turn("+391", 2), turn("+392", 1))
+
+    same_phone = [e for e in events if e[1] == "+391"]
+    assert same_phone == [("start", "+391", 1), ("end", "+391", 1), ("start", "+391", 2), ("end", "+391", 2)]
+    assert events.index(("start", "+392", 1)) < events.index(("end", "+391", 1))
+    assert len(locks) == 0 and locks.waits == 1
+
+@pytest.mark.asyncio
+async def test_duplicate_sid_runs_once():
+    """Test that concurrent and later redeliveries reuse the first result"""
+    dedup = MessageDedup(name="test_message_sid")
+    dedup.cache.clear()
+    calls = []
+
+    async def process():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"reply": "Ciao!"}
+
+    first, retry = await asyncio.gather(dedup.run_once("SM1", process), dedup.run_once("SM1", process))
+    late = await dedup.run_once("SM1", process)
+
+    assert calls == [1]
+    assert first == ({"reply": "Ciao!"}, False)
+    assert retry == late == ({"reply": "Ciao!"}, True)
+
+class FakeClaimStore:
+    """webhook_messages shared by every instance: create fails if the sid exists"""
+    def __init__(self):
+        self.claims = set()
+
+    async def claim(self, sid):
+        if sid in self.claims:
+            return False
+        self.claims.add(sid)
+        return True
+
+    async def release(self, sid):
+        self.claims.discard(sid)
+
+@pytest.mark.asyncio
+async def test_failed_or_foreign_sid():
+    """Test that failures release the claim and sids claimed elsewhere are skipped"""
+    store = FakeClaimStore()
+    store.claims.add("SM_OTHER")
+    dedup = MessageDedup(name="test_message_sid", claim_fn=store.claim, release_fn=store.release)
+    dedup.cache.clear()
+
+    async def boom():
+        raise RuntimeError("LLM down")
+
+    with pytest.raises(RuntimeError):
+        await dedup.run_once("SM2", boom)
+    assert "SM2" not in store.claims
+
+    async def ok():
+        return "ok"
+
+    assert await dedup.run_once("SM2", ok) == ("ok", False)
+    assert "SM2" in store.claims
+    assert await dedup.run_once("SM_OTHER", ok) == (None, True)
+
+@pytest.mark.asyncio
+async def test_failed_turn_retried_on_other_instance():
+    """Test that a redelivery reaching another instance runs after a failure"""
+    store = FakeClaimStore()
+    first = MessageDedup(name="test_message_sid", claim_fn=store.claim, release_fn=store.release)
+    other = MessageDedup(name="test_message_sid_other", claim_fn=store.claim, release_fn=store.release)
+    first.cache.clear()
+    other.cache.clear()
+
+    async def boom():
+        raise RuntimeError("Twilio down")
+
+    async def ok():
+        return "sent"
+
+    with pytest.raises(RuntimeError):
+        await first.run_once("SM3", boom)
+    assert await other.run_once("SM3", ok) == ("sent", False)
+    assert await first.run_once("SM3", ok) == (None, True)
+
+@pytest.mark.asyncio
+async def test_failed_send_is_raised(monkeypatch):
+    """Test that a failed Twilio send raises instead of returning an error result"""
+    from sofia_lite import whatsapp
+
+    class FailingMessages:
+        async def create_async(self, **kwargs):
+            raise RuntimeError("503")
+
+    class FailingClient:
+        messages = FailingMessages()
+
+    monkeypatch.setattr(whatsapp, "_get_async_twilio_client", lambda: FailingClient())
+    with pytest.raises(RuntimeError):
+        await whatsapp._asend_whatsapp_message("+391", "Ciao!")
+
+@pytest.mark.asyncio
+async def test_async_twilio_session_closed(monkeypatch):
+    """Test that shutdown closes the aiohttp session of the async Twilio client"""
+    from sofia_lite import whatsapp
+
+    closed = []
+
+    class FakeHttpClient:
+        async def close(self):
+            closed.append(True)
+
+    class FakeClient:
+        http_client = FakeHttpClient()
+
+    monkeypatch.setattr(whatsapp, "_async_twilio_client", FakeClient())
+    await whatsapp.aclose_twilio_client()
+    assert closed == [True]
+    assert whatsapp._async_twilio_client is None
+
+class FakeResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db, self.ops = db, []
+
+    def set(self, ref, data, merge=None):
+        self.ops.append((ref, data, None))
+
+    def update(self, ref, data, option=None):
+        self.ops.append((ref, data, option))
+
+    def commit(self):
+        for ref, _, expected in self.ops:
+            if expected is not None and self.db.times.get(ref) != expected:
+                raise FailedPrecondition("stale")
+        results = []
+        for ref, data, _ in self.ops:
+            self.db.clock += 1
+            self.db.times[ref] = self.db.clock
+            self.db.docs.setdefault(ref, {}).update(data)
+            results.append(FakeResult(self.db.clock))
+        return results
+
+class FakeSnapshot:
+    def __init__(self, data, update_time):
+        self.exists, self.update_time, self._data = data is not None, update_time, data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+class FakeDocument:
+    def __init__(self, path, db=None):
+        self.path, self.db = path, db
+
+    def collection(self, name):
+        return FakeCollection(f"{self.path}/{name}", self.db)
+
+    def get(self):
+        return FakeSnapshot(self.db.docs.get(self), self.db.times.get(self))
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __eq__(self, other):
+        return self.path == other.path
+
+class FakeCollection:
+    def __init__(self, path, db=None):
+        self.path, self.db = path, db
+
+    def document(self, name="auto"):
+        return FakeDocument(f"{self.path}/{name}", self.db)
+
+class FakeDb:
+    def __init__(self):
+        self.docs, self.times, self.clock = {}, {}, 100
+
+    def collection(self, name):
+        return FakeCollection(name, self)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def write_option(self, last_update_time):
+        return last_update_time
+
+def _delta(fields, expected=None, base=None):
+    return {"fields": fields, "history_set": None, "history_append": [],
+            "archive": [], "expected_update_time": expected, "base": base or {}}
+
+def test_conflicting_user_is_isolated():
+    """Test that a stale precondition only affects the conflicting user"""
+    gateway = FirestoreMemoryGateway.__new__(FirestoreMemoryGateway)
+    gateway.db, gateway._initialized, gateway.write_conflicts = FakeDb(), True, 0
+    alice, bob = FakeDocument("users/+391"), FakeDocument("users/+392")
+    gateway.db.times = {alice: 5, bob: 7}  # bob was written by another instance since our read at 6
+
+    times = gateway.save_user_deltas({
+        "+391": _delta({"state": "ASK_SERVICE"}, expected=5),
+        "+392": _delta({"state": "ASK_CHANNEL"}, expected=6),
+    })
+
+    assert times["+391"] is not None and times["+392"] is None
+    assert gateway.db.docs[bob] == {"state": "ASK_CHANNEL"}
+    assert gateway.write_conflicts == 1
+
+def test_conflict_keeps_the_other_instance_fields():
+    """Test that on a stale precondition the other instance's state survives"""
+    gateway = FirestoreMemoryGateway.__new__(FirestoreMemoryGateway)
+    gateway.db, gateway._initialized, gateway.write_conflicts = FakeDb(), True, 0
+    bob = FakeDocument("users/+392")
+    # Read at 6 with state ASK_SERVICE, lang it; another instance then moved the state on
+    gateway.db.docs = {bob: {"state": "ASK_PAYMENT", "lang": "it"}}
+    gateway.db.times = {bob: 7}
+
+    times = gateway.save_user_deltas({
+        "+392": _delta({"state": "ASK_CHANNEL", "lang": "en"}, expected=6,
+                       base={"state": "ASK_SERVICE", "lang": "it"}),
+    })
+
+    assert times == {"+392": None}
+    assert gateway.db.docs[bob] == {"state": "ASK_PAYMENT", "lang": "en"}
+    assert gateway.write_conflicts == 1
+
+@pytest.mark.asyncio
+async def test_async_client_is_the_library_client(monkeypatch):
+    """Test that the lifespan builds the plain AsyncClient and closes it through close()"""
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import firestore
+
+    gateway = FirestoreMemoryGateway.__new__(FirestoreMemoryGateway)
+    gateway.adb = None
+    monkeypatch.setattr(gateway, "_client_args",
+                        lambda: {"project": "test-sofia", "credentials": AnonymousCredentials()}, raising=False)
+    await gateway.ainitialize(probe=False)
+    assert type(gateway.adb) is firestore.AsyncClient
+
+    closed = []
+    monkeypatch.setattr(gateway.adb, "close", lambda: closed.append(True))
+    await gateway.aclose()
+    assert closed == [True] and gateway.adb is None
@@ -0,0 +1,59 @@
+"""
+Test enrichment pipeline: solo gli stadi richiesti dallo stato vengono eseguiti
+"""
+
+import pytest
+from sofia_lite.agents import orchestrator, pipeline
+from sofia_lite.agents.context import Context
+from sofia_lite.agents.state import State
+from sofia_lite.metrics import enrichment_stages
+
+def _count(stage: str, result: str) -> float:
+    return enrichment_stages.labels(stage=stage, result=result)._value.get()
+
+def test_spec_covers_every_state():
+    """Ogni stato della macchina ha la sua voce nello spec"""
+    assert set(pipeline.STAGE_SPEC) == {state.name for state in State}
+    for stages in pipeline.STAGE_SPEC.values():
+        assert stages <= set(pipeline.STAGES)
+
+def test_plan_stages_skips_known_language_and_counts():
+    """lang saltato se la lingua è nota, name solo in ASK_NAME"""
+    skipped = _count("lang", "skip")
+    assert pipeline.plan_stages(Context(phone="+39", lang="it", state="ASK_SERVICE")) == frozenset()
+    assert _count("lang", "skip") == skipped + 1
+
+    ran = _count("name", "run")
+    assert pipeline.plan_stages(Context(phone="+39", lang="unknown", state="ASK_NAME")) == {"lang", "name"}
+    assert _count("name", "run") == ran + 1
+
+def test_unknown_state_runs_every_stage(monkeypatch):
+    """Stato non previsto dallo spec: tutti gli stadi, come prima"""
+    assert pipeline.stages_for("SOMETHING_NEW") == set(pipeline.STAGES)
+    monkeypatch.setattr(pipeline, "RAG_STATES", frozenset({"ASK_SERVICE"}))
+    assert "rag" in pipeline.stages_for("ASK_SERVICE")
+
+@pytest.mark.asyncio
+async def test_orchestrator_runs_only_planned_stages(monkeypatch):
+    """Nessun embedding/FAISS per stati che non usano il RAG"""
+    rag_calls = []
+
+    async def mock_aget_context(phone):
+        return Context(phone=phone, lang="it", state="ASK_SERVICE")
+
+    async def mock_aplan(ctx, message, chat):
+        return "ASK_SERVICE", "test (confidence: 0.99)"
+
+    monkeypatch.setattr(orchestrator, "aget_or_create_context", mock_aget_context)
+    monkeypatch.setattr(orchestrator, "search_similar", lambda query, k=3, phone=None: rag_calls.append(query) or [])
+    monkeypatch.setattr(orchestrator, "aplan", mock_aplan)
+    monkeypatch.setattr(orchestrator, "dispatch", lambda intent, ctx, message: "ok")
+    monkeypatch.setattr(orchestrator, "save_context", lambda ctx: None)
+
+    orch = orchestrator.Orchestrator()
+    await orch.aprocess_message("+393001234599", "Vorrei il permesso di soggiorno")
+    assert rag_calls == []
+
+    monkeypatch.setattr(pipeline, "RAG_STATES", frozenset({"ASK_SERVICE"}))
+    await orch.aprocess_message("+393001234599", "Vorrei il permesso di soggiorno")
+    assert rag_calls == ["Vorrei il permesso di soggiorno"]
@@ -0,0 +1,43 @@
+"""
+Test template fast-path for fixed-text skills
+"""
+
+import importlib
+from sofia_lite.agents.context import Context
+from sofia_lite.policy.language_support import render
+
+# skills/__init__ re-exports run() under the module names
+greet_user = importlib.import_module("sofia_lite.skills.greet_user")
+ask_service = importlib.import_module("sofia_lite.skills.ask_service")
+
+def _fail_if_called(*args, **kwargs):
+    raise AssertionError("LLM should not be called in template mode")
+
+def test_greet_renders_from_catalogue(monkeypatch):
+    """Test that GREET in template mode never calls the LLM"""
+    monkeypatch.setattr(greet_user, "template_chat", _fail_if_called)
+    ctx = Context(phone="+393001234567", lang="fr", state="GREETING")
+
+    reply = greet_user.run(ctx, "Bonjour")
+
+    assert reply == render("greet_ask_name", "fr")
+
+def test_named_variant_interpolates_name():
+    """Test that the _named variant is used once the name is known"""
+    ctx = Context(phone="+393001234567", lang="en", name="Aisha", state="ASK_SERVICE")
+
+    reply = ask_service.run(ctx, "hello")
+
+    assert reply.startswith("Nice to meet you, Aisha!")
+
+def test_template_mode_off_uses_llm(monkeypatch):
+    """Test that disabling template mode falls back to the LLM"""
+    monkeypatch.setenv("SOFIA_TEMPLATE_MODE", "off")
+    monkeypatch.setattr(greet_user, "template_chat", lambda *a, **k: "llm reply")
+    ctx = Context(phone="+393001234567", lang="it", state="GREETING")
+
+    assert greet_user.run(ctx, "Ciao") == "llm reply"
+
+def test_missing_slot_renders_empty():
+    """Test that a missing slot does not raise"""
+    assert "{slots}" not in render("propose_slots", "it")
@@ -0,0 +1,122 @@
+"""
+Test persistent, partitioned vector store (local disk backend)
+"""
+
+import os
+import pytest
+from sofia_lite.middleware.vector_store import (
+    LocalDiskBackend, PartitionedVectorStore, VectorStore, get_backend
+)
+
+@pytest.fixture(autouse=True)
+def test_mode(monkeypatch):
+    monkeypatch.setenv("TEST_MODE", "true")
+
+def test_warm_start_from_disk(tmp_path):
+    """Test that a flushed store is reloaded by a new instance"""
+    vs = VectorStore(backend=LocalDiskBackend(str(tmp_path)), flush_every=1000)
+    vs.add("Voglio una consulenza", {"phone": "+393001234567"})
+    vs.add("Permesso di soggiorno", {"phone": "+393001234567"})
+    vs.flush()
+
+    restarted = VectorStore(backend=LocalDiskBackend(str(tmp_path)))
+    results = restarted.search("Permesso di soggiorno", k=1)
+
+    assert results[0]["text"] == "Permesso di soggiorno"
+    assert results[0]["metadata"]["phone"] == "+393001234567"
+    assert restarted.index.ntotal == 2
+
+def test_no_flush_before_batch(tmp_path):
+    """Test that appends are persisted in batches, not one by one"""
+    vs = VectorStore(backend=LocalDiskBackend(str(tmp_path)), flush_every=1000)
+    vs.add("Ciao")
+
+    assert not os.path.exists(tmp_path / "index.faiss")
+    assert vs._pending == 1
+
+def test_out_of_sync_files_start_empty(tmp_path):
+    """Test that a mismatch between index and metadata is not loaded"""
+    vs = VectorStore(backend=LocalDiskBackend(str(tmp_path)))
+    vs.add("Ciao")
+    vs.flush()
+    (tmp_path / "store.json").write_text('{"texts": [], "metadata": []}')
+
+    assert VectorStore(backend=LocalDiskBackend(str(tmp_path))).search("Ciao") == []
+
+def test_get_backend_uri():
+    """Test backend selection from the store URI"""
+    assert get_backend("") is None
+    assert get_backend("file:///var/sofia").root == "/var/sofia"
+
+def test_partitions_isolate_users(tmp_path):
+    """Test that a user's search never returns another user's messages"""
+    store = PartitionedVectorStore(backend=LocalDiskBackend(str(tmp_path)))
+    store.add("Mi chiamo Mario", {"phone": "+393001111111"})
+    store.add("Mi chiamo Aisha", {"phone": "+393002222222"})
+    store.add_to_kb("La consulenza costa 60 euro")
+
+    results = store.search("Mi chiamo Aisha", k=5, phone="+393001111111")
+
+    texts = [r["text"] for r in results]
+    assert "Mi chiamo Aisha" not in texts
+    assert set(texts) == {"Mi chiamo Mario", "La consulenza costa 60 euro"}
+
+def test_evicted_partition_is_flushed_and_reloaded(tmp_path):
+    """Test that LRU eviction persists the partition"""
+    store = PartitionedVectorStore(backend=LocalDiskBackend(str(tmp_path)), max_partitions=1)
+    store.add("Permesso di soggiorno", {"phone": "+393001111111"})
+    store.add("Cittadinanza", {"phone": "+393002222222"})  # evicts the first user
+
+    results = store.search("Permesso di soggiorno", k=1, phone="+393001111111", include_kb=False)
+
+    assert results[0]["text"] == "Permesso di soggiorno"
+
+def test_concurrent_embeddings_are_batched(monkeypatch):
+    """Test that concurrent embed() calls share one OpenAI request and the cache"""
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+    from sofia_lite.middleware import vector_store
+    from sofia_lite.utils.memo import get_cache
+
+    monkeypatch.delenv("TEST_MODE")
+    batches = []
+    def fake_embeddings(texts):
+        batches.append(list(texts))
+        return [np.full(4, len(t), dtype=np.float32) for t in texts]
+
+    monkeypatch.setattr(vector_store, "_get_openai_embeddings", fake_embeddings)
+    monkeypatch.setattr(vector_store, "_batcher", vector_store.EmbeddingBatcher(window_ms=50))
+    get_cache("embeddings").clear()
+
+    texts = ["Ciao", "Sì", "Ciao", "Permesso", "Cittadinanza"]
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        vectors = list(pool.map(vector_store.embed, texts))
+
+    assert len(batches) == 1 and sorted(batches[0]) == ["Ciao", "Cittadinanza", "Permesso", "Sì"]
+    assert vectors[0][0] == len("Ciao")
+    vector_store.embed("Ciao")  # cache hit, no new request
+    assert len(batches) == 1
+
+def test_embed_falls_back_when_batch_stalls(monkeypatch):
+    """Test that a stalled batch does not block embed(): it falls back to a direct call"""
+    import numpy as np
+    from sofia_lite.middleware import vector_store
+    from sofia_lite.utils.memo import get_cache
+
+    monkeypatch.delenv("TEST_MODE")
+    calls = []
+    def fake_embeddings(texts):
+        calls.append(list(texts))
+        return [np.ones(4, dtype=np.float32) for _ in texts]
+
+    batcher = vector_store.EmbeddingBatcher()
+    monkeypatch.setattr(batcher, "_ensure_thread", lambda: None)  # nessun worker: il batch resta fermo
+    monkeypatch.setattr(vector_store, "_get_openai_embeddings", fake_embeddings)
+    monkeypatch.setattr(vector_store, "_batcher", batcher)
+    get_cache("embeddings").clear()
+
+    vector = batcher.embed("Rinnovo permesso", timeout=0.05)
+
+    assert calls == [["Rinnovo permesso"]]
+    assert vector[0] == 1.0
+    assert get_cache("embeddings").get(vector_store._text_key("Rinnovo permesso")) is not None
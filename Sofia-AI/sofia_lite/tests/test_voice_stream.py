@@ -0,0 +1,64 @@
+"""
+Test streaming replies and early voice output
+"""
+
+import time
+import pytest
+from sofia_lite.middleware import llm
+from sofia_lite.middleware.voice_stream import VoiceTurnRegistry
+from sofia_lite.middleware.workers import run_blocking
+
+def test_iter_sentences_splits_on_boundaries():
+    """Test that sentences are emitted as soon as their boundary arrives"""
+    tokens = ["Cia", "o Marco! Per", " il permesso serve", " una consulenza. ", "आप कैसे हैं। ", "Ok"]
+
+    assert list(llm.iter_sentences(tokens)) == [
+        "Ciao Marco!", "Per il permesso serve una consulenza.", "आप कैसे हैं।", "Ok"
+    ]
+
+def _slow_tokens(*tokens, delay=0.0):
+    def stream(sys_prompt, user_prompt):
+        for token in tokens:
+            time.sleep(delay)
+            yield token
+    return stream
+
+def test_raw_chat_streams_into_sink(monkeypatch):
+    """Test that with a sink registered the LLM reply is streamed sentence by sentence"""
+    monkeypatch.setattr(llm, "stream_chat", _slow_tokens("Perfetto! ", "Online o in ufficio?"))
+    sentences = []
+
+    with llm.reply_stream(sentences.append):
+        reply = llm._raw_chat("sys streaming test", "user streaming test")
+
+    assert reply == "Perfetto! Online o in ufficio?"
+    assert sentences == ["Perfetto!", "Online o in ufficio?"]
+
+@pytest.mark.asyncio
+async def test_voice_turn_speaks_first_sentence_early(monkeypatch):
+    """Test that the first sentence is available before the turn completes"""
+    monkeypatch.setattr(llm, "stream_chat",
+                        _slow_tokens("Certo. ", "La consulenza costa 60 €. ", "Quando preferisci?", delay=0.05))
+
+    async def run_turn():
+        reply = await run_blocking(llm._raw_chat, "sys voice test", "user voice test")
+        return {"reply": reply}
+
+    first, turn_id, turn = await VoiceTurnRegistry().start(run_turn)
+
+    assert first == "Certo."
+    assert not turn.task.done()
+    rest, result = await turn.remainder()
+    assert rest == "La consulenza costa 60 €. Quando preferisci?"
+    assert result["reply"].startswith("Certo.")
+
+@pytest.mark.asyncio
+async def test_voice_turn_without_streaming():
+    """Test that cached/template replies come back whole"""
+    async def run_turn():
+        return {"reply": "Ciao! Come ti chiami?"}
+
+    first, _, turn = await VoiceTurnRegistry().start(run_turn)
+
+    assert first is None
+    assert await turn.remainder() == ("Ciao! Come ti chiami?", {"reply": "Ciao! Come ti chiami?"})
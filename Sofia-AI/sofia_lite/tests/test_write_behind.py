@@ -0,0 +1,155 @@
+"""
+Test write-behind context persistence
+"""
+
+import pytest
+from sofia_lite.agents.context import Context
+from sofia_lite.middleware import memory
+from sofia_lite.middleware.write_behind import WriteBehindQueue, WriteQueueFull
+
+class FakeGateway:
+    def __init__(self):
+        self.batches = []
+        self.indexed = []
+
+    def save_user_deltas(self, deltas):
+        self.batches.append(deltas)
+
+    def add_to_vector_store(self, text, metadata=None):
+        self.indexed.append(text)
+
+@pytest.fixture
+def gateway(monkeypatch):
+    """Fresh write queue writing into a fake gateway"""
+    fake = FakeGateway()
+    monkeypatch.setattr(memory, "_get_memory_gateway", lambda: fake)
+    monkeypatch.setattr(memory, "_write_queue",
+                        WriteBehindQueue(memory._write_contexts, interval_ms=1000, merge=memory._merge_deltas))
+    return fake
+
+def test_turn_saves_coalesce_into_one_write(gateway):
+    """Test that several saves in one turn produce a single batched write"""
+    ctx = Context(phone="+393001234567", state="ASK_NAME")
+
+    with memory.context_turn():
+        memory.save_context(ctx)
+        ctx.name = "Mario"
+        memory.save_context(ctx)
+        ctx.state = "ASK_SERVICE"
+        memory.save_context(ctx)
+        assert memory.get_write_stats()["pending"] == 0  # still buffered in the turn
+
+    memory.flush_pending_writes()
+
+    assert len(gateway.batches) == 1
+    saved = gateway.batches[0]["+393001234567"]["fields"]
+    assert saved["name"] == "Mario" and saved["state"] == "ASK_SERVICE"
+
+def test_queue_coalesces_per_phone_and_snapshots(gateway):
+    """Test that queued saves coalesce per phone and are not affected by later mutations"""
+    a = Context(phone="+391", history=[{"role": "user", "text": "Ciao"}])
+    b = Context(phone="+392")
+
+    memory.save_context(a)
+    memory.save_context(b)
+    a.state = "ASK_NAME"
+    memory.save_context(a)
+    a.state = "MUTATED_AFTER_SAVE"
+    memory.flush_pending_writes()
+
+    assert len(gateway.batches) == 1
+    assert set(gateway.batches[0]) == {"+391", "+392"}
+    assert gateway.batches[0]["+391"]["fields"]["state"] == "ASK_NAME"
+    assert gateway.indexed == ["Ciao"]
+    assert memory.get_write_stats()["coalesced"] == 1
+
+def test_only_changed_fields_and_history_append(gateway):
+    """Test that a loaded context writes only its delta, with history as an append"""
+    history = [{"role": "user", "text": f"msg {i}"} for i in range(10)]
+    ctx = Context(phone="+391", state="ASK_SERVICE", name="Mario", history=list(history))
+    ctx.mark_saved()
+
+    ctx.state = "PROPOSE_CONSULT"
+    ctx.history.append({"role": "user", "text": "permesso"})
+    ctx.history.append({"role": "assistant", "text": "Ok!"})
+    memory.save_context(ctx)
+    ctx.slots["service"] = "permesso"
+    memory.save_context(ctx)
+    memory.save_context(ctx)  # unchanged: no new delta
+    memory.flush_pending_writes()
+
+    delta = gateway.batches[0]["+391"]
+    assert delta["fields"] == {"state": "PROPOSE_CONSULT", "slots": {"service": "permesso"}}
+    assert delta["history_set"] is None
+    assert [m["text"] for m in delta["history_append"]] == ["permesso", "Ok!"]
+    assert gateway.indexed == ["permesso"]
+
+def test_rewritten_history_is_sent_whole(gateway):
+    """Test that a history that is no longer a prefix is replaced, not appended"""
+    ctx = Context(phone="+391", history=[{"role": "user", "text": "a"}])
+    ctx.mark_saved()
+
+    ctx.history = [{"role": "user", "text": "b"}]
+    memory.save_context(ctx)
+    memory.flush_pending_writes()
+
+    assert gateway.batches[0]["+391"]["history_set"] == [{"role": "user", "text": "b"}]
+
+def test_full_queue_flushes_in_caller():
+    """Test back-pressure: a full queue is drained by the caller"""
+    written = []
+    queue = WriteBehindQueue(lambda batch: written.append(dict(batch)), max_pending=2, interval_ms=1000)
+
+    queue.put("a", 1)
+    queue.put("b", 2)
+
+    assert written == [{"a": 1, "b": 2}]
+
+def test_failing_store_caps_the_queue():
+    """Test that while the store fails new keys are rejected past max_pending"""
+    def failing(batch):
+        raise RuntimeError("UNAVAILABLE")
+
+    queue = WriteBehindQueue(failing, max_pending=2, interval_ms=1000)
+    queue.put("a", 1)
+    queue.put("b", 2)  # full: the caller's flush fails and requeues
+
+    with pytest.raises(WriteQueueFull):
+        queue.put("c", 3)
+    queue.put("a", 4)  # a key already waiting is still coalesced
+
+    stats = queue.stats()
+    assert stats["pending"] == 2 and stats["rejected"] == 1
+
+def test_failed_flush_is_requeued_under_newer_saves(gateway, monkeypatch):
+    """Test that a failed batch is retried, merged under newer deltas, and saved only after commit"""
+    ctx = Context(phone="+391", state="ASK_NAME")
+    ctx.mark_saved()
+    failures = []
+
+    def flaky(deltas):
+        if not failures:
+            failures.append(1)
+            raise RuntimeError("UNAVAILABLE")
+        gateway.batches.append(deltas)
+
+    monkeypatch.setattr(gateway, "save_user_deltas", flaky)
+
+    ctx.name = "Mario"
+    ctx.history.append({"role": "user", "text": "mi chiamo Mario"})
+    memory.save_context(ctx)
+    memory.flush_pending_writes()
+    assert gateway.batches == [] and ctx._saved["name"] is None
+    assert memory.get_write_stats()["pending"] == 1
+
+    ctx.state = "ASK_SERVICE"
+    memory.save_context(ctx)
+    memory.flush_pending_writes()
+
+    delta = gateway.batches[0]["+391"]
+    assert delta["fields"] == {"name": "Mario", "state": "ASK_SERVICE"}
+    assert [m["text"] for m in delta["history_append"]] == ["mi chiamo Mario"]
+    assert ctx._saved["name"] == "Mario" and ctx._saved["state"] == "ASK_SERVICE"
+    assert ctx._queued is None
+    stats = memory.get_write_stats()
+    assert stats["errors"] == 1 and stats["retried"] == 1 and stats["pending"] == 0
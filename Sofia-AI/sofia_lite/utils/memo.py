@@ -1,86 +1,177 @@
 """
 TTL Cache Decorator - Δmini Performance Optimization
-In-process TTL cache per ridurre chiamate ripetute
+In-process LRU + TTL cache per ridurre chiamate ripetute
 """
 
+import os
 import time
 import functools
-from typing import Any, Callable, Dict, Tuple
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
 import logging
 
+from ..metrics import cache_evictions, cache_hits, cache_misses, cache_size
+
 log = logging.getLogger("sofia.memo")
 
+_MISSING = object()
+
 class TTLCache:
-    """Simple TTL cache implementation"""
-    
-    def __init__(self, ttl: int = 30, maxsize: int = 256):
+    """Bounded, thread-safe LRU cache with per-entry TTL (O(1) get/set/evict)"""
+
+    def __init__(self, ttl: int = 30, maxsize: int = 256, name: str = "anonymous"):
         self.ttl = ttl
         self.maxsize = maxsize
-        self.cache: Dict[str, Tuple[Any, float]] = {}
-    
-    def get(self, key: str) -> Any:
-        """Get value from cache if not expired"""
-        if key in self.cache:
-            value, timestamp = self.cache[key]
-            if time.time() - timestamp < self.ttl:
-                return value
-            else:
+        self.name = name
+        self.cache: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get value from cache if not expired (refreshes LRU position)"""
+        with self._lock:
+            entry = self.cache.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if time.monotonic() < expires_at:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                    cache_hits.labels(cache=self.name).inc()
+                    return value
                 del self.cache[key]
-        return None
-    
-    def set(self, key: str, value: Any):
-        """Set value in cache with timestamp"""
-        # Evict oldest if cache is full
-        if len(self.cache) >= self.maxsize:
-            oldest_key = min(self.cache.keys(), key=lambda k: self.cache[k][1])
-            del self.cache[oldest_key]
-        
-        self.cache[key] = (value, time.time())
-    
+                self.expirations += 1
+                cache_size.labels(cache=self.name).set(len(self.cache))
+            self.misses += 1
+        cache_misses.labels(cache=self.name).inc()
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Set value with its own TTL, evicting the least recently used entries"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        evicted = 0
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            self.cache[key] = (value, expires_at)
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+            size = len(self.cache)
+        if evicted:
+            cache_evictions.labels(cache=self.name).inc(evicted)
+        cache_size.labels(cache=self.name).set(size)
+
+    def delete(self, key: Hashable):
+        """Remove a single key"""
+        with self._lock:
+            self.cache.pop(key, None)
+            size = len(self.cache)
+        cache_size.labels(cache=self.name).set(size)
+
     def clear(self):
         """Clear all cached values"""
-        self.cache.clear()
+        with self._lock:
+            self.cache.clear()
+        cache_size.labels(cache=self.name).set(0)
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters for this cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.cache),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+# Named cache instances: name → (ttl seconds, maxsize), override with
+# SOFIA_CACHE_<NAME>_TTL / SOFIA_CACHE_<NAME>_SIZE
+CACHE_DEFAULTS: Dict[str, Tuple[int, int]] = {
+    "classify": (30, 1024),
+    "chat": (30, 1024),
+    "lang": (30, 512),
+    "embeddings": (3600, 4096),
+    "similarity": (30, 256),
+    "reply": (3600, 2048),
+    "context": (900, 4096),  # = SOFIA_CONTEXT_STALE_S: copre la rivalidazione in background
+    "message_sid": (3600, 8192),
+    "transcript": (3600, 1024),
+    "names": (60, 2048),
+}
 
-def ttl_cache(ttl: int = 30, maxsize: int = 256):
+_CACHES: Dict[str, TTLCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+def get_cache(name: str) -> TTLCache:
+    """Get (or create) a named cache instance"""
+    cache = _CACHES.get(name)
+    if cache is None:
+        with _CACHES_LOCK:
+            cache = _CACHES.get(name)
+            if cache is None:
+                ttl, maxsize = CACHE_DEFAULTS.get(name, (30, 256))
+                env = name.upper()
+                ttl = int(os.getenv(f"SOFIA_CACHE_{env}_TTL", ttl))
+                maxsize = int(os.getenv(f"SOFIA_CACHE_{env}_SIZE", maxsize))
+                cache = TTLCache(ttl=ttl, maxsize=maxsize, name=name)
+                _CACHES[name] = cache
+    return cache
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats for every named cache"""
+    return {name: cache.stats() for name, cache in list(_CACHES.items())}
+
+def ttl_cache(ttl: int = 30, maxsize: int = 256, name: Optional[str] = None):
     """
     Decorator per TTL cache - Δmini optimization
-    
+
     Args:
         ttl: Time to live in seconds
         maxsize: Maximum number of cached items
+        name: Use the named cache instance instead of a private one
     """
     def decorator(func: Callable) -> Callable:
-        cache = TTLCache(ttl=ttl, maxsize=maxsize)
-        
+        cache = get_cache(name) if name else TTLCache(ttl=ttl, maxsize=maxsize, name=func.__name__)
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs) -> Any:
             # Create cache key from function name and arguments
-            key = f"{func.__name__}:{hash(str(args) + str(sorted(kwargs.items())))}"
-            
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+
             # Try to get from cache
-            cached_result = cache.get(key)
-            if cached_result is not None:
+            cached_result = cache.get(key, _MISSING)
+            if cached_result is not _MISSING:
                 log.debug(f"💾 Cache hit for {func.__name__}")
                 return cached_result
-            
+
             # Execute function and cache result
             result = func(*args, **kwargs)
             cache.set(key, result)
             log.debug(f"💾 Cache miss for {func.__name__}, cached result")
-            
+
             return result
-        
+
+        wrapper.cache = cache
         return wrapper
     return decorator
 
-# Global caches for common functions
-_language_cache = TTLCache(ttl=30, maxsize=256)
-_similarity_cache = TTLCache(ttl=30, maxsize=256)
-
 def get_language_cache() -> TTLCache:
     """Get global language detection cache"""
-    return _language_cache
+    return get_cache("lang")
 
 def get_similarity_cache() -> TTLCache:
     """Get global similarity classification cache"""
-    return _similarity_cache 
\ No newline at end of file
+    return get_cache("similarity")
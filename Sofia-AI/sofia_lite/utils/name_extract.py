@@ -1,12 +1,17 @@
 """
 Sofia Lite - Multilingual Name Extraction
 Extracts names from user messages in 9 languages using regex and LLM fallback.
+Pattern compilati una volta per lingua; la scrittura del messaggio sceglie le
+lingue candidate, il nome mantiene le maiuscole digitate dall'utente e ogni
+turno estrae al massimo una volta per (phone, messaggio).
 """
 
 import re
 import logging
 from typing import Optional, Dict, List
 
+from .memo import get_cache
+
 logger = logging.getLogger(__name__)
 
 # Simple regex for names (letters, apostrophes, hyphens)
@@ -48,51 +53,122 @@ NAME_PATTERNS: Dict[str, List[str]] = {
     ],
 }
 
+_FLAGS = re.UNICODE | re.IGNORECASE
+COMPILED_PATTERNS: Dict[str, List[re.Pattern]] = {
+    lang: [re.compile(p, _FLAGS) for p in patterns] for lang, patterns in NAME_PATTERNS.items()
+}
+
+# Lingue candidate per scrittura (ordine = priorità quando ctx.lang non corrisponde)
+SCRIPT_LANGS: Dict[str, List[str]] = {
+    "latin": ["it", "en", "fr", "es", "wo"],
+    "arabic": ["ar", "ur"],
+    "devanagari": ["hi"],
+    "bengali": ["bn"],
+}
+_SCRIPT_RANGES = [
+    ("arabic", re.compile(r"[\u0600-\u06FF]")),
+    ("devanagari", re.compile(r"[\u0900-\u097F]")),
+    ("bengali", re.compile(r"[\u0980-\u09FF]")),
+    ("latin", re.compile(r"[A-Za-zÀ-ÖØ-öø-ÿ]")),
+]
+_LANG_SCRIPT = {lang: script for script, langs in SCRIPT_LANGS.items() for lang in langs}
+
+# Stati in cui serve il nome: solo lì l'orchestrator lo estrae in anticipo
+NAME_STATES = frozenset({"ASK_NAME"})
+
+_DIGITS = re.compile(r'[0-9]')
+_INVALID = re.compile(r'[^a-zA-ZÀ-ÿ\u0600-\u06FF\u0900-\u097F\u0980-\u09FF\s\'-]', re.UNICODE)
+_SPACES = re.compile(r'\s+')
+_MISSING = object()
+
+def detect_script(text: str) -> Optional[str]:
+    """Script of the text (latin, arabic, devanagari, bengali; non-Latin wins) or None"""
+    for script, pattern in _SCRIPT_RANGES:
+        if pattern.search(text):
+            return script
+    return None
+
+def candidate_langs(text: str, lang: Optional[str]) -> List[str]:
+    """ctx.lang first, then the other languages written in the text's script"""
+    if lang not in NAME_PATTERNS:
+        lang = "it"
+    script = detect_script(text)
+    if script is None:
+        return [lang]
+    langs = SCRIPT_LANGS[script]
+    if _LANG_SCRIPT[lang] != script:
+        return list(langs)
+    return [lang] + [other for other in langs if other != lang]
+
+def needs_name(ctx) -> bool:
+    """True when the conversation state is waiting for the user's name"""
+    return ctx.state in NAME_STATES
+
 def extract_name_regex(text: str, lang: str = "it") -> Optional[str]:
     """Extract name using regex patterns for the specified language."""
     if lang not in NAME_PATTERNS:
         lang = "it"
     
-    text_lower = text.lower().strip()
+    text = text.strip()
     
-    for pattern in NAME_PATTERNS[lang]:
-        match = re.search(pattern, text_lower, re.UNICODE | re.IGNORECASE)
+    for pattern in COMPILED_PATTERNS[lang]:
+        match = pattern.search(text)
         if match:
+            # Offsets on the original text: the casing typed by the user is kept
             name = match.group(1).strip()
             if len(name) >= 2:
-                # Capitalize correctly
-                name = clean_name(name)
+                name = clean_name(name, keep_case=True)
                 logger.info(f"✅ Name extracted via regex: {name} (lang: {lang})")
                 return name
     
     return None
 
 def extract_name(text: str, ctx) -> Optional[str]:
-    """Extract name from text using regex first, then LLM fallback."""
+    """Extract name from text using regex first, then LLM fallback (once per phone + message)."""
     if not text or len(text.strip()) < 2:
         return None
     
-    # Try regex first
-    name = extract_name_regex(text, ctx.lang)
-    if name:
-        return name
+    # Same turn (orchestrator, executor, ask_name): one extraction. The candidate
+    # languages are part of the key, so a language detected mid-turn re-extracts
+    langs = candidate_langs(text, ctx.lang)
+    cache = get_cache("names")
+    key = (getattr(ctx, "phone", None), text, tuple(langs))
+    cached = cache.get(key, _MISSING)
+    if cached is not _MISSING:
+        return cached
     
-    return None
+    # Try regex first, for the languages written in the message's script
+    name = None
+    for lang in langs:
+        name = extract_name_regex(text, lang)
+        if name:
+            break
+    
+    cache.set(key, name)
+    return name
 
-def clean_name(name: str) -> str:
-    """Clean and normalize extracted name."""
+def clean_name(name: str, keep_case: bool = False) -> str:
+    """Clean and normalize extracted name (keep_case: words with internal capitals stay as typed)."""
     if not name:
         return ""
     
     # Remove numbers first
-    name = re.sub(r'[0-9]', '', name)
+    name = _DIGITS.sub('', name)
     
     # Advanced cleaning: replace special characters with spaces to preserve word boundaries
     # This ensures "Mario@Rossi" becomes "Mario Rossi" instead of "Mariorossi"
-    name = re.sub(r'[^a-zA-ZÀ-ÿ\u0600-\u06FF\u0900-\u097F\u0980-\u09FF\s\'-]', ' ', name, flags=re.UNICODE)
+    name = _INVALID.sub(' ', name)
     
     # Normalize spaces (multiple spaces become single space)
-    name = re.sub(r'\s+', ' ', name.strip())
+    name = _SPACES.sub(' ', name.strip())
+    if keep_case:
+        return " ".join(_word_case(word) for word in name.split(' '))
     name = name.title()
     
     return name
+
+def _word_case(word: str) -> str:
+    """Internal capitals ("McDonald", "DiCaprio") kept as typed, any other word title-cased"""
+    if not word.isupper() and any(ch.isupper() for ch in word[1:]):
+        return word
+    return word.title()
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Form, Request
+from fastapi.responses import JSONResponse
 from twilio.rest import Client
 from twilio.twiml.messaging_response import MessagingResponse
 import os
@@ -11,8 +12,10 @@ from sofia_lite.agents.orchestrator import Orchestrator
 # from sofia_lite.middleware.loop_guard import LoopGuard  # Removed - not implemented
 from sofia_lite.skills import dispatch
 from sofia_lite.agents.context import Context
-from sofia_lite.middleware.memory import load_context, save_context
+from sofia_lite.middleware.memory import aload_context, save_context
 from sofia_lite.middleware import voice_transcript
+from sofia_lite.middleware.ordering import get_message_dedup
+from sofia_lite.middleware.workers import run_blocking
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -41,6 +44,11 @@ def handle_incoming(phone: str, text: str, channel: str = "text"):
     result = orchestrator.process_message(phone, text, channel)
     return result["reply"]
 
+async def ahandle_incoming(phone: str, text: str, channel: str = "text"):
+    """Async unified handler: the orchestrator never blocks the event loop"""
+    result = await orchestrator.aprocess_message(phone, text, channel)
+    return result["reply"]
+
 @router.post("/webhook")
 async def whatsapp_webhook(
     request: Request,
@@ -49,7 +57,8 @@ async def whatsapp_webhook(
     To: str = Form(...),
     MediaUrl0: str = Form(None),
     NumMedia: str = Form("0"),
-    MediaContentType0: str = Form(None)
+    MediaContentType0: str = Form(None),
+    MessageSid: str = Form(None)
 ):
     """WhatsApp webhook handler - F22 support for voice notes"""
     
@@ -64,46 +73,125 @@ async def whatsapp_webhook(
         # Extract phone number
         phone = From.replace("whatsapp:", "")
         
-        # Load context for language hint
-        ctx = load_context(phone) or Context(phone)
+        # Twilio retries on timeout: a redelivered MessageSid is not processed/sent again
+        response_data, duplicate = await get_message_dedup().run_once(
+            MessageSid,
+            lambda: _handle_whatsapp(phone, Body, MediaUrl0, NumMedia, MediaContentType0)
+        )
+        if duplicate:
+            return response_data or {"status": "duplicate", "message_sid": MessageSid}
+        return response_data
         
-        # Handle media (voice notes or payment receipt)
-        if NumMedia and int(NumMedia) > 0 and MediaUrl0:
-            media_type = MediaContentType0
-            
-            if media_type and media_type.startswith("audio/"):
-                # F22: Handle voice notes
-                logger.info(f"🎤 Processing voice note: {MediaUrl0}")
-                try:
-                    # Usa lingua già stimata, se disponibile
-                    lang_hint = ctx.lang if ctx.lang and ctx.lang != "unknown" else None
-                    user_msg = voice_transcript.transcribe_voice(MediaUrl0, lang_hint)
-                    logger.info(f"✅ Voice transcription: '{user_msg[:50]}...'")
-                except Exception as e:
-                    logger.error(f"❌ Voice transcription failed: {e}")
-                    user_msg = "Mi dispiace, non sono riuscito a trascrivere l'audio. Puoi scrivere il messaggio?"
-            else:
-                # Handle image (payment receipt)
-                logger.info(f"📸 Processing image: {MediaUrl0}")
-                ctx.slots["payment_image_url"] = MediaUrl0
-                save_context(ctx)
-                user_msg = "image"
+    except Exception as e:
+        logger.error(f"❌ Error in WhatsApp webhook: {e}")
+        # 5xx: Twilio redelivers the message (the MessageSid claim was released)
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+async def _handle_whatsapp(phone: str, Body, MediaUrl0, NumMedia, MediaContentType0):
+    # Handle media (voice notes or payment receipt)
+    if NumMedia and int(NumMedia) > 0 and MediaUrl0:
+        media_type = MediaContentType0
+        # Context only for the language hint / receipt slot; the orchestrator
+        # reloads it from the hot context cache, not from Firestore
+        ctx = await aload_context(phone) or Context(phone)
+        
+        if media_type and media_type.startswith("audio/"):
+            # F22: Handle voice notes
+            logger.info(f"🎤 Processing voice note: {MediaUrl0}")
+            try:
+                # Usa lingua già stimata, se disponibile
+                lang_hint = ctx.lang if ctx.lang and ctx.lang != "unknown" else None
+                user_msg = await run_blocking(voice_transcript.transcribe_voice, MediaUrl0, lang_hint)
+                logger.info(f"✅ Voice transcription: '{user_msg[:50]}...'")
+            except Exception as e:
+                logger.error(f"❌ Voice transcription failed: {e}")
+                user_msg = "Mi dispiace, non sono riuscito a trascrivere l'audio. Puoi scrivere il messaggio?"
         else:
-            # Handle text message
-            user_msg = Body or ""
+            # Handle image (payment receipt)
+            logger.info(f"📸 Processing image: {MediaUrl0}")
+            ctx.slots["payment_image_url"] = MediaUrl0
+            await run_blocking(save_context, ctx)
+            user_msg = "image"
+    else:
+        # Handle text message
+        user_msg = Body or ""
+    
+    # Process message through orchestrator
+    reply = await ahandle_incoming(phone, user_msg, "whatsapp")
+    
+    # Send response
+    response_data = await _asend_whatsapp_message(phone, reply)
+    
+    logger.info(f"✅ WhatsApp response sent: {response_data}")
+    return response_data
+
+_async_twilio_client = None
+
+def _get_async_twilio_client():
+    """Twilio client backed by aiohttp (must be created inside the event loop)"""
+    global _async_twilio_client
+    if _async_twilio_client is None and twilio_client is not None:
+        try:
+            from twilio.http.async_http_client import AsyncTwilioHttpClient
+            _async_twilio_client = Client(
+                os.getenv('TWILIO_ACCOUNT_SID'),
+                os.getenv('TWILIO_AUTH_TOKEN'),
+                http_client=AsyncTwilioHttpClient()
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Async Twilio client unavailable: {e}")
+    return _async_twilio_client
+
+async def aclose_twilio_client():
+    """Close the aiohttp session of the async Twilio client (lifespan shutdown)"""
+    global _async_twilio_client
+    async_client, _async_twilio_client = _async_twilio_client, None
+    if async_client is None:
+        return
+    try:
+        await async_client.http_client.close()
+        logger.info("🔒 Async Twilio client closed")
+    except Exception as e:
+        logger.warning(f"⚠️ Async Twilio client close failed: {e}")
+
+async def _asend_whatsapp_message(to_number: str, message: str):
+    """Send WhatsApp message via Twilio without blocking the event loop"""
+    
+    async_client = _get_async_twilio_client()
+    if async_client is None:
+        # No native async client: run the sync sender on the shared pool
+        response_data = await run_blocking(_send_whatsapp_message, to_number, message)
+        if response_data["status"] == "error":
+            raise RuntimeError(response_data["message"])
+        return response_data
+    
+    try:
+        formatted_number = f"whatsapp:{to_number}"
+        from_number = os.getenv('TWILIO_WHATSAPP_NUMBER', '+18149149892')
         
-        # Process message through orchestrator
-        reply = handle_incoming(phone, user_msg, "whatsapp")
+        message_obj = await async_client.messages.create_async(
+            body=message,
+            from_=f"whatsapp:{from_number}",
+            to=formatted_number
+        )
         
-        # Send response
-        response_data = _send_whatsapp_message(phone, reply)
+        logger.info(f"✅ WhatsApp message sent: {message_obj.sid}")
         
-        logger.info(f"✅ WhatsApp response sent: {response_data}")
-        return response_data
+        return {
+            "status": "sent",
+            "reply": message,
+            "method": "whatsapp",
+            "message": "Messaggio inviato con successo",
+            "sid": message_obj.sid,
+            "original_number": to_number,
+            "formatted_number": formatted_number
+        }
         
     except Exception as e:
-        logger.error(f"❌ Error in WhatsApp webhook: {e}")
-        return {"status": "error", "message": str(e)}
+        # Raised, not returned: a failed send must not be cached as the answer
+        # to this MessageSid, so Twilio's redelivery sends it again
+        logger.error(f"❌ Error sending WhatsApp message: {e}")
+        raise
 
 def _send_whatsapp_message(to_number: str, message: str):
     """Send WhatsApp message via Twilio"""
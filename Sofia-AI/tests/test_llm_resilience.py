@@ -79,5 +79,81 @@ def test_cb_closes_after_timeout():
     # Verifica che il circuit breaker sia chiuso e funzioni
     assert result == "Success response"
 
+def test_template_chat_slots_name_after_cache_hit(monkeypatch):
+    """Test che la reply cache è condivisa tra utenti e reinserisce il nome"""
+    from sofia_lite.agents.context import Context
+    from sofia_lite.utils.memo import get_cache
+    
+    calls = []
+    def success(sys_prompt, user_prompt):
+        calls.append(user_prompt)
+        return f"Piacere {user_prompt}! Che servizio ti serve?"
+    
+    monkeypatch.setattr(llm, "_raw_chat", success)
+    llm._CIRCUIT["fail"] = 0
+    llm._CIRCUIT["open_until"] = 0
+    get_cache("reply").clear()
+    
+    first = llm.template_chat("TEST/name", Context(phone="1", lang="it", name="Marco", state="ASK_SERVICE"), "sys", "Marco")
+    second = llm.template_chat("TEST/name", Context(phone="2", lang="it", name="Aisha", state="ASK_SERVICE"), "sys", "Aisha")
+    english = llm.template_chat("TEST/name", Context(phone="3", lang="en", name="John", state="ASK_SERVICE"), "sys", "John")
+    
+    assert first == "Piacere Marco! Che servizio ti serve?"
+    assert second == "Piacere Aisha! Che servizio ti serve?"
+    assert english == "Piacere John! Che servizio ti serve?"
+    assert calls == ["Marco", "John"]  # una chiamata per lingua
+
+def test_template_chat_slots_whole_words_only(monkeypatch):
+    """Test che il nome dentro altre parole ("Alle", "Sarajevo") non viene sostituito"""
+    from sofia_lite.agents.context import Context
+    from sofia_lite.utils.memo import get_cache
+    
+    monkeypatch.setattr(llm, "_raw_chat", lambda sys_prompt, user_prompt: f"Grazie {user_prompt}! Alle 10 o alle 15? Sarajevo o Milano?")
+    llm._CIRCUIT["fail"] = 0
+    llm._CIRCUIT["open_until"] = 0
+    get_cache("reply").clear()
+    
+    llm.template_chat("TEST/word", Context(phone="1", lang="it", name="Sara", state="ASK_SLOT"), "sys", "Sara")
+    other = llm.template_chat("TEST/word", Context(phone="2", lang="it", name="Marco", state="ASK_SLOT"), "sys", "Marco")
+    assert other == "Grazie Marco! Alle 10 o alle 15? Sarajevo o Milano?"
+    
+    # Nome corto che coincide con parole comuni: la risposta non entra in cache
+    get_cache("reply").clear()
+    llm.template_chat("TEST/short", Context(phone="3", lang="it", name="Al", state="ASK_SLOT"), "sys", "Al")
+    assert len(get_cache("reply")) == 0
+
+def test_template_chat_skips_cache_with_summary(monkeypatch):
+    """Test che una risposta personalizzata dal riassunto non passa a un altro utente"""
+    from sofia_lite.agents.context import Context
+    from sofia_lite.utils.memo import get_cache
+    
+    monkeypatch.setattr(llm, "_raw_chat", lambda sys_prompt, user_prompt: f"Risposta per: {sys_prompt}")
+    llm._CIRCUIT["fail"] = 0
+    llm._CIRCUIT["open_until"] = 0
+    get_cache("reply").clear()
+    
+    alice = Context(phone="1", lang="it", state="ASK_SERVICE", summary="Rinnovo permesso, scade a maggio")
+    bob = Context(phone="2", lang="it", state="ASK_SERVICE", summary="Cittadinanza per matrimonio")
+    first = llm.template_chat("TEST/summary", alice, "sys: rinnovo permesso", "Ciao")
+    second = llm.template_chat("TEST/summary", bob, "sys: cittadinanza", "Ciao")
+    
+    assert first == "Risposta per: sys: rinnovo permesso"
+    assert second == "Risposta per: sys: cittadinanza"
+    assert len(get_cache("reply")) == 0
+
+def test_template_chat_does_not_cache_fallback(monkeypatch):
+    """Test che le risposte di fallback non finiscono nella reply cache"""
+    from sofia_lite.agents.context import Context
+    from sofia_lite.utils.memo import get_cache
+    
+    get_cache("reply").clear()
+    llm._CIRCUIT["open_until"] = time.time() + 60
+    ctx = Context(phone="1", lang="it", state="GREETING")
+    
+    llm.template_chat("TEST/fallback", ctx, "sys", "Ciao")
+    
+    assert len(get_cache("reply")) == 0
+    llm._CIRCUIT["open_until"] = 0
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"]) 
\ No newline at end of file
@@ -14,20 +14,24 @@ import os
 from unittest.mock import patch, MagicMock, mock_open
 from sofia_lite.middleware import voice_transcript
 from sofia_lite.whatsapp import handle_incoming
+from sofia_lite.utils.memo import get_cache
 
 class TestVoiceNotes:
     """Test per la funzionalità voice notes"""
     
-    @patch('requests.get')
-    @patch('openai.OpenAI')
-    def test_transcribe_voice_success(self, mock_openai, mock_requests):
+    def setup_method(self):
+        get_cache("transcript").clear()
+    
+    @patch('sofia_lite.middleware.voice_transcript._get_http_session')
+    @patch('sofia_lite.middleware.voice_transcript.get_openai_client')
+    def test_transcribe_voice_success(self, mock_openai, mock_session):
         """Test trascrizione voice note con successo"""
         
-        # Mock response per download audio
+        # Mock response per download audio (streaming a chunk)
         mock_response = MagicMock()
-        mock_response.content = b'fake_ogg_audio_content'
+        mock_response.iter_content.return_value = [b'OggS', b'fake_ogg_audio_content']
         mock_response.raise_for_status.return_value = None
-        mock_requests.return_value = mock_response
+        mock_session.return_value.get.return_value.__enter__.return_value = mock_response
         
         # Mock OpenAI client
         mock_client = MagicMock()
@@ -36,37 +40,39 @@ class TestVoiceNotes:
         mock_client.audio.transcriptions.create.return_value = mock_transcription
         mock_openai.return_value = mock_client
         
-        # Test trascrizione
+        # Test trascrizione: niente file temporanei
         with patch('tempfile.NamedTemporaryFile') as mock_temp:
-            mock_temp.return_value.__enter__.return_value.name = "/tmp/test.wav"
-            mock_temp.return_value.__enter__.return_value.flush.return_value = None
-            
             result = voice_transcript.transcribe_voice("https://example.com/audio.ogg", "it")
             
             assert result == "Ciao, mi chiamo Mario Rossi"
-            mock_requests.assert_called_once_with("https://example.com/audio.ogg", timeout=10)
+            mock_session.return_value.get.assert_called_once_with("https://example.com/audio.ogg", timeout=10, stream=True)
             mock_client.audio.transcriptions.create.assert_called_once()
+            mock_temp.assert_not_called()
+            
+            # OGG/Opus inviato a Whisper senza conversione
+            file_arg = mock_client.audio.transcriptions.create.call_args[1]["file"]
+            assert file_arg == ("audio.ogg", b'OggSfake_ogg_audio_content', "audio/ogg")
     
-    @patch('requests.get')
-    def test_transcribe_voice_download_failure(self, mock_requests):
+    @patch('sofia_lite.middleware.voice_transcript._get_http_session')
+    def test_transcribe_voice_download_failure(self, mock_session):
         """Test fallimento download audio"""
         
         # Mock request exception
-        mock_requests.side_effect = Exception("Download failed")
+        mock_session.return_value.get.side_effect = Exception("Download failed")
         
         with pytest.raises(Exception):
             voice_transcript.transcribe_voice("https://example.com/audio.ogg")
     
-    @patch('requests.get')
-    @patch('openai.OpenAI')
-    def test_transcribe_voice_with_language_hint(self, mock_openai, mock_requests):
+    @patch('sofia_lite.middleware.voice_transcript._get_http_session')
+    @patch('sofia_lite.middleware.voice_transcript.get_openai_client')
+    def test_transcribe_voice_with_language_hint(self, mock_openai, mock_session):
         """Test trascrizione con suggerimento lingua"""
         
         # Mock response
         mock_response = MagicMock()
-        mock_response.content = b'fake_ogg_audio_content'
+        mock_response.iter_content.return_value = [b'OggS' + b'fake_ogg_audio_content']
         mock_response.raise_for_status.return_value = None
-        mock_requests.return_value = mock_response
+        mock_session.return_value.get.return_value.__enter__.return_value = mock_response
         
         # Mock OpenAI
         mock_client = MagicMock()
@@ -76,17 +82,53 @@ class TestVoiceNotes:
         mock_openai.return_value = mock_client
         
         # Test con language hint
-        with patch('tempfile.NamedTemporaryFile') as mock_temp:
-            mock_temp.return_value.__enter__.return_value.name = "/tmp/test.wav"
-            mock_temp.return_value.__enter__.return_value.flush.return_value = None
-            
-            result = voice_transcript.transcribe_voice("https://example.com/audio.ogg", "fr")
-            
-            assert result == "Bonjour, je m'appelle Pierre"
-            
-            # Verifica che language hint sia stato passato
-            call_args = mock_client.audio.transcriptions.create.call_args
-            assert call_args[1]["language"] == "fr"
+        result = voice_transcript.transcribe_voice("https://example.com/audio.ogg", "fr")
+        
+        assert result == "Bonjour, je m'appelle Pierre"
+        
+        # Verifica che language hint sia stato passato
+        call_args = mock_client.audio.transcriptions.create.call_args
+        assert call_args[1]["language"] == "fr"
+    
+    @patch('sofia_lite.middleware.voice_transcript._get_http_session')
+    @patch('sofia_lite.middleware.voice_transcript.get_openai_client')
+    def test_transcript_cache_by_content(self, mock_openai, mock_session):
+        """Stesso audio + stessa lingua: Whisper chiamato una volta sola"""
+        mock_response = MagicMock()
+        mock_response.iter_content.return_value = [b'OggS' + b'same_voice_note']
+        mock_session.return_value.get.return_value.__enter__.return_value = mock_response
+        mock_client = MagicMock()
+        mock_client.audio.transcriptions.create.return_value = MagicMock(text="Ciao")
+        mock_openai.return_value = mock_client
+        
+        # URL diversi (redelivery Twilio), stesso contenuto
+        assert voice_transcript.transcribe_voice("https://example.com/a.ogg", "it") == "Ciao"
+        assert voice_transcript.transcribe_voice("https://example.com/b.ogg", "it") == "Ciao"
+        assert mock_client.audio.transcriptions.create.call_count == 1
+        
+        # Lingua diversa: nuova trascrizione
+        voice_transcript.transcribe_voice("https://example.com/a.ogg", "en")
+        assert mock_client.audio.transcriptions.create.call_count == 2
+    
+    @patch('sofia_lite.middleware.voice_transcript._get_http_session')
+    @patch('sofia_lite.middleware.voice_transcript.get_openai_client')
+    def test_whisper_retry_does_not_download_again(self, mock_openai, mock_session):
+        """Un errore Whisper ritenta solo la trascrizione, non il download"""
+        import httpx, openai, tenacity
+        mock_response = MagicMock()
+        mock_response.iter_content.return_value = [b'OggS' + b'retry_voice_note']
+        mock_session.return_value.get.return_value.__enter__.return_value = mock_response
+        mock_client = MagicMock()
+        error = openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com"))
+        mock_client.audio.transcriptions.create.side_effect = [error, MagicMock(text="Riprova ok")]
+        mock_openai.return_value = mock_client
+        
+        with patch.object(voice_transcript._whisper.retry, "wait", tenacity.wait_none()):
+            result = voice_transcript.transcribe_voice("https://example.com/audio.ogg", "it")
+        
+        assert result == "Riprova ok"
+        assert mock_client.audio.transcriptions.create.call_count == 2
+        mock_session.return_value.get.assert_called_once()
     
     def test_detect_audio_format(self):
         """Test rilevamento formato audio"""
@@ -102,6 +144,11 @@ class TestVoiceNotes:
         # Test WAV format
         wav_bytes = b'RIFF' + b'x' * 100
         assert voice_transcript.detect_audio_format(wav_bytes) == "wav"
+        
+        # Test M4A (container MP4) e formato sconosciuto
+        m4a_bytes = b'\x00\x00\x00\x20ftypM4A ' + b'x' * 100
+        assert voice_transcript.detect_audio_format(m4a_bytes) == "m4a"
+        assert voice_transcript.detect_audio_format(b'xxxx' * 10) == "unknown"
     
     @patch('sofia_lite.middleware.voice_transcript.transcribe_voice')
     @patch('sofia_lite.agents.orchestrator.Orchestrator.process_message')
@@ -137,16 +184,16 @@ class TestVoiceNotes:
         assert "trascrivere" in fallback_msg
         assert "audio" in fallback_msg
     
-    @patch('requests.get')
-    @patch('openai.OpenAI')
-    def test_transcribe_voice_with_fallback(self, mock_openai, mock_requests):
+    @patch('sofia_lite.middleware.voice_transcript._get_http_session')
+    @patch('sofia_lite.middleware.voice_transcript.get_openai_client')
+    def test_transcribe_voice_with_fallback(self, mock_openai, mock_session):
         """Test trascrizione con fallback per diversi formati"""
         
         # Mock response
         mock_response = MagicMock()
-        mock_response.content = b'fake_mp3_audio_content'
+        mock_response.iter_content.return_value = [b'ID3' + b'fake_mp3_audio_content']
         mock_response.raise_for_status.return_value = None
-        mock_requests.return_value = mock_response
+        mock_session.return_value.get.return_value.__enter__.return_value = mock_response
         
         # Mock OpenAI
         mock_client = MagicMock()
@@ -156,14 +203,11 @@ class TestVoiceNotes:
         mock_openai.return_value = mock_client
         
         # Test trascrizione con fallback
-        with patch('tempfile.NamedTemporaryFile') as mock_temp:
-            mock_temp.return_value.__enter__.return_value.name = "/tmp/test.wav"
-            mock_temp.return_value.__enter__.return_value.flush.return_value = None
-            
-            result = voice_transcript.transcribe_voice_with_fallback("https://example.com/audio.mp3", "en")
-            
-            assert result == "Hello, this is a test message"
-            mock_client.audio.transcriptions.create.assert_called_once()
+        result = voice_transcript.transcribe_voice_with_fallback("https://example.com/audio.mp3", "en")
+        
+        assert result == "Hello, this is a test message"
+        mock_client.audio.transcriptions.create.assert_called_once()
+        assert mock_client.audio.transcriptions.create.call_args[1]["file"][0] == "audio.mp3"
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"]) 
\ No newline at end of file
@@ -3,67 +3,108 @@ Sofia Lite - Multilingual Abuse Guardrails
 Protects Sofia from abusive and inappropriate content in 9 languages.
 """
 
-import re
+import glob
+import json
 import logging
-from typing import Dict, List
+import os
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional
 
 logger = logging.getLogger(__name__)
 
-# Pattern regex per abusi in 9 lingue
-ABUSE_PATTERNS = [
-    # Italiano
-    r"\bvaffa\b", r"\bporco\b", r"\bstronzo\b", r"\bcazzo\b", r"\bmerda\b",
-    r"\bputtana\b", r"\btroia\b", r"\bfiga\b", r"\bscopare\b", r"\bscopata\b",
-    
-    # Inglese
-    r"\bfuck\b", r"\bshit\b", r"\bbitch\b", r"\bcunt\b", r"\bdick\b",
-    r"\bpussy\b", r"\basshole\b", r"\bbastard\b", r"\bwhore\b", r"\bslut\b",
-    
-    # Francese
-    r"\bmerde\b", r"\bputain\b", r"\bcon\b", r"\bconnard\b", r"\bsalope\b",
-    r"\bpute\b", r"\bchier\b", r"\bcul\b", r"\bnique\b", r"\bta mère\b",
-    
-    # Spagnolo
-    r"\bputa\b", r"\bcoño\b", r"\bcabrón\b", r"\bhijo de puta\b", r"\bcarajo\b",
-    r"\bmierda\b", r"\bmalparido\b", r"\bmaricón\b", r"\bperra\b", r"\bzorra\b",
-    
-    # Arabo
-    r"كلب", r"زبالة", r"عرص", r"شرموطة", r"عرص", r"زبي", r"كس", r"طيز",
-    
-    # Hindi
-    r"चूतिया", r"मादरचोद", r"भेंचोद", r"हरामी", r"बहनचोद", r"मादरजात",
-    
-    # Urdu
-    r"حرامی", r"کتیا", r"چوتیا", r"مادرجھٹ", r"بہنچوٹ", r"حرامزادہ",
-    
-    # Bengali
-    r"মাদারচোদ", r"বোনচোদ", r"চুটিয়া", r"হারামি", r"বেশ্যা", r"পুত",
-    
-    # Wolof
-    r"\bndaw\b", r"\bgor\b", r"\bmbool\b", r"\bjaay\b", r"\bjaaykat\b",
-]
-
-# Pattern per minacce e violenza
-THREAT_PATTERNS = [
-    r"\bammazzare\b", r"\buccidere\b", r"\bkill\b", r"\bmurder\b", r"\btuer\b",
-    r"\bmatar\b", r"\bقتل\b", r"\bमारना\b", r"\bقتل\b", r"\bহত্যা\b",
-    r"\bviolence\b", r"\bviolenza\b", r"\bviolence\b", r"\bviolencia\b",
-]
-
-# Pattern per spam e contenuti commerciali
-SPAM_PATTERNS = [
-    r"\bcompra ora\b", r"\bbuy now\b", r"\bachetez maintenant\b", r"\bcomprar ahora\b",
-    r"\bclick here\b", r"\bclicca qui\b", r"\bcliquez ici\b", r"\bhaz clic aquí\b",
-    r"\bwww\.", r"\bhttp://", r"\bhttps://", r"\b\.com\b", r"\b\.it\b",
-    r"\bprezzo speciale\b", r"\bspecial price\b", r"\bprix spécial\b", r"\bprecio especial\b",
-]
-
-# Pattern per contenuti sessuali inappropriati
-SEXUAL_PATTERNS = [
-    r"\bporno\b", r"\bporn\b", r"\bpornographie\b", r"\bpornografía\b",
-    r"\bsexy\b", r"\bnudo\b", r"\bnude\b", r"\bnue\b", r"\bdesnudo\b",
-    r"\bsex\b", r"\bsesso\b", r"\bsexe\b", r"\bsexo\b",
-]
+# Lessici per lingua in config/guardrails/<lang>.json (versionati): "terms"
+# con confini di parola, "substrings" ovunque nel testo. Tutte le categorie
+# compilate in un'unica regex a trie, un solo passaggio per messaggio.
+LEXICON_DIR = os.getenv(
+    "SOFIA_GUARDRAILS_DIR",
+    os.path.join(os.path.dirname(__file__), '..', 'config', 'guardrails'),
+)
+
+def _trie_pattern(terms: Iterable[str]) -> str:
+    """Alternation factored on common prefixes: matching walks a trie, not the list"""
+    trie: Dict[str, dict] = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def walk(node: dict) -> str:
+        branches = [re.escape(ch) + walk(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # A term ends here: the longer continuations are optional
+            body = "(?:" + body + ")?"
+        return body
+
+    return walk(trie)
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+class GuardrailEngine:
+    """All lexicons compiled into one regex with a named group per category"""
+
+    def __init__(self, lexicons: Iterable[dict]):
+        # category → {(leading \b, trailing \b): terms}
+        buckets: Dict[str, Dict[tuple, set]] = {}
+        self.versions: Dict[str, int] = {}
+        for lexicon in lexicons:
+            self.versions[lexicon.get("lang", "?")] = lexicon.get("version", 0)
+            for mode in ("terms", "substrings"):
+                for category, terms in lexicon.get(mode, {}).items():
+                    for term in terms:
+                        term = term.lower().strip()
+                        if not term:
+                            continue
+                        # Word-bounded terms get \b only on sides that are word characters
+                        bounded = mode == "terms"
+                        key = (bounded and _is_word_char(term[0]), bounded and _is_word_char(term[-1]))
+                        buckets.setdefault(category, {}).setdefault(key, set()).add(term)
+
+        self.categories: List[str] = list(buckets)
+        groups = []
+        for category, by_boundary in buckets.items():
+            parts = []
+            for (lead, trail), terms in sorted(by_boundary.items()):
+                parts.append(("\\b" if lead else "") + _trie_pattern(terms) + ("\\b" if trail else ""))
+            groups.append(f"(?P<{category}>" + "|".join(parts) + ")")
+        self.pattern = re.compile("|".join(groups)) if groups else None
+
+    def scan(self, text: str) -> FrozenSet[str]:
+        """Every category matched by the text, in a single pass"""
+        if not text or len(text.strip()) < 2 or self.pattern is None:
+            return frozenset()
+        return frozenset(m.lastgroup for m in self.pattern.finditer(text.lower().strip()))
+
+def load_lexicons(directory: str = LEXICON_DIR) -> List[dict]:
+    """Load every <lang>.json lexicon from the guardrails config directory"""
+    lexicons = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lexicons.append(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"❌ Guardrail lexicon {path} not loaded: {e}")
+    if not lexicons:
+        logger.error(f"❌ No guardrail lexicons found in {directory}")
+    return lexicons
+
+_engine: Optional[GuardrailEngine] = None
+
+def get_guardrails() -> GuardrailEngine:
+    """Compiled guardrail engine (lexicons loaded on first use)"""
+    global _engine
+    if _engine is None:
+        _engine = GuardrailEngine(load_lexicons())
+        logger.info(f"🛡️ Guardrails compiled: {_engine.versions}")
+    return _engine
+
+def scan(text: str) -> FrozenSet[str]:
+    """Categories (abuse, threat, spam, sexual) found in text"""
+    return get_guardrails().scan(text)
 
 def is_abusive(text: str) -> bool:
     """
@@ -75,17 +116,9 @@ def is_abusive(text: str) -> bool:
     Returns:
         True se il testo è abusivo, False altrimenti
     """
-    if not text or len(text.strip()) < 2:
-        return False
-    
-    text_lower = text.lower().strip()
-    
-    # Controlla pattern di abuso
-    for pattern in ABUSE_PATTERNS:
-        if re.search(pattern, text_lower, re.IGNORECASE):
-            logger.warning(f"🚫 Abusive content detected: {text[:50]}...")
-            return True
-    
+    if "abuse" in scan(text):
+        logger.warning(f"🚫 Abusive content detected: {text[:50]}...")
+        return True
     return False
 
 def is_threatening(text: str) -> bool:
@@ -98,16 +131,9 @@ def is_threatening(text: str) -> bool:
     Returns:
         True se il testo contiene minacce, False altrimenti
     """
-    if not text or len(text.strip()) < 2:
-        return False
-    
-    text_lower = text.lower().strip()
-    
-    for pattern in THREAT_PATTERNS:
-        if re.search(pattern, text_lower, re.IGNORECASE):
-            logger.warning(f"⚠️ Threatening content detected: {text[:50]}...")
-            return True
-    
+    if "threat" in scan(text):
+        logger.warning(f"⚠️ Threatening content detected: {text[:50]}...")
+        return True
     return False
 
 def is_spam(text: str) -> bool:
@@ -120,16 +146,9 @@ def is_spam(text: str) -> bool:
     Returns:
         True se il testo è spam, False altrimenti
     """
-    if not text or len(text.strip()) < 2:
-        return False
-    
-    text_lower = text.lower().strip()
-    
-    for pattern in SPAM_PATTERNS:
-        if re.search(pattern, text_lower, re.IGNORECASE):
-            logger.warning(f"📧 Spam content detected: {text[:50]}...")
-            return True
-    
+    if "spam" in scan(text):
+        logger.warning(f"📧 Spam content detected: {text[:50]}...")
+        return True
     return False
 
 def is_sexual_inappropriate(text: str) -> bool:
@@ -142,21 +161,15 @@ def is_sexual_inappropriate(text: str) -> bool:
     Returns:
         True se il testo contiene contenuti inappropriati, False altrimenti
     """
-    if not text or len(text.strip()) < 2:
-        return False
-    
-    text_lower = text.lower().strip()
-    
-    for pattern in SEXUAL_PATTERNS:
-        if re.search(pattern, text_lower, re.IGNORECASE):
-            logger.warning(f"🔞 Inappropriate content detected: {text[:50]}...")
-            return True
-    
+    if "sexual" in scan(text):
+        logger.warning(f"🔞 Inappropriate content detected: {text[:50]}...")
+        return True
     return False
 
 def is_inappropriate(text: str) -> bool:
     """
-    Verifica generale se il testo è inappropriato.
+    Verifica generale se il testo è inappropriato (un solo passaggio per
+    tutte le categorie).
     
     Args:
         text: Testo da verificare
@@ -164,10 +177,11 @@ def is_inappropriate(text: str) -> bool:
     Returns:
         True se il testo è inappropriato, False altrimenti
     """
-    return (is_abusive(text) or 
-            is_threatening(text) or 
-            is_spam(text) or 
-            is_sexual_inappropriate(text))
+    categories = scan(text)
+    if categories:
+        logger.warning(f"🚫 Inappropriate content ({', '.join(sorted(categories))}): {text[:50]}...")
+        return True
+    return False
 
 def abuse_reply(lang: str) -> str:
     """
@@ -217,6 +231,9 @@ def warning_reply(lang: str) -> str:
     
     return warning_messages.get(lang, warning_messages["en"])
 
+# Priorità quando più categorie corrispondono
+_ABUSE_TYPES = [("abuse", "abusive"), ("threat", "threatening"), ("spam", "spam"), ("sexual", "sexual")]
+
 def get_abuse_type(text: str) -> str:
     """
     Determina il tipo di abuso nel testo.
@@ -227,13 +244,8 @@ def get_abuse_type(text: str) -> str:
     Returns:
         Tipo di abuso: "abusive", "threatening", "spam", "sexual", "none"
     """
-    if is_abusive(text):
-        return "abusive"
-    elif is_threatening(text):
-        return "threatening"
-    elif is_spam(text):
-        return "spam"
-    elif is_sexual_inappropriate(text):
-        return "sexual"
-    else:
-        return "none" 
\ No newline at end of file
+    categories = scan(text)
+    for category, abuse_type in _ABUSE_TYPES:
+        if category in categories:
+            return abuse_type
+    return "none"
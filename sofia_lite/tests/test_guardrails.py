@@ -8,7 +8,8 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
 from sofia_lite.policy.guardrails import (
     is_abusive, is_threatening, is_spam, is_sexual_inappropriate, 
-    is_inappropriate, abuse_reply, warning_reply, get_abuse_type
+    is_inappropriate, abuse_reply, warning_reply, get_abuse_type,
+    scan, get_guardrails, GuardrailEngine
 )
 from sofia_lite.agents.executor import dispatch
 from sofia_lite.agents.context import Context
@@ -208,5 +209,26 @@ def test_edge_cases():
     special_text = "v@ff@"
     assert not is_inappropriate(special_text), "Text with special chars should not be inappropriate"
 
+def test_single_scan_returns_every_category():
+    """Un solo passaggio restituisce tutte le categorie presenti"""
+    assert scan("vaffa, buy now su www.example.com") == {"abuse", "spam"}
+    assert scan("porno e violenza") == {"sexual", "threat"}
+    assert scan("ciao come stai?") == frozenset()
+
+def test_lexicons_loaded_with_versions():
+    """Lessici per lingua caricati da config/guardrails con versione"""
+    versions = get_guardrails().versions
+    for lang in ["it", "en", "fr", "es", "ar", "hi", "ur", "bn", "wo"]:
+        assert versions.get(lang, 0) >= 1, f"Missing lexicon for {lang}"
+
+def test_engine_word_and_substring_terms():
+    """terms con confini di parola, substrings ovunque"""
+    engine = GuardrailEngine([{"lang": "xx", "version": 1,
+                               "terms": {"abuse": ["con", "connard"]},
+                               "substrings": {"spam": ["promo"]}}])
+    assert engine.scan("quel con") == {"abuse"}
+    assert engine.scan("connu") == frozenset()
+    assert engine.scan("superpromozione") == {"spam"}
+
 if __name__ == "__main__":
     pytest.main([__file__]) 
\ No newline at end of file